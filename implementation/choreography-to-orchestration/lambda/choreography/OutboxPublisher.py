@@ -0,0 +1,32 @@
+import logging
+from collections import OrderedDict
+
+import instrumentation
+import lambda_runtime
+import sns_batch
+import sqs_batch
+from order_state import outbox_message
+
+logger = lambda_runtime.get_logger()
+
+# publishes the outbox entries written by ProcessPayment (PUBLISH_MODE outbox) from the stream of the order table.
+# the entries of a batch are published per topic with PublishBatch, a failed entry is reported back by its
+# sequence number (ReportBatchItemFailures) and the stream retries the batch from there
+@instrumentation.handler('OutboxPublisher')
+def lambda_handler(event, context):
+    instrumentation.log_payload(logger, 'Received event: ', event)
+    topics = OrderedDict()
+    with instrumentation.span('parse'):
+        for record in event['Records']:
+            entry = outbox_message(record)
+            if entry is not None:
+                topic_arn, message = entry
+                topics.setdefault(topic_arn, []).append((record['dynamodb']['SequenceNumber'], message))
+
+    failed = []
+    for topic_arn, entries in topics.items():
+        with instrumentation.span('sns.publish_batch'):
+            failed.extend(entries[index][0] for index in sns_batch.publish(topic_arn, [message for _, message in entries]))
+    logging.info("published %d outbox entries, %d failed", sum(len(entries) for entries in topics.values()), len(failed))
+    # the stream retries from the first failed record, later records of the shard are published again
+    return sqs_batch.batch_item_failures(sorted(failed, key=int)[:1])
@@ -1,31 +1,50 @@
-import boto3
-from botocore.config import Config
 import json
 import os
-import uuid
+
+import instrumentation
+import lambda_runtime
+from order_state import dynamodb, outbox_entry
+
+logger = lambda_runtime.get_logger()
 
 TABLE_NAME = os.environ['table_name']
 SNS_TOPIC_ARN = os.environ['sns_topic_arn']
-config = Config(connect_timeout=5, read_timeout=5, retries={'max_attempts': 1})
-dynamodb = boto3.client('dynamodb', config=config)
-sns = boto3.client('sns')
+# direct: the order is written and published by the handler. outbox: the order and an outbox entry are
+# written in one transaction, the outbox publisher publishes the entry from the table stream
+PUBLISH_MODE = os.getenv('PUBLISH_MODE', 'direct')
+
+def sns():
+    return lambda_runtime.client('sns')
 
+@instrumentation.handler('ProcessPayment')
 def lambda_handler(event, context):
     request = json.loads(event['body'])
-    
-    dynamodb_response = dynamodb.put_item(
-        TableName = TABLE_NAME, 
-        Item = {
-            'product_id': {'S': str(request['product_id'])},
-            'Payment_processed' : {'BOOL': True}
-        }
-    );
-    
-    print('dynamo_response:', dynamodb_response)
-    
-    sns_response = sns.publish(TopicArn=SNS_TOPIC_ARN, MessageStructure= "json", Message=json.dumps({"default": json.dumps({"product_id" : request['product_id']})})) 
-    
-    print('sns_response:', sns_response)
+    order = {
+        'product_id': {'S': str(request['product_id'])},
+        'Payment_processed' : {'BOOL': True}
+    }
+
+    if PUBLISH_MODE == 'outbox':
+        # a single write, SNS is called by the outbox publisher for many orders at once
+        with instrumentation.span('dynamodb.transact_write', product_id=str(request['product_id'])):
+            dynamodb_response = dynamodb().transact_write_items(TransactItems=[
+                {'Put': {'TableName': TABLE_NAME, 'Item': order}},
+                outbox_entry(TABLE_NAME, SNS_TOPIC_ARN, {"product_id": request['product_id']})
+            ])
+        instrumentation.log_payload(logger, 'dynamo_response: ', dynamodb_response)
+    else:
+        with instrumentation.span('dynamodb.put', product_id=str(request['product_id'])):
+            dynamodb_response = dynamodb().put_item(
+                TableName = TABLE_NAME, 
+                Item = order
+            );
+        
+        instrumentation.log_payload(logger, 'dynamo_response: ', dynamodb_response)
+        
+        with instrumentation.span('sns.publish', product_id=str(request['product_id'])):
+            sns_response = sns().publish(TopicArn=SNS_TOPIC_ARN, MessageStructure= "json", Message=json.dumps({"default": json.dumps({"product_id" : request['product_id']})})) 
+        
+        instrumentation.log_payload(logger, 'sns_response: ', sns_response)
     
     return {
         'statusCode': 201,
@@ -1,39 +1,23 @@
-import boto3
-from botocore.config import Config
 import json
 import os
-import uuid
+
+import instrumentation
+import lambda_runtime
+import order_state
+
+logger = lambda_runtime.get_logger()
 
 TABLE_NAME = os.environ['table_name']
-config = Config(connect_timeout=5, read_timeout=5, retries={'max_attempts': 1})
-dynamodb = boto3.client('dynamodb', config=config)
-sns = boto3.client('sns')
 
+@instrumentation.handler('UpdateReward')
 def lambda_handler(event, context):
     
     request = json.loads(event['Records'][0]['Sns']['Message'])
     
-    data = dynamodb.get_item(
-    TableName=TABLE_NAME,
-    Key={
-        'product_id': {
-          'S': str(request['product_id'])
-        }
-    },
-    ProjectionExpression = "Ship_order")
-  
-    ship_order = json.dumps(data['Item']['Ship_order'] ['BOOL'])
-    
-    if(ship_order):
-        dynamodb_response = dynamodb.put_item(
-        TableName = TABLE_NAME, 
-        Item = {
-            'product_id': {'S': str(request['product_id'])},
-            'Payment_processed' : {'BOOL': True},
-            'Ship_order' : {'BOOL': True},
-            'Update_reward' : {'BOOL': True}
-        });
-    else:
-        print(' Error: Ship order error')
+    # updates the reward only if the order was shipped, in a single conditional update.
+    # raises order_state.PrerequisiteNotMet if the order was not shipped
+    with instrumentation.span('dynamodb.update', product_id=str(request['product_id'])):
+        order = order_state.advance(TABLE_NAME, request['product_id'], 'Update_reward', 'Ship_order')
+    instrumentation.log_payload(logger, 'order: ', order)
         
     return
@@ -0,0 +1,68 @@
+import json
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+import lambda_runtime
+
+# outbox entries live in the order table next to the orders, the table stream hands them to the outbox publisher
+OUTBOX_PREFIX = 'OUTBOX#'
+# published entries are not deleted, the TTL of the table removes them a day later
+OUTBOX_TTL_SECONDS = 24 * 60 * 60
+
+
+class PrerequisiteNotMet(Exception):
+    pass
+
+
+# the client is created on first use and re-used by the following invocations of the container, its timeouts
+# and retries come from the client profile of the function (CLIENT_PROFILE)
+def dynamodb():
+    return lambda_runtime.client('dynamodb')
+
+
+# moves an order to the next stage in one conditional UpdateItem: the flag of the stage is set only if the
+# flag of the previous stage is true, the other flags of the order are left untouched. returns the new state
+# of the order ({'product_id': '20', 'Payment_processed': True, ...}) and raises PrerequisiteNotMet otherwise
+def advance(table_name, product_id, flag, prerequisite):
+    try:
+        response = dynamodb().update_item(
+            TableName=table_name,
+            Key={'product_id': {'S': str(product_id)}},
+            UpdateExpression="SET #flag = :true",
+            ConditionExpression="#prerequisite = :true",
+            ExpressionAttributeNames={'#flag': flag, '#prerequisite': prerequisite},
+            ExpressionAttributeValues={':true': {'BOOL': True}},
+            ReturnValues='ALL_NEW'
+        )
+    except ClientError as error:
+        if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            raise PrerequisiteNotMet(f"{prerequisite} is not true for product {product_id}, {flag} not set") from error
+        raise
+    return {name: next(iter(value.values())) for name, value in response['Attributes'].items()}
+
+
+# the TransactWriteItems action adding an outbox entry: the message is published to the topic once the
+# transaction that wrote it committed, by the publisher reading the stream of the table
+def outbox_entry(table_name, topic_arn, message):
+    return {'Put': {
+        'TableName': table_name,
+        'Item': {
+            'product_id': {'S': f"{OUTBOX_PREFIX}{uuid.uuid4()}"},
+            'topic_arn': {'S': topic_arn},
+            'message': {'S': json.dumps(message)},
+            'expiresAt': {'N': str(int(time.time()) + OUTBOX_TTL_SECONDS)}
+        },
+        'ConditionExpression': 'attribute_not_exists(product_id)'
+    }}
+
+
+# (topic arn, message) of the outbox entry inserted by a stream record, None for any other record of the table
+def outbox_message(record):
+    if record.get('eventName') != 'INSERT':
+        return None
+    image = record['dynamodb'].get('NewImage', {})
+    if not image.get('product_id', {}).get('S', '').startswith(OUTBOX_PREFIX):
+        return None
+    return image['topic_arn']['S'], image['message']['S']
@@ -1,5 +1,3 @@
-import json
-
 def lambda_handler(event, context):
     # TODO implement
     print ('Processing payment for the product id:', event['product_id'])
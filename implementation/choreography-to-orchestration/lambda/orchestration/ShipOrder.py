@@ -1,5 +1,3 @@
-import json
-
 def lambda_handler(event, context):
     # TODO implement
     print ('Shipped order for the product id:', event['product_id'])
@@ -14,6 +14,7 @@ import {
   aws_stepfunctions_tasks as tasks,
   aws_logs as logs,
   CfnOutput,
+  Duration,
 } from "aws-cdk-lib";
 import { NagSuppressions } from 'cdk-nag'
 
@@ -64,6 +65,10 @@ export class ChoreographyStack extends Stack {
       }
     ]);
 
+    // transactional outbox (cdk.json context order_outbox, or -c order_outbox=true): ProcessPayment writes the order
+    // and an outbox entry in one transaction and returns, OutboxPublisher publishes the entries from the table stream
+    const orderOutbox = String(this.node.tryGetContext("order_outbox")) === "true";
+
     const DynamoDBTable = new dynamodb.CfnTable(this, "DynamoDBTable", {
       attributeDefinitions: [
         {
@@ -82,6 +87,9 @@ export class ChoreographyStack extends Stack {
         readCapacityUnits: 1,
         writeCapacityUnits: 1,
       },
+      // the outbox entries reach the publisher through the stream and expire a day later (lambda/choreography/order_state.py)
+      streamSpecification: orderOutbox ? { streamViewType: "NEW_IMAGE" } : undefined,
+      timeToLiveSpecification: orderOutbox ? { attributeName: "expiresAt", enabled: true } : undefined,
     });
 
     const pointInTimeRecoverySpecificationProperty: dynamodb.CfnGlobalTable.PointInTimeRecoverySpecificationProperty = {
@@ -111,15 +119,26 @@ export class ChoreographyStack extends Stack {
         kmsMasterKeyId: "alias/aws/sns",
       });
 
+    // helpers shared by the python functions (lazily created boto3 clients)
+    const SharedLayer = new lambda.LayerVersion(this, "SharedLayer", {
+      code: lambda.Code.fromAsset("../shared/layer"),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_12],
+    });
+
     const ProcessPaymentFunction = new lambda.Function(this, "ProcessPaymentFunction", {
       description: "",
       environment: {
         table_name: DynamoDBTable.ref,
-        sns_topic_arn : SNSTopic_ShipOrder.ref
+        sns_topic_arn : SNSTopic_ShipOrder.ref,
+        METRICS_NAMESPACE: "OrderChoreography",
+        // the REST API waits for the payment, its AWS calls fail fast (shared/layer/python/lambda_runtime.py)
+        CLIENT_PROFILE: "interactive",
+        PUBLISH_MODE: orderOutbox ? "outbox" : "direct"
       },
       functionName: "ProcessPaymentFunction",
       handler: "ProcessPayment.lambda_handler",
       code: lambda.Code.fromAsset("lambda/choreography"),
+      layers: [SharedLayer],
       memorySize: 128,
       role: ProcessPaymentFunctionRole,
       runtime: lambda.Runtime.PYTHON_3_12,
@@ -165,6 +184,73 @@ export class ChoreographyStack extends Stack {
         })
       );
 
+    if (orderOutbox) {
+      const OutboxPublisherFunctionRole = new iam.Role(this, "Outbox Publisher Function Role", {
+        assumedBy: new iam.ServicePrincipal("lambda.amazonaws.com"),
+      });
+
+      OutboxPublisherFunctionRole.addToPolicy(
+        new iam.PolicyStatement({
+          actions: [
+            "dynamodb:DescribeStream",
+            "dynamodb:GetRecords",
+            "dynamodb:GetShardIterator",
+            "dynamodb:ListStreams"
+          ],
+          resources: [DynamoDBTable.attrStreamArn],
+        })
+      );
+
+      OutboxPublisherFunctionRole.addToPolicy(
+        new iam.PolicyStatement({
+          actions: ["sns:Publish"],
+          resources: [SNSTopic_ShipOrder.ref],
+        })
+      );
+
+      OutboxPublisherFunctionRole.addManagedPolicy(
+        iam.ManagedPolicy.fromAwsManagedPolicyName(
+          "service-role/AWSLambdaBasicExecutionRole"
+        )
+      );
+
+      const OutboxPublisherFunction = new lambda.Function(this, "OutboxPublisherFunction", {
+        description: "",
+        environment: {
+          METRICS_NAMESPACE: "OrderChoreography",
+          CLIENT_PROFILE: "default"
+        },
+        functionName: "OutboxPublisherFunction",
+        handler: "OutboxPublisher.lambda_handler",
+        code: lambda.Code.fromAsset("lambda/choreography"),
+        layers: [SharedLayer],
+        memorySize: 128,
+        role: OutboxPublisherFunctionRole,
+        runtime: lambda.Runtime.PYTHON_3_12,
+      });
+
+      // up to 100 orders per invocation, published 10 per PublishBatch call. only inserted outbox entries
+      // invoke the function, a failed entry is retried from its sequence number
+      const OutboxEventSourceMapping = new lambda.EventSourceMapping(this, "OutboxEventSourceMapping", {
+        target: OutboxPublisherFunction,
+        eventSourceArn: DynamoDBTable.attrStreamArn,
+        startingPosition: lambda.StartingPosition.TRIM_HORIZON,
+        batchSize: 100,
+        maxBatchingWindow: Duration.seconds(1),
+        reportBatchItemFailures: true,
+        bisectBatchOnError: true,
+        retryAttempts: 10,
+        filters: [
+          lambda.FilterCriteria.filter({
+            eventName: lambda.FilterRule.isEqual("INSERT"),
+            dynamodb: { Keys: { product_id: { S: lambda.FilterRule.beginsWith("OUTBOX#") } } },
+          }),
+        ],
+      });
+
+      OutboxEventSourceMapping.node.addDependency(OutboxPublisherFunctionRole);
+    }
+
 
 
     const ShipOrderFunctionRole = new iam.Role(this, "Ship Order Function Role", {
@@ -203,11 +289,14 @@ export class ChoreographyStack extends Stack {
         description: "",
         environment: {
           table_name: DynamoDBTable.ref,
-          sns_topic_arn : SNSTopic_UpdateReward.ref
+          sns_topic_arn : SNSTopic_UpdateReward.ref,
+          METRICS_NAMESPACE: "OrderChoreography",
+          CLIENT_PROFILE: "default"
         },
         functionName: "ShipOrderFunction",
         handler: "ShipOrder.lambda_handler",
         code: lambda.Code.fromAsset("lambda/choreography"),
+        layers: [SharedLayer],
         memorySize: 128,
         role: ShipOrderFunctionRole,
         runtime: lambda.Runtime.PYTHON_3_12,
@@ -289,10 +378,13 @@ export class ChoreographyStack extends Stack {
         description: "",
         environment: {
           table_name: DynamoDBTable.ref,
+          METRICS_NAMESPACE: "OrderChoreography",
+          CLIENT_PROFILE: "default"
         },
         functionName: "UpdateRewardFunction",
         handler: "UpdateReward.lambda_handler",
         code: lambda.Code.fromAsset("lambda/choreography"),
+        layers: [SharedLayer],
         memorySize: 128,
         role: UpdateRewardFunctionRole,
         runtime: lambda.Runtime.PYTHON_3_12,
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: order_benchmark.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Runs the real handlers of both order flows in-process against in-memory stand-ins for SNS and DynamoDB
+# and compares them at the same load:
+#
+#   choreography:  API -> ProcessPayment -> SNS ShipOrderTopic -> ShipOrder -> SNS UpdateRewardTopic -> UpdateReward (ChoreographyStack)
+#   orchestration: state machine -> ProcessPayment -> ShipOrder -> UpdateReward -> PutItem -> Transform Data (OrchestrationStack)
+#
+# --outbox runs the choreography with ProcessPayment in outbox mode: the order and an outbox entry are written in
+# one transaction and OutboxPublisher publishes the entries from the table stream in batches (order_outbox).
+#
+# usage: python tools/order_benchmark.py --design both --orders 1000 --concurrency 20
+import argparse
+import contextlib
+import json
+import pathlib
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PROJECT = pathlib.Path(__file__).resolve().parents[1]
+LAMBDA_DIR = PROJECT.joinpath("lambda")
+sys.path.insert(0, str(PROJECT.parent.joinpath("shared", "local")))
+
+from aws_stand_ins import LocalAWS  # noqa: E402
+from benchmark import MetricSink, format_table, latency_summary  # noqa: E402
+from lambda_loader import LambdaContext, load_handler  # noqa: E402
+
+# table names of the stacks
+CHOREOGRAPHY_TABLE_NAME = 'temporary-data-store'
+ORCHESTRATION_TABLE_NAME = 'store-order-data'
+SHIP_ORDER_TOPIC_ARN = 'arn:aws:sns:local:000000000000:ShipOrderTopic'
+UPDATE_REWARD_TOPIC_ARN = 'arn:aws:sns:local:000000000000:UpdateRewardTopic'
+STAGES = ('ProcessPayment', 'ShipOrder', 'UpdateReward')
+# Lambda retries a failed asynchronous invocation twice (without the delays of the service here)
+ASYNC_RETRIES = 2
+# event source mapping of the outbox publisher in the ChoreographyStack
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_BATCHING_WINDOW = 1.0
+
+
+# filter criteria of the outbox publisher mapping: only inserted outbox entries invoke the function
+def outbox_filter(record):
+    return record['eventName'] == 'INSERT' and record['dynamodb']['Keys']['product_id']['S'].startswith('OUTBOX#')
+
+
+class OrderSimulation:
+
+    design = None
+
+    def __init__(self, hop_latency=0.0, ddb_latency=0.0, workers=64, timeout=30.0):
+        self.hop_latency = hop_latency
+        self.timeout = timeout
+        # asynchronous invocations (SNS deliveries) run on this pool
+        self.invoker = ThreadPoolExecutor(max_workers=workers)
+        self.aws = LocalAWS(ddb_latency=ddb_latency, sns_latency=hop_latency, dispatcher=self.invoker)
+        self.metrics = MetricSink()
+        # handler durations as seen by the caller, stage -> seconds
+        self.stage_latencies = {}
+        # Step Functions bills every state transition
+        self.transitions = 0
+        self.lock = threading.Lock()
+
+    def hop(self):
+        if self.hop_latency:
+            time.sleep(self.hop_latency)
+
+    # invokes a handler and records its duration under the stage
+    def invoke(self, stage, handler, event):
+        started = time.monotonic()
+        try:
+            return handler.lambda_handler(event, LambdaContext(f"{stage}Function"))
+        finally:
+            with self.lock:
+                self.stage_latencies.setdefault(stage, []).append(time.monotonic() - started)
+
+    def run_order(self, product_id):
+        raise NotImplementedError
+
+    # background pollers (event source mappings) of the flow, running while the orders are placed
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    # orders whose item carries the flags of every stage
+    def completed(self):
+        raise NotImplementedError
+
+    def run(self, orders, concurrency):
+        latencies = []
+        failures = []
+        lock = threading.Lock()
+
+        # an order whose flow fails (e.g. a stage whose prerequisite was not met) is counted, not timed
+        def timed(product_id):
+            started = time.monotonic()
+            try:
+                self.run_order(product_id)
+            except Exception as error:
+                with lock:
+                    failures.append(error)
+                return
+            with lock:
+                latencies.append(time.monotonic() - started)
+
+        with self.aws.install(), contextlib.redirect_stdout(self.metrics):
+            started = time.monotonic()
+            self.start()
+            with ThreadPoolExecutor(max_workers=concurrency) as clients:
+                list(clients.map(timed, range(1, orders + 1)))
+            elapsed = time.monotonic() - started
+            self.stop()
+            self.invoker.shutdown(wait=True)
+        calls = self.aws.calls
+        result = {
+            'design': self.design,
+            'orders': orders,
+            'concurrency': concurrency,
+            'orders/s': orders / elapsed if elapsed else 0.0
+        }
+        result.update(latency_summary(latencies))
+        result['ddb calls/order'] = calls.total('dynamodb') / orders
+        result['sns calls/order'] = calls.total('sns') / orders
+        result['invocations/order'] = sum(len(durations) for durations in self.stage_latencies.values()) / orders
+        result['transitions/order'] = self.transitions / orders
+        result['completed'] = self.completed()
+        result['failed'] = len(failures)
+        return result
+
+    def stage_summary(self):
+        rows = []
+        for stage in STAGES + tuple(sorted(set(self.stage_latencies) - set(STAGES))):
+            durations = self.stage_latencies.get(stage, [])
+            row = {'design': self.design, 'stage': stage, 'invocations': len(durations)}
+            row.update(latency_summary(durations))
+            rows.append(row)
+        return rows
+
+
+class ChoreographySimulation(OrderSimulation):
+    """Every function hands the order on to the next one through an SNS topic, the order is done once UpdateReward ran."""
+
+    design = 'choreography'
+
+    def __init__(self, outbox=False, outbox_batch_size=OUTBOX_BATCH_SIZE, outbox_window=OUTBOX_BATCHING_WINDOW, **kwargs):
+        super().__init__(**kwargs)
+        self.aws.dynamodb.create_table(CHOREOGRAPHY_TABLE_NAME, 'product_id')
+        # product id -> event set once UpdateReward handled the order, or gave up on it
+        self.pending = {}
+        self.errors = {}
+        self.outbox = outbox
+        self.outbox_batch_size = outbox_batch_size
+        self.outbox_window = outbox_window
+        self.stream = None
+        self.poller = None
+        self.stopped = threading.Event()
+        environment = {'table_name': CHOREOGRAPHY_TABLE_NAME, 'sns_topic_arn': SHIP_ORDER_TOPIC_ARN}
+        if outbox:
+            self.design = 'choreography+outbox'
+            environment['PUBLISH_MODE'] = 'outbox'
+            self.stream = self.aws.dynamodb.stream(CHOREOGRAPHY_TABLE_NAME, record_filter=outbox_filter)
+        with self.aws.install():
+            self.process_payment = load_handler(LAMBDA_DIR.joinpath("choreography", "ProcessPayment.py"), environment)
+            self.outbox_publisher = load_handler(LAMBDA_DIR.joinpath("choreography", "OutboxPublisher.py")) if outbox else None
+            self.ship_order = load_handler(LAMBDA_DIR.joinpath("choreography", "ShipOrder.py"),
+                                           {'table_name': CHOREOGRAPHY_TABLE_NAME, 'sns_topic_arn': UPDATE_REWARD_TOPIC_ARN})
+            self.update_reward = load_handler(LAMBDA_DIR.joinpath("choreography", "UpdateReward.py"),
+                                              {'table_name': CHOREOGRAPHY_TABLE_NAME})
+        self.aws.sns.subscribe(SHIP_ORDER_TOPIC_ARN, self.subscriber('ShipOrder', self.ship_order))
+        self.aws.sns.subscribe(UPDATE_REWARD_TOPIC_ARN, self.subscriber('UpdateReward', self.update_reward, last=True))
+
+    # asynchronous invocation of a subscribed function, retried by Lambda when it fails
+    def subscriber(self, stage, handler, last=False):
+        def deliver(event):
+            product_id = json.loads(event['Records'][0]['Sns']['Message'])['product_id']
+            for attempt in range(ASYNC_RETRIES + 1):
+                try:
+                    self.invoke(stage, handler, event)
+                    break
+                except Exception as error:
+                    if attempt == ASYNC_RETRIES:
+                        # the event is dropped after the last retry, the order never completes
+                        self.errors[product_id] = error
+                        self.pending[product_id].set()
+                        return
+            if last:
+                self.pending[product_id].set()
+        return deliver
+
+    # the event source mapping of the outbox publisher: batches of stream records, a failed batch is retried
+    # from the first failed record
+    def poll_outbox(self):
+        while not (self.stopped.is_set() and not len(self.stream)):
+            records = self.stream.receive(self.outbox_batch_size, self.outbox_window, self.stopped)
+            if not records:
+                continue
+            self.hop()
+            try:
+                response = self.invoke('OutboxPublisher', self.outbox_publisher, self.stream.event(records))
+                failed = [failure['itemIdentifier'] for failure in response['batchItemFailures']]
+            except Exception:
+                failed = [records[0]['dynamodb']['SequenceNumber']]
+            if failed:
+                first = min(failed, key=int)
+                self.stream.redeliver([record for record in records if int(record['dynamodb']['SequenceNumber']) >= int(first)])
+
+    def start(self):
+        if self.outbox:
+            self.poller = threading.Thread(target=self.poll_outbox, daemon=True)
+            self.poller.start()
+
+    def stop(self):
+        if self.poller is not None:
+            self.stopped.set()
+            self.poller.join()
+
+    def run_order(self, product_id):
+        self.pending[product_id] = threading.Event()
+        # the REST API invokes ProcessPayment synchronously (AWS_PROXY integration)
+        self.hop()
+        response = self.invoke('ProcessPayment', self.process_payment, {'body': json.dumps({'product_id': product_id})})
+        if response['statusCode'] != 201:
+            raise RuntimeError(f"placeOrder failed for {product_id}: {response}")
+        if not self.pending[product_id].wait(self.timeout):
+            raise TimeoutError(f"order {product_id} did not complete within {self.timeout}s")
+        if product_id in self.errors:
+            raise self.errors[product_id]
+
+    def completed(self):
+        return sum(1 for item in self.aws.dynamodb.items(CHOREOGRAPHY_TABLE_NAME)
+                   if all(item.get(flag) for flag in ('Payment_processed', 'Ship_order', 'Update_reward')))
+
+
+class OrchestrationSimulation(OrderSimulation):
+    """The state machine of the OrchestrationStack: each task invokes a function with the output of the previous one."""
+
+    design = 'orchestration'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.aws.dynamodb.create_table(ORCHESTRATION_TABLE_NAME, 'product_id')
+        with self.aws.install():
+            self.functions = {stage: load_handler(LAMBDA_DIR.joinpath("orchestration", f"{stage}.py")) for stage in STAGES}
+        self.dynamodb = self.aws.client('dynamodb')
+
+    def transition(self, count=1):
+        with self.lock:
+            self.transitions += count
+
+    # Task with "OutputPath": "$.Payload" followed by its Choice state
+    def task(self, stage, state, flag):
+        self.hop()
+        state = self.invoke(stage, self.functions[stage], state)
+        self.transition(2)
+        if state.get(flag) is not True:
+            # Default: "Handle Error"
+            self.transition()
+            raise RuntimeError(f"{stage} did not set {flag} for {state.get('product_id')}")
+        return state
+
+    def run_order(self, product_id):
+        state = {'product_id': str(product_id)}
+        state = self.task('ProcessPayment', state, 'payment_processed')
+        state = self.task('ShipOrder', state, 'order_shipped')
+        state = self.task('UpdateReward', state, 'update_reward')
+        # "Put Item": arn:aws:states:::dynamodb:putItem with "ResultPath": null
+        self.dynamodb.put_item(TableName=ORCHESTRATION_TABLE_NAME, Item={
+            'product_id': {'S': state['product_id']},
+            'Payment_processed': {'BOOL': True},
+            'Ship_order': {'BOOL': True},
+            'Update_reward': {'BOOL': True}
+        })
+        # "Transform Data" Pass state
+        self.transition(2)
+        return {
+            'Product ID': state['product_id'],
+            'Payment has been processed': state['payment_processed'],
+            'Order has been shipped': state['order_shipped'],
+            'Reward was updated': state['update_reward']
+        }
+
+    def completed(self):
+        return sum(1 for item in self.aws.dynamodb.items(ORCHESTRATION_TABLE_NAME)
+                   if all(item.get(flag) for flag in ('Payment_processed', 'Ship_order', 'Update_reward')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--design', choices=['choreography', 'orchestration', 'both'], default='both',
+                        help='order flow to run (default: both)')
+    parser.add_argument('--orders', type=int, default=500, help='number of orders (default: 500)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10],
+                        help='concurrent orders, several values run the designs once per value (default: 10)')
+    parser.add_argument('--hop-latency-ms', type=float, default=0.0,
+                        help='latency of each hop: the API / Step Functions invoking a function and each SNS publish')
+    parser.add_argument('--ddb-latency-ms', type=float, default=0.0, help='latency of each DynamoDB call')
+    parser.add_argument('--outbox', action='store_true',
+                        help='run the choreography with the transactional outbox of ProcessPayment (order_outbox)')
+    parser.add_argument('--outbox-batch-size', type=int, default=OUTBOX_BATCH_SIZE,
+                        help=f"stream records per OutboxPublisher invocation (default: {OUTBOX_BATCH_SIZE})")
+    parser.add_argument('--outbox-window', type=float, default=OUTBOX_BATCHING_WINDOW,
+                        help=f"seconds the stream batch may fill up (default: {OUTBOX_BATCHING_WINDOW})")
+    parser.add_argument('--timeout', type=float, default=30.0, help='seconds a choreography order may take to complete (default: 30)')
+    parser.add_argument('--spans', action='store_true',
+                        help='also print the latency per span from the embedded metrics of the instrumented choreography handlers')
+    args = parser.parse_args()
+
+    results = []
+    stages = []
+    spans = []
+    simulations = []
+    if args.design in ('choreography', 'both'):
+        simulations.append((ChoreographySimulation, {}))
+        if args.outbox:
+            simulations.append((ChoreographySimulation, {'outbox': True, 'outbox_batch_size': args.outbox_batch_size,
+                                                         'outbox_window': args.outbox_window}))
+    if args.design in ('orchestration', 'both'):
+        simulations.append((OrchestrationSimulation, {}))
+    for concurrency in args.concurrency:
+        for simulation_class, options in simulations:
+            simulation = simulation_class(hop_latency=args.hop_latency_ms / 1000.0, ddb_latency=args.ddb_latency_ms / 1000.0,
+                                          workers=max(64, concurrency * 2), timeout=args.timeout, **options)
+            results.append(simulation.run(args.orders, concurrency))
+            stages.extend(dict(row, concurrency=concurrency) for row in simulation.stage_summary())
+            spans.extend(dict(row, concurrency=concurrency) for row in simulation.metrics.stage_summary(simulation.design))
+    print(format_table(results))
+    print()
+    print(format_table(stages, ['design', 'concurrency', 'stage', 'invocations', 'p50_ms', 'p99_ms', 'max_ms']))
+    if args.spans and spans:
+        print()
+        print(format_table(spans, ['design', 'concurrency', 'service', 'stage', 'spans', 'p50_ms', 'p99_ms', 'max_ms']))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,49 @@
-import boto3
+import decimal
 import json
-import logging
-import uuid
+import os
+from collections import OrderedDict
+import instrumentation
+import lambda_runtime
+import quote_store
+import sqs_batch
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-dynamo = boto3.resource('dynamodb')
+logger = lambda_runtime.get_logger()
+QUOTE_TABLE_NAME = os.getenv('QUOTE_TABLE_NAME', 'MortgageQuotes')
+# several banks answer the same request, so quotes are appended atomically instead of read, extended and put back.
+# a bank's quote is appended once per request (bankId), so a redelivered record does not add it twice.
+# with quote_top_k in cdk.json the item of a request keeps the QUOTE_TOP_K lowest rates and every quote goes to
+# the history table (ID, quote) instead, so a popular request no longer grows its item towards the 400 KB limit
+if os.getenv('QUOTE_STORE_LAYOUT') == quote_store.COMPACT:
+  store = quote_store.QuoteStore(QUOTE_TABLE_NAME, 'ID', layout=quote_store.COMPACT, idempotency_field='bankId', rank_field='rate',
+                                 top_k=int(os.getenv('QUOTE_TOP_K') or quote_store.TOP_K),
+                                 history_table=os.environ['QUOTE_HISTORY_TABLE_NAME'], history_sort_key='quote')
+else:
+  store = quote_store.QuoteStore(QUOTE_TABLE_NAME, 'ID', idempotency_field='bankId')
 
+# every record is handled on its own: malformed records go to the dead-letter queue, records whose quotes
+# could not be stored are reported back through batchItemFailures and retried without the rest of the batch
+@instrumentation.handler('QuoteAggregator')
 def lambda_handler(event, context):
-  for record in event['Records']:
-    body = json.loads(record['body'])
-    quote = body['responsePayload']
-    logger.info(quote)
-    requestId = quote['id']
-    bankId = quote['bankId']
-    rate = quote['rate']
-    table = dynamo.Table('MortgageQuotes')
-    
-    record = table.get_item(Key={'ID': quote['id'] }, ConsistentRead=True)
-    item = record.get('Item', { 'ID': quote['id'], 'Quotes': [] } )
-    item['Quotes'].append( { 'bankId': quote['bankId'], 'rate':"%.2f" % quote['rate'] }) 
-    
-    logger.info(item)
-    table.put_item(Item = item)
-  return 0
+  groups = OrderedDict()
+  message_ids = {}
+  poisoned = []
+  with instrumentation.span('parse'):
+    for record in event['Records']:
+      try:
+        quote = json.loads(record['body'])['responsePayload']
+        entry = { 'bankId': quote['bankId'], 'rate': decimal.Decimal("%.2f" % quote['rate']) }
+        key = (quote['id'],)
+      except (KeyError, TypeError, ValueError) as error:
+        logger.exception(f"invalid record: {record.get('messageId')}")
+        poisoned.append((record, f"{type(error).__name__}: {error}"))
+        continue
+      groups.setdefault(key, []).append(entry)
+      message_ids.setdefault(key, []).append(record['messageId'])
+  instrumentation.log_payload(logger, "quotes: ", (dict(quote, id=key[0]) for key, quotes in groups.items() for quote in quotes))
+
+  failed_message_ids = sqs_batch.dead_letter(poisoned)
+  with instrumentation.span('dynamodb.write', quote_id=sorted(key[0] for key in groups)):
+    failed = store.write(groups)
+  for key in failed:
+    failed_message_ids.extend(message_ids[key])
+  return sqs_batch.response(failed_message_ids)
@@ -1,6 +1,7 @@
 import {
   Stack,
   StackProps,
+  Duration,
   aws_lambda as lambda,
   aws_iam as iam,
   aws_dynamodb as dynamodb,
@@ -84,9 +85,15 @@ export class ChoreographyStack extends Stack {
       tableName: "MortgageQuotes",
     });
 
-    // Create SQS queue
+    // Create SQS queue, poison messages are moved to the dead-letter queue by the QuoteAggregator
+    // and records that keep failing end up there after 5 receives
+    const SQSDeadLetterQueue = new sqs.Queue(this, 'SQSDeadLetterQueue', {
+      queueName: `${DynamoDBTable.tableName}-dlq`,
+      retentionPeriod: Duration.days(14)
+    });
     const SQSQueue = new sqs.Queue(this, 'SQSQueue', {
-      queueName: DynamoDBTable.tableName
+      queueName: DynamoDBTable.tableName,
+      deadLetterQueue: { queue: SQSDeadLetterQueue, maxReceiveCount: 5 }
     });
 
     // Create Lambda functions
@@ -168,19 +175,52 @@ export class ChoreographyStack extends Stack {
       region: `${this.region}`
     });
 
+    // Python modules shared with the other implementations (quote_store)
+    const sharedLayer = new lambda.LayerVersion(this, 'SharedLayer', {
+      code: lambda.Code.fromAsset('../shared/layer'),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_12]
+    });
+
     const quoteAggregatorFn = new lambda.Function(this, 'QuoteAggregator', {
       functionName: "QuoteAggregator",
       handler: "quoteAggregator.lambda_handler",
       code: lambda.Code.fromAsset('lambda/choreography'),
+      environment: {
+        QUOTE_TABLE_NAME: DynamoDBTable.tableName,
+        METRICS_NAMESPACE: "MortgageQuotes",
+        DEAD_LETTER_QUEUE_URL: SQSDeadLetterQueue.queueUrl,
+        // botocore profile of the DynamoDB client (shared/layer/python/lambda_runtime.py)
+        CLIENT_PROFILE: "burst"
+      },
+      layers: [sharedLayer],
       role: choreographyRole,
       runtime: lambda.Runtime.PYTHON_3_12
     });
 
     // QuoteAggregation is triggered by SQS events
-    quoteAggregatorFn.addEventSource(new sources.SqsEventSource(SQSQueue, { batchSize: 3 }));
+    // failed records are reported back one by one, the rest of the batch is not processed again
+    quoteAggregatorFn.addEventSource(new sources.SqsEventSource(SQSQueue, { batchSize: 3, reportBatchItemFailures: true }));
+    SQSDeadLetterQueue.grantSendMessages(quoteAggregatorFn);
 
     DynamoDBTable.grantFullAccess(quoteAggregatorFn);
 
+    // with a positive quote_top_k (cdk.json) the item of a request keeps its cheapest quotes only and every quote
+    // is stored in the history table, expiring a week later (shared/layer/python/quote_store.py)
+    const quoteTopK = Number(this.node.tryGetContext("quote_top_k") ?? 0);
+    if (quoteTopK > 0) {
+      const QuoteHistoryTable = new dynamodb.Table(this, 'QuoteHistoryTable', {
+        partitionKey: { name: 'ID', type: dynamodb.AttributeType.STRING },
+        sortKey: { name: 'quote', type: dynamodb.AttributeType.STRING },
+        tableName: "MortgageQuoteHistory",
+        billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+        timeToLiveAttribute: "expiresAt",
+      });
+      QuoteHistoryTable.grantReadWriteData(quoteAggregatorFn);
+      quoteAggregatorFn.addEnvironment("QUOTE_STORE_LAYOUT", "compact");
+      quoteAggregatorFn.addEnvironment("QUOTE_TOP_K", String(quoteTopK));
+      quoteAggregatorFn.addEnvironment("QUOTE_HISTORY_TABLE_NAME", QuoteHistoryTable.tableName);
+    }
+
     // Role for Step Function
     const stepRole = new iam.Role(this, 'stepRole', {
       path: "/service-role/",
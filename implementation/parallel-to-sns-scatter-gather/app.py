@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import os
+import sys
 import aws_cdk as cdk
 from cdk_nag import (
     AwsSolutionsChecks,
@@ -7,6 +8,7 @@ from cdk_nag import (
     NagPackSuppression
     )
 
+from scatter_gather import performance_profile
 from scatter_gather.original_component import OriginalScatterGatherStack
 from scatter_gather.refactored_component import RefactoredlScatterGatherStack
 
@@ -38,5 +40,7 @@ NagSuppressions.add_resource_suppressions([sfn_scatter_gather, refactored_scatte
                                         apply_to_children=True
                                     )
 
+# the settings of the performance profile both stacks are synthesized with
+print(performance_profile.summary(app), file=sys.stderr)
 
 app.synth()
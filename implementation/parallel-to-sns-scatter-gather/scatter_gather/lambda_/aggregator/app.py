@@ -19,39 +19,170 @@
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 ###
-import json
+import base64
+import decimal
 import logging
-import boto3
 import os
-logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', level=logging.INFO, datefmt='%Y-%m-%d %H:%M:%S')
-logging.getLogger().setLevel(logging.INFO)
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+import envelope
+import gather
+import instrumentation
+import lambda_runtime
+import quote_cache
+import quote_store
+import sqs_batch
+# the Lambda runtime installs the log handler, only the level is set (LOG_LEVEL)
+lambda_runtime.get_logger()
 
 QUOTE_TABLE_NAME = os.environ['QUOTE_TABLE_NAME']
-ddb_table = boto3.resource('dynamodb').Table(QUOTE_TABLE_NAME)
+# sparse index of the quote table on (quoteId, bestRate), the items are ranked by rate once the stack creates it
+QUOTE_RANK_INDEX = os.getenv('QUOTE_RANK_INDEX')
+# list, item or compact (quote_top_k in cdk.json): the compact layout keeps the QUOTE_TOP_K cheapest quotes of a
+# vendor inline and every quote in a history item expiring after QUOTE_HISTORY_TTL_SECONDS
+QUOTE_STORE_LAYOUT = os.getenv('QUOTE_STORE_LAYOUT', quote_store.LIST)
+# the quotes of a (quoteId, vendor) key are appended with a conditional UpdateItem, a quote already in the item is
+# skipped. aggregators receiving records of the same request in concurrent batches never overwrite each other.
+# QUOTE_TABLE_SHARDS (quote_table_shards in cdk.json) spreads the vendor items of a request over that many partition
+# key values. the client writes to the table in the region of the function, its own replica of a global table
+store = quote_store.QuoteStore(QUOTE_TABLE_NAME, 'quoteId', 'vendor',
+                               layout=QUOTE_STORE_LAYOUT,
+                               rank_field='rate' if QUOTE_RANK_INDEX or QUOTE_STORE_LAYOUT == quote_store.COMPACT else None,
+                               rank_index=QUOTE_RANK_INDEX,
+                               top_k=int(os.getenv('QUOTE_TOP_K') or quote_store.TOP_K),
+                               history_ttl=int(os.getenv('QUOTE_HISTORY_TTL_SECONDS') or quote_store.HISTORY_TTL_SECONDS),
+                               shards=int(os.getenv('QUOTE_TABLE_SHARDS') or 1))
+# vendors returned per page by the quote reader
+READ_PAGE_SIZE = int(os.getenv('READ_PAGE_SIZE', '25'))
+# complete aggregates are cached for the parameters of their request, None unless the stack configures the cache
+cache = quote_cache.QuoteCache.from_environment()
 
 
-# The lambda function receives the message from the SQS event aggregates them and stores it in the DDB table
+# parses one SQS record into the DDB keys and the quote entries stored for them,
+# a responder that priced a batch of quote requests returns all of its quotes in one record.
+# the rate is stored as a number rounded to cents, so quotes rank by it
+def parse_record(record):
+    parsed = []
+    for quote in envelope.quotes(record):
+        key = (quote['uuid'], f"VENDOR#{quote['vendor']}")
+        entry = { 'carType': quote['car_type'], 'rate': decimal.Decimal("%.2f" % quote['price_quote']), 'daysRental': quote['days_rental'] }
+        parsed.append((quote, key, entry))
+    return parsed
+
+
+# The lambda function receives the message from the SQS event aggregates them and stores it in the DDB table.
+# Records are grouped by (quoteId, vendor) so each key costs a single write, and failed records are
+# reported back to SQS through batchItemFailures instead of failing the whole batch. Malformed records
+# go to the dead-letter queue, the quotes of a redelivered record are not stored twice. With completion tracking
+# the quotes of a request are stored in its tracker, one write per request and batch (gather.py).
+@instrumentation.handler('aggregator')
 def lambda_handler(event, context):
-    logging.info("Received event: " + json.dumps(event, indent=2))
+    instrumentation.log_payload(logging.getLogger(), "Received event: ", event)
     # aggregates the messages received from the SQS event
     quotes = []
+    groups = OrderedDict()
+    message_ids = {}
+    failed_message_ids = []
+    poisoned = []
+    with instrumentation.span('parse') as tags:
+        for record in event['Records']:
+            try:
+                parsed = parse_record(record)
+            except (KeyError, TypeError, ValueError) as error:
+                logging.exception(f"invalid record: {record.get('messageId')}")
+                poisoned.append((record, f"{type(error).__name__}: {error}"))
+                continue
+            for quote, key, entry in parsed:
+                quotes.append(quote)
+                groups.setdefault(key, []).append(entry)
+                message_ids.setdefault(key, []).append(record['messageId'])
+        tags['quote_id'] = sorted({quote_id for quote_id, _ in groups})
+    if poisoned:
+        with instrumentation.span('sqs.dead_letter'):
+            failed_message_ids.extend(sqs_batch.dead_letter(poisoned))
+
+    if gather.enabled():
+        failed_keys = set()
+        arrivals = OrderedDict()
+        requests = {quote['uuid']: quote for quote in quotes}
+        for (quote_id, vendor), entries in groups.items():
+            arrivals.setdefault(quote_id, {})[vendor[len(gather.VENDOR_PREFIX):]] = entries
+        for quote_id, vendor_quotes in arrivals.items():
+            # a request another invocation is publishing is retried by that invocation or by the deadline. a failed
+            # tracker update or publish retries the records of the request, their vendors are recorded once
+            try:
+                failed_keys |= gather.record_arrivals(store, quote_id, vendor_quotes, cache, requests[quote_id])
+            except gather.PublishInProgress:
+                logging.info(f"{quote_id} is being published by another invocation")
+            except ClientError:
+                logging.exception(f"gather failed for {quote_id}")
+                failed_keys |= {key for key in groups if key[0] == quote_id}
+    else:
+        with instrumentation.span('dynamodb.write', quote_id=sorted({quote_id for quote_id, _ in groups})):
+            failed_keys = store.write(groups)
+    for key in failed_keys:
+        failed_message_ids.extend(message_id for message_id in message_ids[key] if message_id not in failed_message_ids)
+
+    logging.info("stored %d quotes, %d records failed, %d poison records", len(quotes), len(failed_message_ids), len(poisoned))
+    return sqs_batch.response(failed_message_ids, statusCode=200, body=quotes)
+
+
+# The lambda function receives the quote requests from the deadline queue once the deadline of a request passed
+# and publishes whatever quotes arrived so far. Requests that were complete before are published already and skipped,
+# a request another invocation is still publishing is checked again once its record is redelivered.
+@instrumentation.handler('gather-deadline')
+def deadline_handler(event, context):
+    failed_message_ids = []
+    poisoned = []
     for record in event['Records']:
-        body = json.loads(record['body'])
-        # get the quote from the message body
-        quote = json.loads(body['responsePayload']['data'])
-        logging.info(f"quote: {quote}")
-        quotes.append(quote)
-        # the quoteId is used to check if the quote is already stored in the DDB table
-        ddb_record = ddb_table.get_item(Key={'quoteId': quote['uuid'], 'vendor': f"VENDOR#{quote['vendor']}"})
-        item = ddb_record.get('Item', { 'quoteId': quote['uuid'], 'vendor': f"VENDOR#{quote['vendor']}", 'Quotes': [] })
-        item['Quotes'].append( { 'carType': quote['car_type'], 'rate':"%.2f" % quote['price_quote'], 'daysRental': quote['days_rental'] }) 
-        logging.info(f"item: {item}")
-        # write the quote in the DDB table
-        ddb_table.put_item(Item = item)
-    
-    
-    logging.info(f"quotes:{quotes}")
-    return {
-        'statusCode': 200,
-        'body': json.dumps(quotes)
-    }
\ No newline at end of file
+        try:
+            # a bulk message carries many quote requests, the acknowledgement of a bulk request none
+            for request in envelope.requests(record):
+                request = request['data']
+                # cached requests were answered by the requester
+                if request.get('cached'):
+                    continue
+                quote_id = request['uuid']
+                if gather.publish_at_deadline(store, quote_id) is not None:
+                    logging.info("deadline passed for %s, published the quotes received so far", quote_id)
+        except (KeyError, TypeError, ValueError) as error:
+            logging.exception(f"invalid record: {record.get('messageId')}")
+            poisoned.append((record, f"{type(error).__name__}: {error}"))
+        except gather.PublishInProgress as in_progress:
+            logging.info(f"{in_progress} is being published by another invocation")
+            failed_message_ids.append(record['messageId'])
+        except ClientError:
+            logging.exception(f"publish failed for {record.get('messageId')}")
+            failed_message_ids.append(record['messageId'])
+    failed_message_ids.extend(sqs_batch.dead_letter(poisoned))
+    return sqs_batch.response(failed_message_ids)
+
+
+# continuation tokens of the quote reader are the encoded last key of a query page
+def encode_token(last_key):
+    return base64.urlsafe_b64encode(envelope.dumps(last_key).encode('utf-8')).decode('ascii') if last_key else None
+
+
+def decode_token(token):
+    return envelope.loads(base64.urlsafe_b64decode(token.encode('ascii'))) if token else None
+
+
+# The lambda function returns the stored quotes of a request. {"quoteId": ..., "best": true} returns the cheapest
+# vendor from the rank index in a single read, otherwise one page of vendor quotes is returned with the token of
+# the next page ({"quoteId": ..., "nextToken": ...}) so a caller reads a large aggregate page by page.
+@instrumentation.handler('quote-reader')
+def reader_handler(event, context):
+    quote_id = event['quoteId']
+    if event.get('best'):
+        with instrumentation.span('dynamodb.best', quote_id=quote_id):
+            best = store.best(quote_id)
+        if best is None:
+            return {'statusCode': 404, 'quoteId': quote_id}
+        vendor, rate, quotes = best
+        return {'statusCode': 200, 'quoteId': quote_id, 'vendor': vendor[len(gather.VENDOR_PREFIX):],
+                'rate': str(rate), 'quotes': envelope.plain(quotes)}
+    with instrumentation.span('dynamodb.read', quote_id=quote_id):
+        page, last_key = store.read_page(quote_id, gather.VENDOR_PREFIX, page_size=event.get('pageSize', READ_PAGE_SIZE),
+                                         start_key=decode_token(event.get('nextToken')))
+    quotes = {vendor[len(gather.VENDOR_PREFIX):]: vendor_quotes for vendor, vendor_quotes in page}
+    return {'statusCode': 200, 'quoteId': quote_id, 'quotes': envelope.plain(quotes), 'nextToken': encode_token(last_key)}
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: gather.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Completion tracking for the gather stage. Every quote request has a tracker item (quoteId, GATHER) holding the
+# quotes of the vendors that answered (a VENDOR#<vendor> attribute each) and the set of those vendors. An aggregator
+# batch stores the quotes of a request and counts their vendors in one conditional UpdateItem, the update completing
+# the set publishes the aggregate from the item it returns, without a claim or a read of the vendor items. The vendor
+# items are written by the BatchWriteItem marking the tracker published. A request still incomplete once its deadline
+# passed (the requester sends it to the deadline queue delayed by the deadline of the request) is claimed by the
+# deadline function and published as a partial result. The quotes of a vendor answering after its request was
+# published, or while the deadline function publishes it, are appended to the vendor item directly.
+# A failed publish gives the tracker back, so it is retried by the redelivered records or the deadline instead of
+# being lost. A publisher that fails between publishing and marking publishes the request again on the retry.
+# With a sharded quote table the tracker is on the shard of its sort key.
+import logging
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+import envelope
+import instrumentation
+import lambda_runtime
+import quote_store
+
+TRACKER_SORT_KEY = 'GATHER'
+VENDOR_PREFIX = 'VENDOR#'
+
+# vendors every quote request is sent to, comma separated (car_rentals in cdk.json)
+EXPECTED_VENDORS = frozenset(vendor for vendor in os.getenv('EXPECTED_VENDORS', '').split(',') if vendor)
+RESULT_TOPIC_ARN = os.getenv('RESULT_TOPIC_ARN')
+# a claim older than the timeout of the aggregator belongs to an invocation that died and is taken over, so does a
+# request completed by such an invocation
+CLAIM_TIMEOUT_SECONDS = 10
+# attributes of the invocation publishing a tracker: the claim of the deadline function, or the arrival that
+# completed the request
+OWNER_ATTRIBUTES = ('claimedAt', 'arrivedAt')
+# the tracker is not published and not claimed by a live invocation
+UNCLAIMED = "attribute_not_exists(publishedAt) AND (attribute_not_exists(claimedAt) OR claimedAt < :expired)"
+
+
+# another invocation claimed the request and is publishing it, raised to the deadline handler so it checks again later
+class PublishInProgress(Exception):
+    pass
+
+
+# completion tracking is off unless the stack tells the aggregator which vendors to expect
+def enabled():
+    return bool(EXPECTED_VENDORS)
+
+
+def claimed(tracker, now):
+    return tracker.get('claimedAt', 0) >= now - CLAIM_TIMEOUT_SECONDS
+
+
+# item a failed conditional write returned (ReturnValuesOnConditionCheckFailure), typed even with the resource API
+def condition_item(error):
+    from boto3.dynamodb.types import TypeDeserializer
+    deserializer = TypeDeserializer()
+    return {name: deserializer.deserialize(value) for name, value in error.response.get('Item', {}).items()}
+
+
+# conditional update of the tracker of a request: (True, tracker after the update) or (False, tracker the condition
+# failed on), both without another read
+def update_tracker(store, quote_id, **update):
+    try:
+        response = store.table.update_item(Key=store.key((quote_id, TRACKER_SORT_KEY)), ReturnValues='ALL_NEW',
+                                           ReturnValuesOnConditionCheckFailure='ALL_OLD', **update)
+        return True, response['Attributes']
+    except ClientError as error:
+        if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False, condition_item(error)
+
+
+# records the quotes of the vendors of a request that answered ({vendor: [quote, ...]}) and publishes the request
+# once all expected vendors answered. returns the keys of the vendor items a direct write failed for, a failed tracker
+# update or publish raises its ClientError and a request another invocation publishes raises PublishInProgress
+def record_arrivals(store, quote_id, quotes, cache=None, request=None):
+    now = int(time.time())
+    vendors = sorted(quotes)
+    names = {f"#vendor{index}": f"{VENDOR_PREFIX}{vendor}" for index, vendor in enumerate(vendors)}
+    values = {':vendors': set(vendors), ':now': now, ':expired': now - CLAIM_TIMEOUT_SECONDS}
+    for index, vendor in enumerate(vendors):
+        values.update({f":vendor{index}": vendor, f":quotes{index}": store.unique(quotes[vendor])})
+    with instrumentation.span('dynamodb.track', quote_id=quote_id):
+        recorded, tracker = update_tracker(
+            store, quote_id,
+            UpdateExpression="SET arrivedAt = :now, " + ", ".join(f"#vendor{index} = :quotes{index}" for index in range(len(vendors))) + " ADD answered :vendors",
+            ConditionExpression=" AND ".join([UNCLAIMED] + [f"NOT contains(answered, :vendor{index})" for index in range(len(vendors))]),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+    if recorded:
+        # the vendors of the batch were new, the update that reaches the expected count publishes
+        answered = len(tracker['answered'])
+        if answered - len(vendors) < len(EXPECTED_VENDORS) <= answered:
+            publish(store, quote_id, tracker, now, cache, request)
+        return set()
+    late = {vendor: vendor_quotes for vendor, vendor_quotes in quotes.items() if vendor not in tracker.get('answered', ())}
+    if 'publishedAt' in tracker or claimed(tracker, now):
+        if not late:
+            return set()
+        logging.info("%s is published already, storing the quotes of %s", quote_id, sorted(late))
+        with instrumentation.span('dynamodb.write', quote_id=quote_id):
+            return store.write({(quote_id, f"{VENDOR_PREFIX}{vendor}"): vendor_quotes for vendor, vendor_quotes in late.items()})
+    if late:
+        # a concurrent batch recorded some of the vendors
+        return record_arrivals(store, quote_id, late, cache, request)
+    if len(tracker.get('answered', ())) >= len(EXPECTED_VENDORS):
+        # the records of a complete request are redelivered: its publish failed, or another invocation publishes it
+        with instrumentation.span('dynamodb.claim', quote_id=quote_id):
+            tracker = claim(store, quote_id, now)
+        if tracker is not None:
+            publish(store, quote_id, tracker, now, cache, request)
+    return set()
+
+
+# claims the tracker of a request for publishing and returns it, None if the request is published already.
+# a request another invocation claimed, or completed a moment ago, raises PublishInProgress
+def claim(store, quote_id, now):
+    claimed_now, tracker = update_tracker(
+        store, quote_id,
+        UpdateExpression="SET claimedAt = :now",
+        ConditionExpression=f"{UNCLAIMED} AND (attribute_not_exists(answered) OR size(answered) < :expected "
+                            "OR attribute_not_exists(arrivedAt) OR arrivedAt < :expired)",
+        ExpressionAttributeValues={':now': now, ':expired': now - CLAIM_TIMEOUT_SECONDS, ':expected': len(EXPECTED_VENDORS)}
+    )
+    if claimed_now:
+        return tracker
+    if 'publishedAt' in tracker:
+        return None
+    raise PublishInProgress(quote_id)
+
+
+# gives the tracker of a failed publish back so the retry does not wait for it to time out, a tracker marked
+# published while some of its vendor items failed is published again
+def release(store, quote_id, now):
+    try:
+        store.table.update_item(
+            Key=store.key((quote_id, TRACKER_SORT_KEY)),
+            UpdateExpression="REMOVE claimedAt, arrivedAt, publishedAt",
+            ConditionExpression="claimedAt = :now OR arrivedAt = :now OR publishedAt = :now",
+            ExpressionAttributeValues={':now': now}
+        )
+    except ClientError:
+        logging.exception(f"releasing the claim of {quote_id} failed")
+
+
+# publishes the aggregate of a request from its tracker once, partial results list the vendors that did not answer.
+# the vendor items are written by the BatchWriteItem marking the tracker published. a failed publish or write
+# raises its ClientError with the tracker released, the caller retries the records. a complete aggregate is stored
+# in the quote cache for the parameters of the request
+def publish(store, quote_id, tracker, now, cache=None, request=None):
+    quotes = {name[len(VENDOR_PREFIX):]: vendor_quotes for name, vendor_quotes in sorted(tracker.items()) if name.startswith(VENDOR_PREFIX)}
+    missing = sorted(EXPECTED_VENDORS - set(quotes))
+    aggregate = {
+        'uuid': quote_id,
+        'partial': bool(missing),
+        'missing': missing,
+        # the compact layout keeps the top_k quotes of a vendor
+        'quotes': {vendor: store.top(vendor_quotes) if store.layout == quote_store.COMPACT else vendor_quotes
+                   for vendor, vendor_quotes in quotes.items()}
+    }
+    published = dict({name: value for name, value in tracker.items() if name not in OWNER_ATTRIBUTES}, publishedAt=now)
+    logging.info("publishing aggregate for %s, missing: %s", quote_id, missing)
+    try:
+        if RESULT_TOPIC_ARN:
+            with instrumentation.span('sns.publish', quote_id=quote_id):
+                lambda_runtime.client('sns').publish(TopicArn=RESULT_TOPIC_ARN, Message=envelope.dumps(aggregate))
+        # the owner of the tracker is the only writer of the vendor items it holds
+        with instrumentation.span('dynamodb.mark_published', quote_id=quote_id):
+            failed = store.write({(quote_id, f"{VENDOR_PREFIX}{vendor}"): vendor_quotes for vendor, vendor_quotes in quotes.items()},
+                                 single_writer=True, items=[published])
+        if failed:
+            raise ClientError({'Error': {'Code': 'UnprocessedItems', 'Message': f"{sorted(failed)} were not written"}}, 'BatchWriteItem')
+    except ClientError:
+        release(store, quote_id, now)
+        raise
+    if cache is not None and request is not None and not missing:
+        try:
+            with instrumentation.span('cache.put', quote_id=quote_id):
+                cache.put(request, aggregate['quotes'])
+        except ClientError:
+            logging.exception(f"caching the quotes of {quote_id} failed")
+    return aggregate
+
+
+# publishes a request whose deadline passed with the quotes received so far, None if it is published already
+def publish_at_deadline(store, quote_id):
+    now = int(time.time())
+    with instrumentation.span('dynamodb.claim', quote_id=quote_id):
+        tracker = claim(store, quote_id, now)
+    if tracker is None:
+        return None
+    return publish(store, quote_id, tracker, now)
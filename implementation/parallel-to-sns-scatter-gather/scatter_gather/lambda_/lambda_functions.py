@@ -20,21 +20,46 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 ###
 from constructs import Construct
+import hashlib
+import json
 import pathlib
 from aws_cdk import (
+    aws_dynamodb as dynamodb,
     aws_lambda as lambda_,
     aws_lambda_destinations as destinations,
     aws_sqs as sqs,
     aws_sns as sns,
     Duration
 )
+from scatter_gather import performance_profile
+
+# timeouts of the functions consuming SQS queues, the visibility timeouts of the queues are derived from them
+AGGREGATOR_TIMEOUT_SECONDS = 10
+# the Lambda default timeout
+RESPONDER_TIMEOUT_SECONDS = 3
 
 # CDK construct to create the lambda functions and destinations for both use cases
 class LambdaStates(Construct):
     
-    def __init__(self, scope: Construct, id_: str, requester_sns_topic:sns.ITopic = None, responder_sqs_queue:sqs.IQueue = None, **kwargs) -> None:
+    def __init__(self, scope: Construct, id_: str, requester_sns_topic:sns.ITopic = None, responder_sqs_queue:sqs.IQueue = None, vendor_responder:bool = False, **kwargs) -> None:
         super().__init__(scope, id_)
         
+        # memory, architecture and provisioned concurrency of the functions come from the performance profile
+        profile = performance_profile.settings(self)
+        architecture = lambda_.Architecture.ARM_64 if profile["lambda_architecture"] == "arm64" else lambda_.Architecture.X86_64
+        tuning = {"memory_size": profile["lambda_memory_size"], "architecture": architecture}
+        self.provisioned_concurrency = profile["provisioned_concurrency"]
+        self.aliases = {}
+        
+        # modules shared by the python functions of all implementations (e.g. quote_store)
+        self.shared_layer = lambda_.LayerVersion(
+            self,
+            "shared-layer",
+            code=lambda_.Code.from_asset(str(pathlib.Path(__file__).parents[3].joinpath("shared", "layer").resolve())),
+            compatible_runtimes=[lambda_.Runtime.PYTHON_3_9],
+            compatible_architectures=[lambda_.Architecture.X86_64, lambda_.Architecture.ARM_64]
+        )
+        
         requester_destination = None
         if requester_sns_topic is not None:
             requester_destination = destinations.SnsDestination(requester_sns_topic)
@@ -46,9 +71,46 @@ class LambdaStates(Construct):
             code=lambda_.Code.from_asset(str(pathlib.Path(__file__).parent.joinpath("requester").resolve())),
             handler="app.lambda_handler",
             on_success=requester_destination,
-            tracing=lambda_.Tracing.ACTIVE
+            layers=[self.shared_layer],
+            tracing=lambda_.Tracing.ACTIVE,
+            **tuning
         )
         
+        # optional cache of aggregated quotes, enabled with a positive quote_cache_ttl_seconds in cdk.json.
+        # the cache version changes with the car_rentals configuration, so changed rates never hit older entries
+        self.quote_cache_table = None
+        self.quote_cache_writer = None
+        self.quote_cache_environment = {}
+        cache_ttl = self.node.try_get_context("quote_cache_ttl_seconds") or 0
+        if cache_ttl > 0:
+            self.quote_cache_table = dynamodb.Table(self, "QuoteCacheTable",
+                partition_key=dynamodb.Attribute(
+                    name="cacheKey",
+                    type=dynamodb.AttributeType.STRING),
+                time_to_live_attribute="expiresAt",
+                billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST)
+            self.quote_cache_environment = {
+                "QUOTE_CACHE_TABLE_NAME": self.quote_cache_table.table_name,
+                "QUOTE_CACHE_TTL_SECONDS": str(cache_ttl),
+                "QUOTE_CACHE_VERSION": hashlib.sha256(json.dumps(self.node.try_get_context("car_rentals"), sort_keys=True).encode("utf-8")).hexdigest()[:16]
+            }
+            self.quote_cache_table.grant_read_data(self.requester)
+            for key, value in self.quote_cache_environment.items():
+                self.requester.add_environment(key, value)
+            # stores the gathered quotes of a request in the cache (step function use case)
+            self.quote_cache_writer = lambda_.Function(
+                self,
+                f"quote-cache-writer",
+                runtime=lambda_.Runtime.PYTHON_3_9,
+                code=lambda_.Code.from_asset(str(pathlib.Path(__file__).parent.joinpath("requester").resolve())),
+                handler="app.cache_handler",
+                layers=[self.shared_layer],
+                environment=self.quote_cache_environment,
+                tracing=lambda_.Tracing.ACTIVE,
+                **tuning
+            )
+            self.quote_cache_table.grant_write_data(self.quote_cache_writer)
+        
         responder_destination = None
         if responder_sqs_queue is not None:
             responder_destination = destinations.SqsDestination(responder_sqs_queue) 
@@ -57,7 +119,8 @@ class LambdaStates(Construct):
         car_rental_list = self.node.try_get_context("car_rentals")
         self.responder = []
         for vendor in car_rental_list:
-            env = dict(car_rental_list[vendor])
+            # lambda environment values are strings, a rate_table given in cdk.json is passed on as JSON
+            env = {key: value if isinstance(value, str) else json.dumps(value) for key, value in car_rental_list[vendor].items()}
             env['vendor'] = vendor
             self.responder.append(lambda_.Function(
                 self,
@@ -67,18 +130,115 @@ class LambdaStates(Construct):
                 handler="app.lambda_handler",
                 on_success=responder_destination,
                 environment= env,
-                tracing=lambda_.Tracing.ACTIVE
+                layers=[self.shared_layer],
+                tracing=lambda_.Tracing.ACTIVE,
+                **tuning
             )
         )
         
+        # one responder for any vendor, the Map workflow passes the vendor and its rates with every request
+        self.vendor_responder = None
+        if vendor_responder:
+            self.vendor_responder = lambda_.Function(
+                self,
+                f"responder-any-vendor",
+                runtime=lambda_.Runtime.PYTHON_3_9,
+                code=lambda_.Code.from_asset(str(pathlib.Path(__file__).parent.joinpath("responder").resolve())),
+                handler="app.lambda_handler",
+                layers=[self.shared_layer],
+                tracing=lambda_.Tracing.ACTIVE,
+                **tuning
+            )
+        
         self.aggregator = lambda_.Function(
             self,
             f"aggregator",
             runtime=lambda_.Runtime.PYTHON_3_9,
             code=lambda_.Code.from_asset(str(pathlib.Path(__file__).parent.joinpath("aggregator").resolve())),
             handler="app.lambda_handler",
+            layers=[self.shared_layer],
             tracing=lambda_.Tracing.ACTIVE,
-            timeout=Duration.seconds(10)
+            timeout=Duration.seconds(AGGREGATOR_TIMEOUT_SECONDS),
+            **tuning
         )
         
-        
\ No newline at end of file
+        # publishes the quotes received so far once the deadline of a quote request passed (sns use case only)
+        self.gather_deadline = None
+        if responder_sqs_queue is not None:
+            self.gather_deadline = lambda_.Function(
+                self,
+                f"gather-deadline",
+                runtime=lambda_.Runtime.PYTHON_3_9,
+                code=lambda_.Code.from_asset(str(pathlib.Path(__file__).parent.joinpath("aggregator").resolve())),
+                handler="app.deadline_handler",
+                layers=[self.shared_layer],
+                tracing=lambda_.Tracing.ACTIVE,
+                timeout=Duration.seconds(AGGREGATOR_TIMEOUT_SECONDS),
+                **tuning
+            )
+        
+        # returns the stored quotes of a request, the best offer or a page of vendor quotes (sns use case only)
+        self.quote_reader = None
+        if responder_sqs_queue is not None:
+            self.quote_reader = lambda_.Function(
+                self,
+                f"quote-reader",
+                runtime=lambda_.Runtime.PYTHON_3_9,
+                code=lambda_.Code.from_asset(str(pathlib.Path(__file__).parent.joinpath("aggregator").resolve())),
+                handler="app.reader_handler",
+                layers=[self.shared_layer],
+                tracing=lambda_.Tracing.ACTIVE,
+                **tuning
+            )
+        
+        # hedged vendor calls of the responders (responder/hedging.py), off unless hedge_percentile is set in cdk.json
+        hedge_percentile = self.node.try_get_context("hedge_percentile") or 0
+        hedge_initial_delay_ms = self.node.try_get_context("hedge_initial_delay_ms") or 0
+        if hedge_percentile:
+            for responder in [*self.responder, self.vendor_responder]:
+                if responder is not None:
+                    responder.add_environment("HEDGE_PERCENTILE", str(hedge_percentile))
+                    if hedge_initial_delay_ms:
+                        responder.add_environment("HEDGE_INITIAL_DELAY_MS", str(hedge_initial_delay_ms))
+        
+        # the stage metrics of the functions are tagged with the design of the stack (shared/layer/python/instrumentation.py)
+        self.design = "sns" if requester_sns_topic is not None else "sfn"
+        functions = [self.requester, self.aggregator, *self.responder, self.quote_cache_writer, self.vendor_responder, self.gather_deadline, self.quote_reader]
+        for function in functions:
+            if function is not None:
+                function.add_environment("SCATTER_GATHER_DESIGN", self.design)
+        
+        # botocore profile of the AWS clients of the functions (shared/layer/python/lambda_runtime.py): the functions a caller
+        # waits for fail fast, the aggregator writes a whole SQS batch, the deadline and cache writes yield to both
+        client_profiles = {"requester": "interactive", "quote-reader": "interactive", "aggregator": "burst",
+                           "gather-deadline": "background", "quote-cache-writer": "background"}
+        for function in functions:
+            if function is not None:
+                function.add_environment("CLIENT_PROFILE", client_profiles.get(function.node.id, "default"))
+        
+        # with provisioned concurrency the functions on the request path are invoked through their "live" alias.
+        # an asynchronous invoke config belongs to one qualifier, so the alias carries the destination too
+        if self.provisioned_concurrency > 0:
+            self.live(self.requester, requester_destination)
+            for responder in self.responder:
+                self.live(responder, responder_destination)
+            if self.vendor_responder is not None:
+                self.live(self.vendor_responder)
+            if responder_sqs_queue is not None:
+                self.live(self.aggregator)
+    
+    def live(self, function: lambda_.Function, on_success=None) -> lambda_.Alias:
+        alias = lambda_.Alias(
+            self,
+            f"{function.node.id}-live",
+            alias_name="live",
+            version=function.current_version,
+            provisioned_concurrent_executions=self.provisioned_concurrency,
+            on_success=on_success
+        )
+        self.aliases[function.node.id] = alias
+        return alias
+    
+    # what invokes a function targets: its "live" alias with provisioned concurrency, the function otherwise
+    def target(self, function: lambda_.Function) -> lambda_.IFunction:
+        return self.aliases.get(function.node.id, function)
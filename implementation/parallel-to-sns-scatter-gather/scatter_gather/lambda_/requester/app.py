@@ -19,17 +19,109 @@
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 ###
-import json
 import logging
+import os
 import uuid
 
-logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', level=logging.INFO, datefmt='%Y-%m-%d %H:%M:%S')
-logging.getLogger().setLevel(logging.INFO)
+import envelope
+import instrumentation
+import lambda_runtime
+import quote_cache
+import sns_batch
+import sqs_batch
+
+# the Lambda runtime installs the log handler, only the level is set (LOG_LEVEL)
+lambda_runtime.get_logger()
+
+# optional cache of aggregated quotes, None unless the stack configures a cache table and TTL
+cache = quote_cache.QuoteCache.from_environment()
+# sns use case: a cached aggregate is published to the quotes topic right away
+RESULT_TOPIC_ARN = os.getenv('RESULT_TOPIC_ARN')
+# bulk mode (sns use case): the requester publishes the quote requests to the scatter topic itself,
+# BULK_CHUNK_SIZE requests per message
+SCATTER_TOPIC_ARN = os.getenv('SCATTER_TOPIC_ARN')
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', '100'))
+# sns use case: every quote request that is not cached is also sent to the deadline queue, delayed by the deadline of
+# the request: its deadline_seconds, GATHER_DEADLINE_SECONDS without one, at most the 15 minutes SQS delays a message
+DEADLINE_QUEUE_URL = os.getenv('DEADLINE_QUEUE_URL')
+GATHER_DEADLINE_SECONDS = int(os.getenv('GATHER_DEADLINE_SECONDS', '30'))
+MAX_DELAY_SECONDS = 900
+
+
+def deadline_seconds(event):
+    return max(0, min(int(event.get('deadline_seconds', GATHER_DEADLINE_SECONDS)), MAX_DELAY_SECONDS))
+
+
+# aggregate of a cached request, published to the quotes topic like the aggregator publishes complete ones
+def cached_aggregate(message):
+    return {'uuid': message['data']['uuid'], 'partial': False, 'missing': [], 'cached': True, 'quotes': message['quotes']}
+
+
+# quotes of the step function as they are cached, without the quote id of the request that was priced
+def without_ids(quotes):
+    return [{field: value for field, value in quote.items() if field != 'uuid'} for quote in quotes]
+
+
+# looks a request up in the quote cache, a cached request carries its quotes and is skipped by the responders.
+# the quotes of the step function (a list) get the quote id of the request, the aggregates of the sns use case
+# carry it next to the quotes
+def lookup(message):
+    # requests with their own vendor list (Map workflow) are not cached
+    if cache is None or 'vendors' in message:
+        return False
+    with instrumentation.span('cache.get', quote_id=message['data']['uuid']):
+        quotes = cache.get(message['data'])
+    if quotes is None:
+        return False
+    if isinstance(quotes, list):
+        quotes = [dict(quote, uuid=message['data']['uuid']) for quote in quotes]
+    message['data']['cached'] = True
+    message['quotes'] = quotes
+    return True
+
+
+# bulk mode ({"requests": [{"data": {...}}, ...], "deadline_seconds": ...}): every request gets its uuid, cached requests are answered
+# right away and the others are published to the scatter topic in bulk messages of BULK_CHUNK_SIZE requests,
+# up to 10 messages per PublishBatch call. The responders price the requests of a bulk message together.
+def bulk_handler(event, context):
+    if not SCATTER_TOPIC_ARN:
+        raise Exception("bulk requests need the scatter topic (SCATTER_TOPIC_ARN)")
+    pending = []
+    cached = []
+    for message in event['requests']:
+        if 'data' not in message:
+            raise Exception("data not found in request")
+        message['data']['uuid'] = str(uuid.uuid4())
+        (cached if lookup(message) else pending).append(message)
+    chunks = [pending[start:start + BULK_CHUNK_SIZE] for start in range(0, len(pending), BULK_CHUNK_SIZE)]
+    messages = [envelope.bulk_message(chunk) for chunk in chunks]
+    failed = []
+    # the deadline of a chunk is sent first, a chunk without one is not published
+    unscheduled = set()
+    if DEADLINE_QUEUE_URL and chunks:
+        with instrumentation.span('sqs.send_batch', quote_id=[message['data']['uuid'] for message in pending]):
+            unscheduled = set(sqs_batch.send(DEADLINE_QUEUE_URL, messages, deadline_seconds(event)))
+    for index in sorted(unscheduled):
+        failed.extend(message['data']['uuid'] for message in chunks[index])
+    scheduled = [index for index in range(len(chunks)) if index not in unscheduled]
+    with instrumentation.span('sns.publish_batch', quote_id=[message['data']['uuid'] for index in scheduled for message in chunks[index]]):
+        for index in sns_batch.publish(SCATTER_TOPIC_ARN, [messages[index] for index in scheduled]):
+            failed.extend(message['data']['uuid'] for message in chunks[scheduled[index]])
+    if cached and RESULT_TOPIC_ARN:
+        with instrumentation.span('sns.publish_batch', quote_id=[message['data']['uuid'] for message in cached]):
+            for index in sns_batch.publish(RESULT_TOPIC_ARN, [envelope.dumps(cached_aggregate(message)) for message in cached]):
+                failed.append(cached[index]['data']['uuid'])
+    logging.info("bulk of %d quote requests: %d cached, %d messages, %d failed", len(event['requests']), len(cached), len(chunks), len(failed))
+    # the acknowledgement is skipped by the responders when the destination delivers it to the scatter topic
+    return envelope.bulk_response([message['data']['uuid'] for message in event['requests']], cached=len(cached), failed=failed)
 
 
 # Lambda function handler enriches the received event with an unique id for quote request and returns it
+@instrumentation.handler('requester')
 def lambda_handler(event, context):
     
+    if 'requests' in event:
+        return bulk_handler(event, context)
     # create a unique id for the quote request
     uuid_quote = uuid.uuid4()
     # assumption data is present in event
@@ -39,10 +131,28 @@ def lambda_handler(event, context):
         raise Exception("data not found in event")
     
     message = event
-    logging.info(f"sending quote request: {message}")
+    # the responders skip a cached request, its quotes travel with the request
+    if lookup(message):
+        if RESULT_TOPIC_ARN:
+            with instrumentation.span('sns.publish', quote_id=message['data']['uuid']):
+                lambda_runtime.client('sns').publish(TopicArn=RESULT_TOPIC_ARN, Message=envelope.dumps(cached_aggregate(message)))
+    elif DEADLINE_QUEUE_URL:
+        # sent before the destination publishes the request, a failed send fails the invocation
+        with instrumentation.span('sqs.send', quote_id=message['data']['uuid']):
+            lambda_runtime.client('sqs').send_message(QueueUrl=DEADLINE_QUEUE_URL, MessageBody=envelope.request_message(message),
+                                                      DelaySeconds=deadline_seconds(event))
+    instrumentation.log_payload(logging.getLogger(), "sending quote request: ", message)
     
-    # Return a response
-    return {
-        'statusCode': 200,
-        'body': json.dumps(message)
-    }
\ No newline at end of file
+    # Return a response, the message is encoded once by the lambda destination (or the step function)
+    return envelope.request_response(message)
+
+
+# Lambda function handler stores the quotes gathered for a request in the quote cache (step function use case).
+# quotes with an unavailable vendor are not cached, the next request asks the vendor again
+@instrumentation.handler('quote-cache-writer')
+def cache_handler(event, context):
+    complete = not any(quote.get('unavailable') for quote in event['quotes'])
+    if cache is not None and complete and 'vendors' not in event['request'] and not event['request']['data'].get('cached'):
+        with instrumentation.span('cache.put'):
+            cache.put(event['request']['data'], without_ids(event['quotes']))
+    return {'quotes': event['quotes']}
@@ -22,54 +22,188 @@
 import json
 import logging
 import os
+from collections import OrderedDict
 
+import envelope
+import faults
+import hedging
+import instrumentation
+import lambda_runtime
+import pricing
+import sqs_batch
 
-logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', level=logging.INFO, datefmt='%Y-%m-%d %H:%M:%S')
-logging.getLogger().setLevel(logging.INFO)
+# the Lambda runtime installs the log handler, only the level is set (LOG_LEVEL)
+lambda_runtime.get_logger()
 
 # get environment variables
-BASE_RATE = os.getenv('base_rate')
 VENDOR = os.getenv('vendor')
+# the rate table of the vendor (rate_table, rate_table_file or base_rate) is loaded once per container.
+# the vendor responder of the Map workflow has no vendor of its own, it gets the vendor with every request
+engine = pricing.PricingEngine(pricing.RateTable.from_environment()) if VENDOR else None
+vendor_engines = {}
+# latency and faults of the vendor (faults in car_rentals), None for a vendor that always answers right away
+injector = faults.FaultInjector.from_environment() if VENDOR else None
+vendor_injectors = {}
+# hedged vendor calls (HEDGE_PERCENTILE), None without hedging. the vendor responder of the Map workflow
+# keeps a hedger per vendor, each vendor has a latency distribution of its own
+hedger = hedging.Hedger.from_environment()
+hedgers = {}
+# queue the quotes are sent to when the responder consumes quote requests from SQS (no lambda destination there)
+QUOTE_QUEUE_URL = os.getenv('QUOTE_QUEUE_URL')
+
+# SendMessageBatch accepts at most 10 messages per call
+SEND_BATCH_LIMIT = 10
+
+# one call to the vendor returning the prices of its requests: the latency and faults of the vendor (its fault
+# injector, None for a vendor that answers right away) and the pricing. with hedging the whole call is hedged,
+# the attempt that lost is cancelled and joined before the prices are returned
+def call_vendor(vendor_injector, vendor, quote_ids, context, price):
+    def attempt(cancelled=None):
+        if vendor_injector is not None:
+            vendor_injector.inject(context, cancelled)
+        with instrumentation.span('price', vendor=vendor, quote_id=quote_ids):
+            return price()
+    if vendor_injector is None and hedger is None:
+        return attempt()
+    with instrumentation.span('vendor.call', vendor=vendor, quote_id=quote_ids):
+        if hedger is None:
+            return attempt()
+        if vendor not in hedgers:
+            hedgers[vendor] = hedger if vendor == VENDOR else hedger.copy()
+        # the spans of the attempts are written with the ones of the invocation
+        return hedgers[vendor].call(instrumentation.in_invocation(attempt))
+
+# function generates the price quotes for the rental company(vendor), the whole batch is priced in one pass.
+# a failed vendor call raises its VendorError
+def generate_price_quotes(bodies, context=None):
+    if not bodies:
+        return bodies
+    prices = call_vendor(injector, VENDOR, [message_body['data'].get('uuid') for message_body in bodies], context,
+                         lambda: engine.price_batch([message_body['data'] for message_body in bodies]))
+    for message_body, price in zip(bodies, prices):
+        message_body['data']['price_quote'] = price
+        message_body['data']['vendor'] = VENDOR
+    return bodies
 
 # function generates the price quote for the rental company(vendor)
-def generate_price_quote(body):
+def generate_price_quote(body, context=None):
+    return generate_price_quotes([body], context)[0]
+
+# function generates the price quote for a vendor given with the request ({"vendor": "Avis", "base_rate": "99"})
+def generate_vendor_price_quote(body, vendor, context=None):
+    config_key = json.dumps(vendor, sort_keys=True)
+    if config_key not in vendor_engines:
+        vendor_engines[config_key] = pricing.PricingEngine(pricing.RateTable.from_environment(vendor))
+        vendor_injectors[config_key] = faults.FaultInjector.from_environment(vendor)
     message_body = body
-    daily_charge = int(BASE_RATE)
-    logging.info(f"message_body (before): {message_body}")
-    # create price quote based on days of rental
-    days = int(message_body['data']['days_rental'])
-    message_body['data']['price_quote'] = daily_charge * days
-    message_body['data']['vendor'] = VENDOR
-    logging.info(f"message_body (after): {message_body}")
+    message_body['data']['price_quote'] = call_vendor(vendor_injectors[config_key], vendor['vendor'], message_body['data'].get('uuid'),
+                                                      context, lambda: vendor_engines[config_key].price(message_body['data']))
+    message_body['data']['vendor'] = vendor['vendor']
     return message_body
 
-def get_message_body_json(record):
-    sns_record = record['Sns']
-    sns_message = json.loads(sns_record['Message'])
-    body = sns_message['responsePayload']['body']
-    if (isinstance(body, str)):
-        body = json.loads(sns_message['responsePayload']['body'])
-    logging.debug(f"body: {body}, {type(body)}")
-    return body
+# sends one message per record with the quotes of its requests (a bulk message carries many), shaped like the
+# record of the SQS destination, returns the message ids that failed
+def send_quotes(quotes):
+    groups = OrderedDict()
+    for message_id, data in quotes:
+        groups.setdefault(message_id, []).append(data)
+    groups = list(groups.items())
+    failed = []
+    for start in range(0, len(groups), SEND_BATCH_LIMIT):
+        chunk = groups[start:start + SEND_BATCH_LIMIT]
+        entries = [
+            {'Id': str(index), 'MessageBody': envelope.quotes_message(record_quotes)}
+            for index, (_, record_quotes) in enumerate(chunk)
+        ]
+        with instrumentation.span('sqs.send', vendor=VENDOR, quote_id=[data.get('uuid') for _, record_quotes in chunk for data in record_quotes]):
+            response = lambda_runtime.client('sqs').send_message_batch(QueueUrl=QUOTE_QUEUE_URL, Entries=entries)
+        for failure in response.get('Failed', []):
+            failed.append(chunk[int(failure['Id'])][0])
+    return failed
+
+# quote requests of a record that can be priced. a record that can not be decoded, or a single request that
+# can not be priced, is a poison record (ValueError); an invalid request of a bulk message is dropped and
+# published without this vendor by the gather deadline
+def record_requests(record):
+    try:
+        bodies = envelope.requests(record)
+    except (KeyError, TypeError, ValueError) as error:
+        raise ValueError(f"{type(error).__name__}: {error}") from error
+    valid = []
+    for body in bodies:
+        try:
+            pricing.validate(body['data'])
+        except (KeyError, TypeError, ValueError) as error:
+            if len(bodies) == 1:
+                raise ValueError(f"{type(error).__name__}: {error}") from error
+            logging.warning(f"invalid quote request in a bulk message: {type(error).__name__}: {error}")
+            continue
+        valid.append(body)
+    # the requester answered cached requests already
+    return [body for body in valid if not body['data'].get('cached')]
+
+# prices every record of an SQS batch, failed records are reported back through batchItemFailures
+# and invalid quote requests go to the dead-letter queue once the batch is priced. a failed vendor call reports
+# the records it priced as failed instead of failing the invocation, so a poison record is moved only once
+def handle_sqs_batch(records, context=None):
+    bodies = []
+    message_ids = []
+    failed = []
+    poisoned = []
+    with instrumentation.span('parse', vendor=VENDOR) as tags:
+        for record in records:
+            try:
+                record_bodies = record_requests(record)
+            except ValueError as error:
+                logging.exception(f"invalid record: {record.get('messageId')}")
+                poisoned.append((record, str(error)))
+                continue
+            bodies.extend(record_bodies)
+            message_ids.extend(record['messageId'] for _ in record_bodies)
+        tags['quote_id'] = [body['data'].get('uuid') for body in bodies]
+    # one vendor call prices the batch, SQS delivers its records again when the call failed
+    try:
+        quotes = [(message_id, body['data']) for message_id, body in zip(message_ids, generate_price_quotes(bodies, context))]
+    except faults.VendorError:
+        logging.exception(f"vendor call failed for {len(bodies)} quote requests")
+        quotes = []
+        failed.extend(OrderedDict.fromkeys(message_ids))
+    failed.extend(send_quotes(quotes))
+    failed.extend(sqs_batch.dead_letter(poisoned))
+    instrumentation.metric('Quotes', len(quotes), vendor=VENDOR)
+    logging.info(f"priced {len(quotes)} quote requests, {len(failed)} failed")
+    return envelope.quotes_response([data for _, data in quotes], **sqs_batch.response(failed))
+
 # lambda function receives quote request from the customer and generates the price quote.
-# lambda functions supports both solutions step function and sns.
+# lambda functions supports both solutions step function and sns (directly or through an SQS queue).
+# Every record of an invocation is priced: the quotes are returned together and the SQS destination
+# delivers them to the aggregator in one message.
+@instrumentation.handler('responder', vendor=VENDOR)
 def lambda_handler(event, context):
 
-    logging.debug("Received event: " + json.dumps(event, indent=2))
+    instrumentation.log_payload(logging.getLogger(), "Received event: ", event)
     # sns use case
     if 'Records' in event:
-        for record in event['Records']:
-            if 'Sns' in record:
-                body = get_message_body_json(record)                
-                # generate quote here - for now just pass the received quote request
-                message_body = generate_price_quote(body)
-    else: # step function use case
-        message_body = generate_price_quote(event)
+        if event['Records'] and event['Records'][0].get('eventSource') == 'aws:sqs':
+            return handle_sqs_batch(event['Records'], context)
+        with instrumentation.span('parse', vendor=VENDOR) as tags:
+            bodies = [body for record in event['Records'] if 'Sns' in record for body in record_requests(record)]
+            tags['quote_id'] = [body['data'].get('uuid') for body in bodies]
+        # a failed vendor call fails the invocation, the asynchronous invocation is retried by Lambda
+        quotes = [body['data'] for body in generate_price_quotes(bodies, context)]
+        instrumentation.metric('Quotes', len(quotes), vendor=VENDOR)
+        instrumentation.log_payload(logging.getLogger(), "quotes: ", quotes)
+        # Return a response, the quotes are encoded once by the lambda destination
+        return envelope.quotes_response(quotes)
+    # step function use case, the Map workflow passes the vendor along with the request
+    if 'vendor' in event:
+        message_body = generate_vendor_price_quote({'data': event['data']}, event['vendor'], context)
+    else:
+        # a failed vendor call fails the task of the workflow
+        message_body = generate_price_quote(event, context)
     
-    logging.info(f"message_body: {message_body}")
+    instrumentation.metric('Quotes', 1, vendor=message_body['data']['vendor'])
+    instrumentation.log_payload(logging.getLogger(), "message_body: ", message_body)
         
     # Return a response
-    return {
-        'statusCode': 200,
-        'data': json.dumps(message_body['data'])
-    }
\ No newline at end of file
+    return envelope.quote_response(message_body['data'])
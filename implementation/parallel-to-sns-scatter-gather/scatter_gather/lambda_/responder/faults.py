@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: faults.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Latency and fault injection of the responders. Real vendors answer with a long-tail latency, fail, throttle
+# or time out; a vendor of car_rentals in cdk.json can model that with a "faults" entry (passed to the
+# responder as JSON in the faults environment variable, or with the vendor of a Map state). The same entry
+# works deployed and in tools/simulator.py. FAULT_INJECTION=off switches the injection off without a redeploy.
+#
+# faults (JSON), every entry is optional:
+#   {
+#     "latency_ms": {"distribution": "lognormal", "median": 80, "p99": 1500},
+#                                    or {"distribution": "fixed", "value": 200}
+#                                    or {"distribution": "uniform", "min": 50, "max": 400}
+#                                    or {"distribution": "exponential", "mean": 120}
+#     "max_latency_ms": 5000,        cap of a drawn latency
+#     "error_rate": 0.01,            share of the invocations failing with VendorError
+#     "throttle_rate": 0.02,         share of the invocations failing with VendorThrottled right away
+#     "timeout_rate": 0.001,         share of the invocations running into the function timeout
+#     "seed": 7                      repeatable draws
+#   }
+import json
+import math
+import os
+import random
+import time
+
+# z-score of the 99th percentile of the standard normal distribution
+P99_Z = 2.326347874
+
+
+class VendorError(Exception):
+    """The vendor answered with an error."""
+
+
+class VendorThrottled(VendorError):
+    """The vendor rejected the request, e.g. HTTP 429."""
+
+
+class VendorTimeout(VendorError):
+    """The vendor did not answer within the function timeout."""
+
+
+class VendorCallCancelled(VendorError):
+    """The call was cancelled before the vendor answered, e.g. a hedged call that lost."""
+
+
+class FaultInjector:
+
+    def __init__(self, latency_ms=None, max_latency_ms=None, error_rate=0.0, throttle_rate=0.0, timeout_rate=0.0, seed=None):
+        self.latency_ms = dict(latency_ms or {})
+        self.max_latency_ms = float(max_latency_ms) if max_latency_ms is not None else None
+        self.error_rate = float(error_rate)
+        self.throttle_rate = float(throttle_rate)
+        self.timeout_rate = float(timeout_rate)
+        self.random = random.Random(seed)
+        distribution = self.latency_ms.get('distribution', 'fixed')
+        if self.latency_ms and distribution not in ('fixed', 'uniform', 'exponential', 'lognormal'):
+            raise ValueError(f"unknown latency distribution: {distribution}")
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('latency_ms'), config.get('max_latency_ms'), config.get('error_rate', 0.0),
+                   config.get('throttle_rate', 0.0), config.get('timeout_rate', 0.0), config.get('seed'))
+
+    # faults of the vendor (JSON), also takes the vendor entries of a Map state where faults is an object.
+    # None when the vendor has no faults or the injection is switched off
+    @classmethod
+    def from_environment(cls, environ=os.environ):
+        if os.getenv('FAULT_INJECTION', 'on').lower() == 'off' or not environ.get('faults'):
+            return None
+        config = environ['faults']
+        return cls.from_config(json.loads(config) if isinstance(config, str) else config)
+
+    # latency of one call in seconds
+    def latency(self):
+        if not self.latency_ms:
+            return 0.0
+        settings = self.latency_ms
+        distribution = settings.get('distribution', 'fixed')
+        if distribution == 'fixed':
+            value = float(settings.get('value', 0))
+        elif distribution == 'uniform':
+            value = self.random.uniform(float(settings.get('min', 0)), float(settings['max']))
+        elif distribution == 'exponential':
+            value = self.random.expovariate(1.0 / float(settings['mean']))
+        else:
+            # median and p99 of the latency give mu and sigma of the underlying normal distribution
+            mu = math.log(float(settings['median']))
+            sigma = max(0.0, (math.log(float(settings['p99'])) - mu) / P99_Z)
+            value = self.random.lognormvariate(mu, sigma)
+        if self.max_latency_ms is not None:
+            value = min(value, self.max_latency_ms)
+        return max(0.0, value) / 1000.0
+
+    # one call to the vendor: throttled calls fail right away, other calls take their latency and then fail or
+    # answer. a timed out call waits for the rest of the function timeout (context), the Lambda runtime ends it.
+    # a call stops waiting as soon as cancelled (a threading.Event) is set
+    def inject(self, context=None, cancelled=None):
+        draw = self.random.random()
+        if draw < self.throttle_rate:
+            raise VendorThrottled("vendor throttled the request")
+        draw -= self.throttle_rate
+        if draw < self.timeout_rate:
+            remaining = context.get_remaining_time_in_millis() / 1000.0 if context is not None else 0.0
+            self.wait(remaining, cancelled)
+            raise VendorTimeout("vendor did not answer in time")
+        draw -= self.timeout_rate
+        self.wait(self.latency(), cancelled)
+        if draw < self.error_rate:
+            raise VendorError("vendor failed to price the request")
+
+    # waits out the latency of a call, a cancelled call stops waiting and fails
+    @staticmethod
+    def wait(seconds, cancelled=None):
+        if cancelled is None:
+            time.sleep(seconds)
+        elif cancelled.wait(seconds):
+            raise VendorCallCancelled("vendor call cancelled")
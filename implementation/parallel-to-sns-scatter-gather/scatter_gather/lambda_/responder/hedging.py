@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: hedging.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Hedged vendor calls. A second call to the vendor starts when the first one has not answered within a
+# percentile of the latencies observed by the container (HEDGE_PERCENTILE, e.g. 95), or right away when the
+# first call fails; the first answer wins. Until enough latencies are observed the hedge starts after
+# HEDGE_INITIAL_DELAY_MS. A call takes a threading.Event and stops when it is set: the calls that lost are
+# cancelled and joined before the answer is returned, so none of them runs on in a container Lambda freezes.
+import collections
+import math
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+# latencies kept for the percentile, and the number needed before it is used
+WINDOW = 200
+MIN_SAMPLES = 20
+
+
+class Hedger:
+
+    def __init__(self, percentile, initial_delay_ms=None, max_attempts=2, window=WINDOW, min_samples=MIN_SAMPLES):
+        if not 0 < percentile < 100:
+            raise ValueError(f"hedge percentile must be between 0 and 100: {percentile}")
+        self.percentile = float(percentile)
+        self.initial_delay = float(initial_delay_ms) / 1000.0 if initial_delay_ms is not None else None
+        self.max_attempts = max_attempts
+        self.min_samples = min_samples
+        self.latencies = collections.deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    # HEDGE_PERCENTILE (0 or unset: no hedging) and HEDGE_INITIAL_DELAY_MS, None without hedging
+    @classmethod
+    def from_environment(cls, environ=os.environ):
+        percentile = float(environ.get('HEDGE_PERCENTILE') or 0)
+        if not percentile:
+            return None
+        initial_delay_ms = float(environ.get('HEDGE_INITIAL_DELAY_MS') or 0)
+        return cls(percentile, initial_delay_ms or None)
+
+    # a hedger with the same settings and no latencies observed yet
+    def copy(self):
+        return Hedger(self.percentile, self.initial_delay * 1000.0 if self.initial_delay is not None else None,
+                      self.max_attempts, self.latencies.maxlen, self.min_samples)
+
+    # seconds to wait for a call before the hedge starts, None while there is neither a percentile nor an initial delay
+    def delay(self):
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return self.initial_delay
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered), math.ceil(len(ordered) * self.percentile / 100.0)) - 1]
+
+    # runs one attempt in a thread of its own: call(cancelled) with the event that cancels it
+    def _start(self, call, attempts):
+        future = Future()
+        cancelled = threading.Event()
+
+        def attempt():
+            started = time.monotonic()
+            try:
+                result = call(cancelled)
+            except Exception as error:
+                future.set_exception(error)
+                return
+            with self.lock:
+                self.latencies.append(time.monotonic() - started)
+            future.set_result(result)
+
+        thread = threading.Thread(target=attempt, daemon=True)
+        attempts[future] = (cancelled, thread)
+        thread.start()
+        return future
+
+    # runs call(cancelled) and up to max_attempts - 1 hedges of it, returns the first answer and raises the last error
+    # when every attempt failed. the attempts still running are cancelled and joined first
+    def call(self, call):
+        attempts = {}
+        pending = {self._start(call, attempts)}
+        error = None
+        try:
+            while pending:
+                timeout = self.delay() if len(attempts) < self.max_attempts else None
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+                    error = future.exception()
+                # no answer in time, or a failed call: start the hedge
+                if len(attempts) < self.max_attempts and (not done or not pending):
+                    pending.add(self._start(call, attempts))
+            raise error
+        finally:
+            for cancelled, _ in attempts.values():
+                cancelled.set()
+            for _, thread in attempts.values():
+                thread.join()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: pricing.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Pricing engine of the responders. The rate table of a vendor is loaded once per container and a whole
+# batch of quote requests is priced column by column (with NumPy when it is available).
+#
+# rate table (JSON), every entry but base_rate is optional:
+#   {
+#     "base_rate": 99,                                  daily charge
+#     "car_types": {"L": 1.5, "S": 0.8},                multiplier per car type, 1.0 for other types
+#     "seasons": {"7": 1.2, "8": 1.2},                  multiplier per month of the pickup date, 1.0 for other months
+#     "discounts": {"7": 0.05, "28": 0.15}              discount from a number of rental days on
+#   }
+import bisect
+import datetime
+import json
+import os
+
+try:
+    import numpy
+except ImportError:  # the python runtime of lambda does not ship numpy, fall back to plain lists
+    numpy = None
+
+
+class RateTable:
+
+    def __init__(self, base_rate, car_types=None, seasons=None, discounts=None):
+        self.base_rate = float(base_rate)
+        self.car_types = {str(car_type): float(value) for car_type, value in (car_types or {}).items()}
+        self.seasons = {int(month): float(value) for month, value in (seasons or {}).items()}
+        # (minimum days, discount) sorted by minimum days
+        self.discounts = sorted((int(days), float(value)) for days, value in (discounts or {}).items())
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['base_rate'], config.get('car_types'), config.get('seasons'), config.get('discounts'))
+
+    # rate table of the vendor: rate_table (JSON) or rate_table_file, plain base_rate otherwise.
+    # also takes the vendor entries of a Map state, where rate_table is an object
+    @classmethod
+    def from_environment(cls, environ=os.environ):
+        if environ.get('rate_table'):
+            config = environ['rate_table']
+            config = dict(json.loads(config) if isinstance(config, str) else config)
+        elif environ.get('rate_table_file'):
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), environ['rate_table_file'])
+            with open(path) as rate_table_file:
+                config = json.load(rate_table_file)
+        else:
+            config = {}
+        config.setdefault('base_rate', environ.get('base_rate'))
+        return cls.from_config(config)
+
+
+# month of the pickup date of a request, the current month when the request has none
+def pickup_month(data, today=None):
+    if data.get('pickup_date'):
+        return datetime.date.fromisoformat(data['pickup_date']).month
+    return (today or datetime.date.today()).month
+
+
+# raises KeyError / TypeError / ValueError for a request that can not be priced, so it can be rejected before the batch is priced
+def validate(data):
+    int(data['days_rental'])
+    pickup_month(data)
+
+
+# quotes are whole numbers unless a multiplier or discount makes them fractional
+def _quote_value(price):
+    price = round(price, 2)
+    return int(price) if price.is_integer() else price
+
+
+class PricingEngine:
+    """Prices batches of quote requests (the 'data' of a request) with the rate table of one vendor."""
+
+    def __init__(self, rate_table):
+        self.rate_table = rate_table
+        self.discount_days = [days for days, _ in rate_table.discounts]
+        # index 0 is "no discount", the discount of a request is looked up by bisecting its days
+        self.discount_values = [0.0] + [value for _, value in rate_table.discounts]
+
+    def price(self, data):
+        return self.price_batch([data])[0]
+
+    # prices every request of the batch, returns one quote per request in the same order.
+    # columns of a rate table without entries are skipped, a plain base rate table costs one multiplication
+    def price_batch(self, batch):
+        if not batch:
+            return []
+        rate_table = self.rate_table
+        columns = [[int(data['days_rental']) for data in batch]]
+        if rate_table.car_types:
+            car_types = rate_table.car_types
+            columns.append([car_types.get(str(data.get('car_type')), 1.0) for data in batch])
+        if rate_table.seasons:
+            today = datetime.date.today()
+            seasons = rate_table.seasons
+            columns.append([seasons.get(pickup_month(data, today), 1.0) for data in batch])
+        if rate_table.discounts:
+            discount_days, discount_values = self.discount_days, self.discount_values
+            columns.append([1.0 - discount_values[bisect.bisect_right(discount_days, days)] for days in columns[0]])
+        return [_quote_value(price) for price in self._multiply(columns)]
+
+    def _multiply(self, columns):
+        if numpy is not None:
+            prices = numpy.asarray(columns[0], dtype=numpy.float64) * self.rate_table.base_rate
+            for column in columns[1:]:
+                prices *= numpy.asarray(column, dtype=numpy.float64)
+            return prices.tolist()
+        base_rate = self.rate_table.base_rate
+        prices = [days * base_rate for days in columns[0]]
+        for column in columns[1:]:
+            prices = [price * factor for price, factor in zip(prices, column)]
+        return prices
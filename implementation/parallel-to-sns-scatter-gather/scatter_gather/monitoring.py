@@ -0,0 +1,169 @@
+import json
+
+from aws_cdk import (
+    Duration,
+    Stack,
+    aws_cloudwatch as cloudwatch,
+    aws_dynamodb as dynamodb,
+    aws_sqs as sqs,
+    aws_stepfunctions as sfn,
+    CfnOutput
+)
+from constructs import Construct
+from scatter_gather.lambda_.lambda_functions import RESPONDER_TIMEOUT_SECONDS, LambdaStates
+
+# thresholds of the alarms, overridden per key by the "alarms" context in cdk.json
+ALARM_DEFAULTS = {
+    # p99 Duration of a responder, as a share of its timeout
+    "duration_p99_timeout_ratio": 0.8,
+    "throttles": 0,
+    # age of the oldest message of a queue, the iterator age of an SQS event source
+    "queue_age_seconds": 60,
+    "queue_backlog": 1000,
+    "execution_time_p99_seconds": 10,
+    # consumed capacity units of a table per minute
+    "consumed_write_units": 60000,
+    "consumed_read_units": 60000,
+}
+# namespace of the embedded metrics of the functions (instrumentation.py in the shared layer)
+METRICS_NAMESPACE = "ScatterGather"
+PERIOD = Duration.minutes(1)
+
+
+# a context given on the command line (-c alarms='{"queue_age_seconds": 30}') is a JSON string
+def alarm_settings(scope: Construct) -> dict:
+    overrides = scope.node.try_get_context("alarms") or {}
+    if isinstance(overrides, str):
+        overrides = json.loads(overrides)
+    return dict(ALARM_DEFAULTS, **overrides)
+
+
+# CDK construct with one CloudWatch dashboard and a set of alarms per vendor in car_rentals.
+# a dashboard shows the throughput, result size, p99 Duration and throttles of the responder of its vendor
+# next to what the vendor shares with the others: the backlog and age of the queues, the execution time of
+# the state machine and the consumed capacity of the tables. the shared alarms are created once.
+class ScatterGatherMonitoring(Construct):
+
+    def __init__(self, scope: Construct, id_: str, lambdas: LambdaStates,
+                 responder_queues: dict = None, queues: dict = None, dead_letter_queues: dict = None,
+                 state_machine: sfn.IStateMachine = None, tables: dict = None) -> None:
+        super().__init__(scope, id_)
+        self.settings = alarm_settings(self)
+        self.design = lambdas.design
+        self.dashboards = {}
+        self.alarms = {}
+        responder_queues = responder_queues or {}
+        responders = {responder.node.id: responder for responder in lambdas.responder}
+
+        shared_widgets = []
+        shared_alarms = []
+        for name, queue in (queues or {}).items():
+            shared_widgets.append(self.queue_widget(name, queue))
+            shared_alarms.extend(self.queue_alarms(name, queue))
+        for name, queue in (dead_letter_queues or {}).items():
+            messages = queue.metric_approximate_number_of_messages_visible(statistic="Maximum", period=PERIOD)
+            shared_widgets.append(cloudwatch.GraphWidget(title=f"{name} dead-letter queue", left=[messages], width=12))
+            shared_alarms.append(self.alarm(f"{name}-dead-letters", messages, 0, f"messages moved to the {name} dead-letter queue",
+                                            evaluation_periods=1))
+        if state_machine is not None:
+            execution_time = state_machine.metric_time(statistic="p99", period=PERIOD)
+            shared_widgets.append(cloudwatch.GraphWidget(title="state machine ExecutionTime", left=[execution_time], width=12))
+            shared_alarms.append(self.alarm("execution-time-p99", execution_time, self.settings["execution_time_p99_seconds"] * 1000,
+                                            "p99 execution time of the scatter-gather state machine"))
+        for name, table in (tables or {}).items():
+            shared_widgets.append(self.table_widget(name, table))
+            shared_alarms.extend(self.table_alarms(name, table))
+
+        # alarms of a responder are created once, the responder for any vendor of the Map workflow is on every dashboard
+        function_alarms = {}
+        for vendor in self.node.try_get_context("car_rentals"):
+            responder = lambdas.vendor_responder or responders[f"responder-{vendor}"]
+            if responder.node.id not in function_alarms:
+                function_alarms[responder.node.id] = self.responder_alarms(responder)
+            vendor_alarms = list(function_alarms[responder.node.id])
+            responder_queue = responder_queues.get(f"responder-{vendor}")
+            if responder_queue is not None:
+                vendor_alarms.extend(self.queue_alarms(f"responder-{vendor}", responder_queue))
+            self.alarms[vendor] = vendor_alarms + shared_alarms
+
+            dashboard = cloudwatch.Dashboard(self, f"dashboard-{vendor}",
+                                             dashboard_name=f"{Stack.of(self).stack_name}-{vendor}")
+            dashboard.add_widgets(cloudwatch.AlarmStatusWidget(title=f"{vendor} alarms", alarms=self.alarms[vendor], width=24))
+            dashboard.add_widgets(*self.responder_widgets(vendor, responder))
+            if responder_queue is not None:
+                dashboard.add_widgets(self.queue_widget(f"responder-{vendor}", responder_queue))
+            for start in range(0, len(shared_widgets), 2):
+                dashboard.add_widgets(*shared_widgets[start:start + 2])
+            self.dashboards[vendor] = dashboard
+            CfnOutput(self, f"DashboardName-{vendor}", value=dashboard.dashboard_name)
+
+    def alarm(self, id_: str, metric: cloudwatch.IMetric, threshold: float, description: str,
+              evaluation_periods: int = 3) -> cloudwatch.Alarm:
+        return cloudwatch.Alarm(self, id_,
+                                metric=metric,
+                                threshold=threshold,
+                                evaluation_periods=evaluation_periods,
+                                datapoints_to_alarm=evaluation_periods,
+                                comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+                                alarm_description=description)
+
+    # a metric the functions write to their log in embedded metric format
+    def embedded_metric(self, name: str, service: str, vendor: str, statistic: str, stage: str = None) -> cloudwatch.Metric:
+        dimensions = {"Design": self.design, "Service": service, "Vendor": vendor}
+        if stage:
+            dimensions["Stage"] = stage
+        return cloudwatch.Metric(namespace=METRICS_NAMESPACE, metric_name=name, dimensions_map=dimensions,
+                                 statistic=statistic, period=PERIOD)
+
+    def responder_widgets(self, vendor: str, responder) -> list:
+        return [
+            cloudwatch.GraphWidget(title=f"{responder.node.id} throughput",
+                                   left=[responder.metric_invocations(statistic="Sum", period=PERIOD)],
+                                   right=[self.embedded_metric("Quotes", "responder", vendor, "Sum")], width=8),
+            cloudwatch.GraphWidget(title=f"{responder.node.id} Duration",
+                                   left=[responder.metric_duration(statistic="p50", period=PERIOD),
+                                         responder.metric_duration(statistic="p99", period=PERIOD)],
+                                   right=[self.embedded_metric("Latency", "responder", vendor, "p99", stage="price")],
+                                   width=8),
+            cloudwatch.GraphWidget(title=f"{responder.node.id} errors and throttles",
+                                   left=[responder.metric_errors(statistic="Sum", period=PERIOD),
+                                         responder.metric_throttles(statistic="Sum", period=PERIOD)], width=8),
+        ]
+
+    def responder_alarms(self, responder) -> list:
+        return [
+            self.alarm(f"{responder.node.id}-duration-p99", responder.metric_duration(statistic="p99", period=PERIOD),
+                       RESPONDER_TIMEOUT_SECONDS * 1000 * self.settings["duration_p99_timeout_ratio"],
+                       f"p99 Duration of {responder.node.id} close to its timeout"),
+            self.alarm(f"{responder.node.id}-throttles", responder.metric_throttles(statistic="Sum", period=PERIOD),
+                       self.settings["throttles"], f"throttled invocations of {responder.node.id}", evaluation_periods=1),
+        ]
+
+    def queue_widget(self, name: str, queue: sqs.IQueue) -> cloudwatch.GraphWidget:
+        return cloudwatch.GraphWidget(title=f"{name} queue",
+                                      left=[queue.metric_approximate_number_of_messages_visible(statistic="Maximum", period=PERIOD)],
+                                      right=[queue.metric_approximate_age_of_oldest_message(statistic="Maximum", period=PERIOD)],
+                                      width=12)
+
+    def queue_alarms(self, name: str, queue: sqs.IQueue) -> list:
+        return [
+            self.alarm(f"{name}-queue-backlog", queue.metric_approximate_number_of_messages_visible(statistic="Maximum", period=PERIOD),
+                       self.settings["queue_backlog"], f"messages waiting in the {name} queue"),
+            self.alarm(f"{name}-queue-age", queue.metric_approximate_age_of_oldest_message(statistic="Maximum", period=PERIOD),
+                       self.settings["queue_age_seconds"], f"age of the oldest message of the {name} queue"),
+        ]
+
+    def table_widget(self, name: str, table: dynamodb.ITable) -> cloudwatch.GraphWidget:
+        return cloudwatch.GraphWidget(title=f"{name} consumed capacity",
+                                      left=[table.metric_consumed_write_capacity_units(statistic="Sum", period=PERIOD)],
+                                      right=[table.metric_consumed_read_capacity_units(statistic="Sum", period=PERIOD)],
+                                      width=12)
+
+    def table_alarms(self, name: str, table: dynamodb.ITable) -> list:
+        return [
+            self.alarm(f"{name}-consumed-write-units", table.metric_consumed_write_capacity_units(statistic="Sum", period=PERIOD),
+                       self.settings["consumed_write_units"], f"write units consumed by the {name} table per minute"),
+            self.alarm(f"{name}-consumed-read-units", table.metric_consumed_read_capacity_units(statistic="Sum", period=PERIOD),
+                       self.settings["consumed_read_units"], f"read units consumed by the {name} table per minute"),
+        ]
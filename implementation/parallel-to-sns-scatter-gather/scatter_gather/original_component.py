@@ -5,6 +5,7 @@ from aws_cdk import (
 from constructs import Construct
 from scatter_gather.stepfunction.stepfunctions_workflow import SFNWorkflow
 from scatter_gather.lambda_.lambda_functions import LambdaStates
+from scatter_gather.monitoring import ScatterGatherMonitoring
 
 
 class OriginalScatterGatherStack(Stack):
@@ -12,7 +13,18 @@ class OriginalScatterGatherStack(Stack):
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
         
-        lambdas = LambdaStates(self, "lambda-exec")        
-        sfn = SFNWorkflow(self,"sfn-map", lambdas)
+        # sfn_fan_out: "parallel" (one branch per vendor) or "map" (vendors given at runtime), see SFNWorkflow
+        fan_out = self.node.try_get_context("sfn_fan_out") or "parallel"
+        lambdas = LambdaStates(self, "lambda-exec", vendor_responder=(fan_out == "map"))        
+        sfn = SFNWorkflow(self,"sfn-map", lambdas,
+                          fan_out=fan_out,
+                          max_concurrency=self.node.try_get_context("sfn_max_concurrency") or 0,
+                          distributed=bool(self.node.try_get_context("sfn_distributed_map")))
+        
+        # dashboards and alarms per vendor (scatter_gather/monitoring.py)
+        tables = {"quote-cache": lambdas.quote_cache_table} if lambdas.quote_cache_table is not None else {}
+        self.monitoring = ScatterGatherMonitoring(self, "monitoring", lambdas, state_machine=sfn.cfn_state_machine, tables=tables)
         
         CfnOutput(self, "StatemachineArn", value=sfn.cfn_state_machine.state_machine_arn)
+        if lambdas.quote_cache_table is not None:
+            CfnOutput(self, "QuoteCacheTableName", value=lambdas.quote_cache_table.table_name)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: performance_profile.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Performance profile of a deployment. "performance_profile" in the cdk.json context picks one of PROFILES
+# (latency, throughput or cost), every setting of the profile can still be overridden with its own context
+# key (e.g. cdk deploy -c performance_profile=throughput -c lambda_memory_size=256). LambdaStates, SFNWorkflow
+# and RefactoredlScatterGatherStack read the resolved settings, app.py prints them as a table at synth.
+
+DEFAULT = "default"
+
+# the settings a profile tunes and their values without a profile
+DEFAULTS = {
+    "lambda_memory_size": 128,
+    "lambda_architecture": "x86_64",
+    # warm containers of the "live" alias of the functions on the request path (requester, responders, aggregator)
+    "provisioned_concurrency": 0,
+    # 0: one record per vendor
+    "aggregator_batch_size": 0,
+    "aggregator_batching_window_seconds": 2,
+    "responder_batch_size": 0,
+    "responder_batching_window_seconds": 1,
+    "sfn_express": False,
+}
+
+PROFILES = {
+    DEFAULT: {},
+    # more memory is more CPU per invocation, no batching windows on the way and warm containers
+    "latency": {
+        "lambda_memory_size": 1024,
+        "lambda_architecture": "arm64",
+        "provisioned_concurrency": 2,
+        "aggregator_batching_window_seconds": 0,
+        "sfn_express": True,
+    },
+    # large batches on both queues, every invocation prices and stores many quote requests
+    "throughput": {
+        "lambda_memory_size": 512,
+        "lambda_architecture": "arm64",
+        "aggregator_batch_size": 100,
+        "aggregator_batching_window_seconds": 1,
+        "responder_batch_size": 10,
+        "responder_batching_window_seconds": 1,
+        "sfn_express": True,
+    },
+    # the fewest invocations and GB-seconds, at the price of longer batching windows
+    "cost": {
+        "lambda_memory_size": 128,
+        "lambda_architecture": "arm64",
+        "aggregator_batch_size": 100,
+        "aggregator_batching_window_seconds": 5,
+        "responder_batch_size": 10,
+        "responder_batching_window_seconds": 5,
+        "sfn_express": True,
+    },
+}
+
+
+# context values given with -c are strings, they are converted to the type of the default
+def _coerce(value, default):
+    if isinstance(default, bool):
+        return value if isinstance(value, bool) else str(value).lower() in ("1", "true", "yes")
+    if isinstance(default, int):
+        return int(value)
+    return str(value)
+
+
+# resolved settings of the profile as {setting: (value, source)}, the source is the profile, "context" or "default"
+def resolve(scope):
+    name = scope.node.try_get_context("performance_profile") or DEFAULT
+    if name not in PROFILES:
+        raise ValueError(f"unknown performance profile: {name}, expected one of {', '.join(PROFILES)}")
+    resolved = {}
+    for key, default in DEFAULTS.items():
+        explicit = scope.node.try_get_context(key)
+        if explicit is not None:
+            resolved[key] = (_coerce(explicit, default), "context")
+        elif key in PROFILES[name]:
+            resolved[key] = (PROFILES[name][key], name)
+        else:
+            resolved[key] = (default, DEFAULT)
+    # a distributed map runs in Standard workflows only, a profile does not switch it to Express
+    if scope.node.try_get_context("sfn_distributed_map") and resolved["sfn_express"][1] != "context":
+        resolved["sfn_express"] = (False, f"{resolved['sfn_express'][1]} (distributed map)")
+    return resolved
+
+
+# resolved settings of the profile ({setting: value})
+def settings(scope):
+    return {key: value for key, (value, _) in resolve(scope).items()}
+
+
+# SQS recommends a visibility timeout of six times the function timeout plus the batching window
+def visibility_timeout_seconds(function_timeout_seconds, batching_window_seconds):
+    return 6 * function_timeout_seconds + batching_window_seconds
+
+
+# the resolved settings as a table for the synth output
+def summary(scope):
+    name = scope.node.try_get_context("performance_profile") or DEFAULT
+    rows = [("setting", "value", "source")] + [(key, str(value), source) for key, (value, source) in resolve(scope).items()]
+    widths = [max(len(row[column]) for row in rows) for column in range(3)]
+    lines = [f"performance profile: {name}"]
+    for index, row in enumerate(rows):
+        lines.append("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+        if index == 0:
+            lines.append("  ".join("-" * width for width in widths))
+    return "\n".join(lines)
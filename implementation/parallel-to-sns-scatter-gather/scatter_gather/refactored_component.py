@@ -31,7 +31,23 @@ from aws_cdk import (
     CfnOutput
 )
 from constructs import Construct
-from scatter_gather.lambda_.lambda_functions import LambdaStates
+from scatter_gather import performance_profile
+from scatter_gather.lambda_.lambda_functions import AGGREGATOR_TIMEOUT_SECONDS, RESPONDER_TIMEOUT_SECONDS, LambdaStates
+from scatter_gather.monitoring import ScatterGatherMonitoring
+
+# a quote request the requester answered from the quote cache carries "cached" in its destination record, the
+# requester publishes its aggregate itself so the responders need not receive it
+UNCACHED_REQUESTS_FILTER_POLICY = {"responsePayload": {"body": {"data": {"cached": [{"exists": False}]}}}}
+
+
+# subscribes to the scatter topic, with the quote cache only the requests that are not cached are delivered.
+# the MessageBody filter policy scope is set on the CfnSubscription, Subscription only takes attribute policies here
+def subscribe_to_scatter_topic(topic: sns.ITopic, subscription: sns.ITopicSubscription, filter_cached: bool) -> sns.Subscription:
+    created = topic.add_subscription(subscription)
+    if filter_cached:
+        created.node.default_child.add_property_override("FilterPolicyScope", "MessageBody")
+        created.node.default_child.add_property_override("FilterPolicy", UNCACHED_REQUESTS_FILTER_POLICY)
+    return created
 
 class RefactoredlScatterGatherStack(Stack):
 
@@ -43,14 +59,80 @@ class RefactoredlScatterGatherStack(Stack):
             self, "ScatterTopic",
             topic_name="scatter-topic"
         )
-        # create sqs queue for aggregator
-        sqs_aggregator = sqs.Queue(self, "sqs-aggregator", visibility_timeout=Duration.seconds(90))
+        # batch sizes and batching windows of the queues come from the performance profile, the visibility
+        # timeouts follow from the batching windows
+        profile = performance_profile.settings(self)
+        # create sqs queue for aggregator, with a dead-letter queue for poison messages
+        max_receive_count = self.node.try_get_context("max_receive_count") or 5
+        batching_window = profile["aggregator_batching_window_seconds"]
+        sqs_aggregator_dlq = sqs.Queue(self, "sqs-aggregator-dlq", retention_period=Duration.days(14))
+        sqs_aggregator = sqs.Queue(self, "sqs-aggregator", visibility_timeout=Duration.seconds(performance_profile.visibility_timeout_seconds(AGGREGATOR_TIMEOUT_SECONDS, batching_window)),
+                                   dead_letter_queue=sqs.DeadLetterQueue(queue=sqs_aggregator_dlq, max_receive_count=max_receive_count))
         lambdas = LambdaStates(self, "refactor-lambda", requester_sns_topic=sns_fanout, responder_sqs_queue=sqs_aggregator)
+        # bulk requests are published to the scatter topic by the requester itself
+        sns_fanout.grant_publish(lambdas.requester)
+        lambdas.requester.add_environment("SCATTER_TOPIC_ARN", sns_fanout.topic_arn)
         # subscribe resposnders (car rentals) to sns topic to receive quote request
+        # with a responder batch size the quote requests are buffered in one queue per responder, so a single
+        # invocation prices a whole batch and sends the quotes to the aggregator queue itself
+        responder_batch_size = profile["responder_batch_size"]
+        responder_batching_window = profile["responder_batching_window_seconds"]
+        responder_queues = {}
+        # every dead-letter queue is alarmed, a message in one needs a look
+        dead_letter_queues = {"aggregator": sqs_aggregator_dlq}
+        filter_cached = lambdas.quote_cache_table is not None
         for responder in lambdas.responder:
-            sns_fanout.add_subscription(subscriptions.LambdaSubscription(responder))
+            if responder_batch_size:
+                sqs_responder_dlq = sqs.Queue(self, f"sqs-{responder.node.id}-dlq", retention_period=Duration.days(14))
+                sqs_responder = sqs.Queue(self, f"sqs-{responder.node.id}", visibility_timeout=Duration.seconds(performance_profile.visibility_timeout_seconds(RESPONDER_TIMEOUT_SECONDS, responder_batching_window)),
+                                          dead_letter_queue=sqs.DeadLetterQueue(queue=sqs_responder_dlq, max_receive_count=max_receive_count))
+                responder_queues[responder.node.id] = sqs_responder
+                dead_letter_queues[responder.node.id] = sqs_responder_dlq
+                sqs_responder_dlq.grant_send_messages(responder)
+                responder.add_environment("DEAD_LETTER_QUEUE_URL", sqs_responder_dlq.queue_url)
+                subscribe_to_scatter_topic(sns_fanout, subscriptions.SqsSubscription(sqs_responder, raw_message_delivery=True), filter_cached)
+                lambdas.target(responder).add_event_source(_event.SqsEventSource(queue=sqs_responder, batch_size=responder_batch_size, max_batching_window=Duration.seconds(responder_batching_window), report_batch_item_failures=True))
+                sqs_aggregator.grant_send_messages(responder)
+                responder.add_environment("QUOTE_QUEUE_URL", sqs_aggregator.queue_url)
+            else:
+                subscribe_to_scatter_topic(sns_fanout, subscriptions.LambdaSubscription(lambdas.target(responder)), filter_cached)
         # subscribe aggregator to sqs queue containing generated price quotes
-        lambdas.aggregator.add_event_source(_event.SqsEventSource(queue=sqs_aggregator, batch_size=len(lambdas.responder), max_batching_window=Duration.minutes(1)))
+        # the aggregator publishes a quote request as soon as all vendors answered, so the batching window only
+        # needs to collect the responses that arrive together. failed records are reported back individually.
+        aggregator_batch_size = profile["aggregator_batch_size"] or len(lambdas.responder)
+        lambdas.target(lambdas.aggregator).add_event_source(_event.SqsEventSource(queue=sqs_aggregator, batch_size=aggregator_batch_size, max_batching_window=Duration.seconds(batching_window), report_batch_item_failures=True))
+        
+        # create sns topic receiving the aggregated quotes of every request
+        sns_quotes = sns.Topic(
+            self, "QuotesTopic",
+            topic_name="quotes-topic"
+        )
+        # the requester sends every quote request that is not cached to the deadline queue as well, delayed by the
+        # deadline of the request (gather_deadline_seconds unless the request brings its own)
+        gather_deadline = self.node.try_get_context("gather_deadline_seconds") or 30
+        sqs_deadline_dlq = sqs.Queue(self, "sqs-gather-deadline-dlq", retention_period=Duration.days(14))
+        sqs_deadline = sqs.Queue(self, "sqs-gather-deadline", visibility_timeout=Duration.seconds(60),
+                                 dead_letter_queue=sqs.DeadLetterQueue(queue=sqs_deadline_dlq, max_receive_count=max_receive_count))
+        dead_letter_queues["gather-deadline"] = sqs_deadline_dlq
+        sqs_deadline.grant_send_messages(lambdas.requester)
+        lambdas.requester.add_environment("DEADLINE_QUEUE_URL", sqs_deadline.queue_url)
+        lambdas.requester.add_environment("GATHER_DEADLINE_SECONDS", str(gather_deadline))
+        lambdas.gather_deadline.add_event_source(_event.SqsEventSource(queue=sqs_deadline, batch_size=10, report_batch_item_failures=True))
+        # malformed records are moved to the dead-letter queue of their queue by the functions themselves
+        for gather_function, dead_letter_queue in [(lambdas.aggregator, sqs_aggregator_dlq), (lambdas.gather_deadline, sqs_deadline_dlq)]:
+            dead_letter_queue.grant_send_messages(gather_function)
+            gather_function.add_environment("DEAD_LETTER_QUEUE_URL", dead_letter_queue.queue_url)
+        for gather_function in [lambdas.aggregator, lambdas.gather_deadline]:
+            sns_quotes.grant_publish(gather_function)
+            gather_function.add_environment("RESULT_TOPIC_ARN", sns_quotes.topic_arn)
+            gather_function.add_environment("EXPECTED_VENDORS", ",".join(self.node.try_get_context("car_rentals")))
+        # with the quote cache the aggregator caches complete aggregates and the requester publishes cached ones
+        if lambdas.quote_cache_table is not None:
+            lambdas.quote_cache_table.grant_write_data(lambdas.aggregator)
+            for key, value in lambdas.quote_cache_environment.items():
+                lambdas.aggregator.add_environment(key, value)
+            sns_quotes.grant_publish(lambdas.requester)
+            lambdas.requester.add_environment("RESULT_TOPIC_ARN", sns_quotes.topic_arn)
         
         # crate responder functions (car rentals)
         resp_index = 1
@@ -58,19 +140,77 @@ class RefactoredlScatterGatherStack(Stack):
             CfnOutput(self, f"ResponderFunctionName-{resp_index}", value=responder.function_name)
             resp_index +=1
         
-        # create simple dynamoDB table named QuoteAggregatorTable
-        quote_table = dynamodb.Table(self, "QuoteAggregatorTable",
-            partition_key=dynamodb.Attribute(
-                name="quoteId",
-                type=dynamodb.AttributeType.STRING),
-            sort_key=dynamodb.Attribute(
-                name="vendor",
-                type=dynamodb.AttributeType.STRING),
-            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST)
+        # with a positive quote_top_k the vendor items keep their cheapest quotes only, every quote is stored
+        # as a history item expiring after quote_history_ttl_seconds (shared/layer/python/quote_store.py)
+        quote_top_k = int(self.node.try_get_context("quote_top_k") or 0)
+        # quote_table_shards spreads the vendor items of a request over that many partition key values, so the
+        # quotes of a popular request are written to several partitions and read from all of them at once
+        quote_table_shards = int(self.node.try_get_context("quote_table_shards") or 1)
+        # quote_table_regions makes the quote table a global table named quote_table_name: the stack of the first region
+        # creates it with a replica in every other region, the stacks of the other regions use their replica. a request
+        # is gathered in the region it was sent to, its aggregator writes to the replica of that region
+        quote_table_regions = self.node.try_get_context("quote_table_regions") or []
+        if isinstance(quote_table_regions, str):
+            quote_table_regions = [region for region in quote_table_regions.split(",") if region]
+        quote_table_name = (self.node.try_get_context("quote_table_name") or "QuoteAggregatorTable") if quote_table_regions else None
+        if quote_table_regions and self.region not in quote_table_regions:
+            raise ValueError(f"the stack region {self.region} is not one of the quote_table_regions {quote_table_regions}")
+        if quote_table_regions and self.region != quote_table_regions[0]:
+            quote_table = dynamodb.Table.from_table_attributes(self, "QuoteAggregatorTable",
+                                                                table_name=quote_table_name,
+                                                                global_indexes=["BestRateIndex"])
+        else:
+            # create simple dynamoDB table named QuoteAggregatorTable
+            quote_table = dynamodb.Table(self, "QuoteAggregatorTable",
+                table_name=quote_table_name,
+                partition_key=dynamodb.Attribute(
+                    name="quoteId",
+                    type=dynamodb.AttributeType.STRING),
+                sort_key=dynamodb.Attribute(
+                    name="vendor",
+                    type=dynamodb.AttributeType.STRING),
+                billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                time_to_live_attribute="expiresAt" if quote_top_k > 0 else None,
+                replication_regions=quote_table_regions[1:] or None)
+            # sparse index of the vendor items by their lowest rate, the tracker items have no bestRate and stay out of it
+            quote_table.add_global_secondary_index(
+                index_name="BestRateIndex",
+                partition_key=dynamodb.Attribute(
+                    name="quoteId",
+                    type=dynamodb.AttributeType.STRING),
+                sort_key=dynamodb.Attribute(
+                    name="bestRate",
+                    type=dynamodb.AttributeType.NUMBER),
+                projection_type=dynamodb.ProjectionType.ALL)
         # grant read/write permissions to lambdas.aggregator
         quote_table.grant_read_write_data(lambdas.aggregator)
-        lambdas.aggregator.add_environment("QUOTE_TABLE_NAME", quote_table.table_name)
+        quote_table.grant_read_write_data(lambdas.gather_deadline)
+        quote_table.grant_read_data(lambdas.quote_reader)
+        for function in (lambdas.aggregator, lambdas.gather_deadline, lambdas.quote_reader):
+            function.add_environment("QUOTE_TABLE_NAME", quote_table.table_name)
+            function.add_environment("QUOTE_RANK_INDEX", "BestRateIndex")
+            if quote_top_k > 0:
+                function.add_environment("QUOTE_STORE_LAYOUT", "compact")
+                function.add_environment("QUOTE_TOP_K", str(quote_top_k))
+                function.add_environment("QUOTE_HISTORY_TTL_SECONDS", str(self.node.try_get_context("quote_history_ttl_seconds") or 7 * 24 * 3600))
+            if quote_table_shards > 1:
+                function.add_environment("QUOTE_TABLE_SHARDS", str(quote_table_shards))
+        
+        # dashboards and alarms per vendor (scatter_gather/monitoring.py)
+        tables = {"quote-aggregator": quote_table}
+        if lambdas.quote_cache_table is not None:
+            tables["quote-cache"] = lambdas.quote_cache_table
+        self.monitoring = ScatterGatherMonitoring(self, "monitoring", lambdas,
+                                                  responder_queues=responder_queues,
+                                                  queues={"aggregator": sqs_aggregator, "gather-deadline": sqs_deadline},
+                                                  dead_letter_queues=dead_letter_queues,
+                                                  tables=tables)
         
         CfnOutput(self, "QuoteAggregatorTableName", value=quote_table.table_name)
         CfnOutput(self, "RequesterFunctionName", value=lambdas.requester.function_name)
-        CfnOutput(self, "AggregatorFunctionName", value=lambdas.aggregator.function_name)
\ No newline at end of file
+        CfnOutput(self, "AggregatorFunctionName", value=lambdas.aggregator.function_name)
+        CfnOutput(self, "QuoteReaderFunctionName", value=lambdas.quote_reader.function_name)
+        CfnOutput(self, "QuotesTopicArn", value=sns_quotes.topic_arn)
+        CfnOutput(self, "AggregatorDeadLetterQueueUrl", value=sqs_aggregator_dlq.queue_url)
+        if lambdas.quote_cache_table is not None:
+            CfnOutput(self, "QuoteCacheTableName", value=lambdas.quote_cache_table.table_name)
\ No newline at end of file
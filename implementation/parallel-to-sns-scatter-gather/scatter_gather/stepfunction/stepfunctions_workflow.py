@@ -21,51 +21,217 @@
 ###
 from constructs import Construct
 from aws_cdk import (
+    aws_iam as iam,
     aws_stepfunctions as sfn,
     aws_stepfunctions_tasks as sfn_tasks,
-    Duration
+    ArnFormat,
+    Duration,
+    Stack
 )
 
+from scatter_gather import performance_profile
 from scatter_gather.lambda_.lambda_functions import LambdaStates
 
 
+STATE_MACHINE_NAME = "ParallelStateForScatterGather"
+PARALLEL = "parallel"
+MAP = "map"
+# retry of LambdaInvoke with retry_on_service_exceptions, for the states rendered by hand
+LAMBDA_SERVICE_RETRY = {
+    "ErrorEquals": ["Lambda.ServiceException", "Lambda.AWSLambdaException", "Lambda.SdkClientException"],
+    "IntervalSeconds": 2,
+    "MaxAttempts": 6,
+    "BackoffRate": 2
+}
+
+
+# Workflow of the orchestrated scatter-gather:
+#   parallel: one LambdaInvoke branch per vendor of cdk.json in a Parallel state
+#   map:      a Map state over the vendors of the request ({"data": ..., "vendors": [{"vendor": "Avis", "base_rate": "99"}]}),
+#             the vendors of cdk.json when the request has none. Every iteration invokes the same vendor responder,
+#             so vendors are added without a deployment. distributed runs the iterations as child Express executions
+#             for very large vendor lists (needs a Standard workflow).
+# Every vendor call is capped by the latency budget (sfn_latency_budget_seconds, or timeout_seconds of the vendor
+# in car_rentals when lower), a vendor that times out or fails yields an unavailable quote
+# ({"vendor": ..., "unavailable": true, "error": ...}) instead of failing the execution.
+# express builds an Express state machine, which is cheaper and has less overhead per state transition, the
+# performance profile decides when it is not given. The functions are invoked through LambdaStates.target.
 class SFNWorkflow(Construct):
 
-    def __init__(self, scope: Construct, id_: str, executors: LambdaStates) -> None:
+    def __init__(self, scope: Construct, id_: str, executors: LambdaStates, fan_out: str = PARALLEL, express: bool = None,
+                 max_concurrency: int = 0, distributed: bool = False, latency_budget_seconds: int = None) -> None:
         super().__init__(scope, id_)
+        if latency_budget_seconds is None:
+            latency_budget_seconds = self.node.try_get_context("sfn_latency_budget_seconds") or 0
+        self.latency_budget_seconds = int(latency_budget_seconds)
+        if fan_out not in (PARALLEL, MAP):
+            raise ValueError(f"unknown fan out: {fan_out}")
+        if fan_out == MAP and executors.vendor_responder is None:
+            raise ValueError("the map fan out needs LambdaStates with a vendor responder")
+        if express is None:
+            express = performance_profile.settings(self)["sfn_express"]
+        if distributed and express:
+            raise ValueError("a distributed map runs in Standard workflows only")
 
         # Define the requester state
         requester = sfn_tasks.LambdaInvoke(self, "Requester",
-                                           lambda_function=executors.requester,
+                                           lambda_function=executors.target(executors.requester),
                                            result_path="$",
-                                           result_selector={"request": sfn.JsonPath.string_to_json(
-                                               sfn.JsonPath.string_at("$.Payload.body"))},
+                                           result_selector={"request": sfn.JsonPath.object_at("$.Payload.body")},
                                            retry_on_service_exceptions=True
                                            )
 
+        # fan_out_entry is the first state of the fan-out, fan_out_state the one gathering the quotes
+        if fan_out == PARALLEL:
+            fan_out_state = fan_out_entry = self.parallel_state(executors)
+        else:
+            if distributed:
+                fan_out_state = self.distributed_map_state(executors, max_concurrency)
+            else:
+                fan_out_state = self.map_state(executors, max_concurrency)
+            # the vendors of cdk.json unless the request lists its own
+            car_rental_list = self.node.try_get_context("car_rentals")
+            default_vendors = sfn.Pass(self, "DefaultVendors",
+                                       result=sfn.Result.from_array([dict(config, vendor=vendor) for vendor, config in car_rental_list.items()]),
+                                       result_path="$.request.vendors")
+            default_vendors.next(fan_out_state)
+            fan_out_entry = sfn.Choice(self, "VendorsGiven").when(sfn.Condition.is_present("$.request.vendors"), fan_out_state).otherwise(default_vendors)
+
+        # with the quote cache a cached request skips the fan-out, the quotes of any other request are cached after the gather
+        if executors.quote_cache_writer is not None:
+            cached = sfn.Pass(self, "CachedQuotes", parameters={"quotes": sfn.JsonPath.object_at("$.request.quotes")})
+            cache_quotes = sfn_tasks.LambdaInvoke(self, "CacheQuotes",
+                                                  lambda_function=executors.quote_cache_writer,
+                                                  payload=sfn.TaskInput.from_object({
+                                                      "request": sfn.JsonPath.object_at("$$.Execution.Input"),
+                                                      "quotes": sfn.JsonPath.object_at("$.quotes")
+                                                  }),
+                                                  result_path=sfn.JsonPath.DISCARD,
+                                                  retry_on_service_exceptions=True
+                                                  )
+            fan_out_state.next(cache_quotes)
+            requester.next(
+                sfn.Choice(self, "Cached")
+                .when(sfn.Condition.and_(sfn.Condition.is_present("$.request.data.cached"),
+                                         sfn.Condition.boolean_equals("$.request.data.cached", True)), cached)
+                .otherwise(fan_out_entry))
+        else:
+            requester.next(fan_out_entry)
+
+        # Create the state machine
+        self.cfn_state_machine = sfn.StateMachine(self, f"{id_}scatter-gather-workflow",
+                                                  state_machine_name=STATE_MACHINE_NAME,
+                                                  state_machine_type=sfn.StateMachineType.EXPRESS if express else sfn.StateMachineType.STANDARD,
+                                                  definition=requester,
+                                                  timeout=Duration.minutes(5)
+                                                  )
+        if fan_out == MAP and distributed:
+            self.grant_distributed_map(executors)
+
+    def parallel_state(self, executors: LambdaStates):
         # Define the parallel state
         parallel_state = sfn.Parallel(self, "Parallel",
                                       result_selector={"quotes": sfn.JsonPath.object_at("$")})
         # Define the responder state
         resp_index = 1
-        for resp_lambda in executors.responder:
+        car_rental_list = self.node.try_get_context("car_rentals")
+        for resp_lambda, vendor in zip(executors.responder, car_rental_list):
             responder = sfn_tasks.LambdaInvoke(self, f"Responder-{resp_index}",
-                                               lambda_function=resp_lambda,
+                                               lambda_function=executors.target(resp_lambda),
                                                result_path="$",
                                                input_path="$.request",
                                                output_path="$.quote",
                                                result_selector={
-                                                   "quote": sfn.JsonPath.string_to_json(sfn.JsonPath.string_at("$.Payload.data"))
+                                                   "quote": sfn.JsonPath.object_at("$.Payload.data")
                                                },
-                                               retry_on_service_exceptions=True
+                                               retry_on_service_exceptions=True,
+                                               timeout=self.vendor_timeout(car_rental_list[vendor])
                                                )
+            responder.add_catch(self.unavailable_quote(f"Unavailable-{resp_index}", vendor, "$.request.data.uuid"),
+                                errors=[sfn.Errors.ALL], result_path="$.error")
             parallel_state.branch(responder)
             resp_index += 1
+        return parallel_state
 
-        # Create the state machine
-        self.cfn_state_machine = sfn.StateMachine(self, f"{id_}scatter-gather-workflow",
-                                                  state_machine_name="ParallelStateForScatterGather",
-                                                  definition=requester.next(
-                                                      parallel_state),
-                                                  timeout=Duration.minutes(5)
-                                                  )
+    def map_state(self, executors: LambdaStates, max_concurrency: int):
+        map_state = sfn.Map(self, "Map",
+                            items_path="$.request.vendors",
+                            max_concurrency=max_concurrency,
+                            parameters={
+                                "data": sfn.JsonPath.object_at("$.request.data"),
+                                "vendor": sfn.JsonPath.object_at("$$.Map.Item.Value")
+                            },
+                            result_selector={"quotes": sfn.JsonPath.object_at("$")})
+        responder = sfn_tasks.LambdaInvoke(self, "Responder",
+                                           lambda_function=executors.target(executors.vendor_responder),
+                                           result_path="$",
+                                           output_path="$.quote",
+                                           result_selector={
+                                               "quote": sfn.JsonPath.object_at("$.Payload.data")
+                                           },
+                                           retry_on_service_exceptions=True,
+                                           timeout=self.vendor_timeout()
+                                           )
+        responder.add_catch(self.unavailable_quote("Unavailable", sfn.JsonPath.string_at("$.vendor.vendor"), "$.data.uuid"),
+                            errors=[sfn.Errors.ALL], result_path="$.error")
+        map_state.iterator(responder)
+        return map_state
+
+    # timeout of a vendor call: the latency budget, or the timeout_seconds of the vendor when it is lower. None without either
+    def vendor_timeout(self, vendor_config: dict = None):
+        timeouts = [seconds for seconds in (self.latency_budget_seconds, int((vendor_config or {}).get("timeout_seconds", 0))) if seconds]
+        return Duration.seconds(min(timeouts)) if timeouts else None
+
+    # quote of a vendor that timed out or failed, the error of the Catch is at $.error
+    def unavailable_quote(self, id_: str, vendor: str, uuid_path: str):
+        return sfn.Pass(self, id_, parameters={
+            "uuid": sfn.JsonPath.string_at(uuid_path),
+            "vendor": vendor,
+            "unavailable": True,
+            "error": sfn.JsonPath.string_at("$.error.Error")
+        })
+
+    # the construct library has no distributed Map state yet, so it is rendered as a custom state
+    def distributed_map_state(self, executors: LambdaStates, max_concurrency: int):
+        return sfn.CustomState(self, "DistributedMap", state_json={
+            "Type": "Map",
+            "ItemsPath": "$.request.vendors",
+            "ItemSelector": {"data.$": "$.request.data", "vendor.$": "$$.Map.Item.Value"},
+            "MaxConcurrency": max_concurrency,
+            "ItemProcessor": {
+                "ProcessorConfig": {"Mode": "DISTRIBUTED", "ExecutionType": "EXPRESS"},
+                "StartAt": "Responder",
+                "States": {
+                    "Responder": {
+                        "Type": "Task",
+                        "Resource": "arn:aws:states:::lambda:invoke",
+                        "Parameters": {"FunctionName": executors.target(executors.vendor_responder).function_arn, "Payload.$": "$"},
+                        "ResultSelector": {"quote.$": "$.Payload.data"},
+                        "OutputPath": "$.quote",
+                        "Retry": [LAMBDA_SERVICE_RETRY],
+                        "Catch": [{"ErrorEquals": ["States.ALL"], "ResultPath": "$.error", "Next": "Unavailable"}],
+                        **({"TimeoutSeconds": self.latency_budget_seconds} if self.latency_budget_seconds else {}),
+                        "End": True
+                    },
+                    "Unavailable": {
+                        "Type": "Pass",
+                        "Parameters": {"uuid.$": "$.data.uuid", "vendor.$": "$.vendor.vendor", "unavailable": True, "error.$": "$.error.Error"},
+                        "End": True
+                    }
+                }
+            },
+            "ResultSelector": {"quotes.$": "$"}
+        })
+
+    # the child executions of a distributed map are started by the state machine itself
+    def grant_distributed_map(self, executors: LambdaStates):
+        stack = Stack.of(self)
+        executors.target(executors.vendor_responder).grant_invoke(self.cfn_state_machine)
+        self.cfn_state_machine.add_to_role_policy(iam.PolicyStatement(
+            actions=["states:StartExecution"],
+            resources=[stack.format_arn(service="states", resource="stateMachine", resource_name=STATE_MACHINE_NAME,
+                                        arn_format=ArnFormat.COLON_RESOURCE_NAME)]))
+        self.cfn_state_machine.add_to_role_policy(iam.PolicyStatement(
+            actions=["states:DescribeExecution", "states:StopExecution"],
+            resources=[stack.format_arn(service="states", resource="execution", resource_name=f"{STATE_MACHINE_NAME}/*",
+                                        arn_format=ArnFormat.COLON_RESOURCE_NAME)]))
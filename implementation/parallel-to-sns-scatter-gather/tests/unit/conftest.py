@@ -0,0 +1,48 @@
+import json
+import pathlib
+import sys
+
+import pytest
+
+PROJECT = pathlib.Path(__file__).parents[2]
+# the in-memory stand-ins and the loader of the handlers and the shared layer
+sys.path.insert(0, str(PROJECT.parent.joinpath("shared", "local")))
+
+from aws_stand_ins import LocalAWS  # noqa: E402
+
+ACCOUNT = "123456789012"
+
+
+def cdk_context(**overrides):
+    settings = json.loads(PROJECT.joinpath("cdk.json").read_text())["context"]
+    settings.update(overrides)
+    return settings
+
+
+# the context of cdk.json, context(**overrides) replaces single keys
+@pytest.fixture
+def context():
+    return cdk_context
+
+
+# synth(stack_class, region=None, **overrides) synthesizes a stack with the context of cdk.json and the overrides,
+# in the account and region given, or environment-agnostic without a region. the CDK is imported here, the tests of
+# the handlers and the shared layer run without it
+@pytest.fixture
+def synth():
+    import aws_cdk as cdk
+    from aws_cdk.assertions import Template
+
+    def synthesize(stack_class, region=None, **overrides):
+        app = cdk.App(context=cdk_context(**overrides))
+        env = cdk.Environment(account=ACCOUNT, region=region) if region else None
+        return Template.from_stack(stack_class(app, stack_class.__name__, env=env))
+    return synthesize
+
+
+# in-memory DynamoDB, SNS and SQS installed in place of the boto3 clients for the duration of a test
+@pytest.fixture
+def local_aws():
+    local = LocalAWS()
+    with local.install():
+        yield local
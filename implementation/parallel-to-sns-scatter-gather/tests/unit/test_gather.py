@@ -0,0 +1,110 @@
+import json
+import pathlib
+import uuid
+
+import pytest
+from botocore.exceptions import ClientError
+from lambda_loader import LambdaContext, load_handler
+
+LAMBDA_DIR = pathlib.Path(__file__).parents[2].joinpath("scatter_gather", "lambda_")
+TABLE = "QuoteAggregatorTable"
+RESULT_TOPIC_ARN = "arn:aws:sns:local:000000000000:quotes-topic"
+DEADLINE_QUEUE_URL = "https://sqs.local.amazonaws.com/000000000000/sqs-gather-deadline"
+
+
+@pytest.fixture
+def aws(local_aws):
+    local_aws.dynamodb.create_table(TABLE, "quoteId", "vendor")
+    return local_aws
+
+
+@pytest.fixture
+def published(aws):
+    aggregates = []
+    aws.sns.subscribe(RESULT_TOPIC_ARN, lambda event: aggregates.append(json.loads(event["Records"][0]["Sns"]["Message"])))
+    return aggregates
+
+
+@pytest.fixture
+def aggregator(aws):
+    return load_handler(LAMBDA_DIR.joinpath("aggregator", "app.py"),
+                        {"QUOTE_TABLE_NAME": TABLE, "EXPECTED_VENDORS": "avis,hertz", "RESULT_TOPIC_ARN": RESULT_TOPIC_ARN})
+
+
+def quote_record(quote_id, vendor, price):
+    quote = {"uuid": quote_id, "vendor": vendor, "car_type": "compact", "price_quote": price, "days_rental": 3}
+    return {"messageId": str(uuid.uuid4()), "body": json.dumps({"responsePayload": {"statusCode": 200, "data": quote}})}
+
+
+def deadline_record(quote_id):
+    return {"messageId": str(uuid.uuid4()), "body": json.dumps({"responsePayload": {"statusCode": 200, "body": {"data": {"uuid": quote_id}}}})}
+
+
+def receive(aggregator, *records):
+    return aggregator.lambda_handler({"Records": list(records)}, LambdaContext("aggregator"))["batchItemFailures"]
+
+
+def vendor_quotes(aws, quote_id):
+    return {item["vendor"]: item["Quotes"] for item in aws.dynamodb.items(TABLE)
+            if item["quoteId"] == quote_id and item["vendor"].startswith("VENDOR#")}
+
+
+# every batch stores its quotes and counts its vendors in one write, the last vendor publishes from the tracker:
+# no claim, no read of the vendor items, and the vendor items are written with the tracker marked published
+def test_request_is_published_by_the_arrival_completing_it(aws, published, aggregator):
+    first = quote_record("q1", "avis", 40.0)
+    assert receive(aggregator, first) == []
+    assert published == []
+    aws.calls.reset()
+    assert receive(aggregator, quote_record("q1", "hertz", 38.5)) == []
+    assert {operation: count for (service, operation), count in aws.calls.snapshot().items() if service == "dynamodb"} == \
+        {"UpdateItem": 1, "BatchWriteItem": 1}
+    [aggregate] = published
+    assert aggregate["partial"] is False
+    assert aggregate["quotes"] == {"avis": [{"carType": "compact", "rate": 40, "daysRental": 3}],
+                                   "hertz": [{"carType": "compact", "rate": 38.5, "daysRental": 3}]}
+    assert set(vendor_quotes(aws, "q1")) == {"VENDOR#avis", "VENDOR#hertz"}
+    # a redelivered record is neither stored nor published again
+    assert receive(aggregator, first) == []
+    assert len(published) == 1
+    assert len(vendor_quotes(aws, "q1")["VENDOR#avis"]) == 1
+
+
+# the deadline publishes what arrived so far, a vendor answering later is stored without a second publish
+def test_deadline_publishes_a_partial_result(aws, published, aggregator):
+    assert receive(aggregator, quote_record("q1", "avis", 40.0)) == []
+    assert aggregator.deadline_handler({"Records": [deadline_record("q1")]}, LambdaContext("gather-deadline")) == {"batchItemFailures": []}
+    [aggregate] = published
+    assert aggregate["partial"] is True and aggregate["missing"] == ["hertz"]
+    assert receive(aggregator, quote_record("q1", "hertz", 38.5)) == []
+    assert aggregator.deadline_handler({"Records": [deadline_record("q1")]}, LambdaContext("gather-deadline")) == {"batchItemFailures": []}
+    assert len(published) == 1
+    assert set(vendor_quotes(aws, "q1")) == {"VENDOR#avis", "VENDOR#hertz"}
+
+
+# a failed publish gives the tracker back, the redelivered record publishes the request
+def test_failed_publish_is_retried_by_the_redelivered_record(aws, published, aggregator, monkeypatch):
+    assert receive(aggregator, quote_record("q1", "avis", 40.0)) == []
+    last = quote_record("q1", "hertz", 38.5)
+    publish = aws.sns.publish
+
+    def unavailable(**kwargs):
+        raise ClientError({"Error": {"Code": "InternalError", "Message": "unavailable"}}, "Publish")
+    monkeypatch.setattr(aws.sns, "publish", unavailable)
+    assert receive(aggregator, last) == [{"itemIdentifier": last["messageId"]}]
+    monkeypatch.setattr(aws.sns, "publish", publish)
+    assert receive(aggregator, last) == []
+    [aggregate] = published
+    assert aggregate["partial"] is False
+
+
+# the requester sends the deadline message of a request delayed by the deadline of the request
+def test_requester_sends_the_deadline_of_the_request(aws):
+    queue = aws.queue("sqs-gather-deadline")
+    requester = load_handler(LAMBDA_DIR.joinpath("requester", "app.py"),
+                             {"DEADLINE_QUEUE_URL": DEADLINE_QUEUE_URL, "GATHER_DEADLINE_SECONDS": "0"})
+    response = requester.lambda_handler({"data": {"days_rental": 3}}, LambdaContext("requester"))
+    [record] = queue.receive(1, 0.0)
+    assert json.loads(record["body"])["responsePayload"]["body"]["data"]["uuid"] == response["body"]["data"]["uuid"]
+    requester.lambda_handler({"data": {"days_rental": 3}, "deadline_seconds": 60}, LambdaContext("requester"))
+    assert queue.receive(1, 0.0) == [] and len(queue) == 1
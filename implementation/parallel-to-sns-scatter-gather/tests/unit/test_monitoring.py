@@ -0,0 +1,120 @@
+import json
+import os
+import pathlib
+
+import pytest
+from aws_cdk.assertions import Match
+
+from scatter_gather.lambda_.lambda_functions import RESPONDER_TIMEOUT_SECONDS
+from scatter_gather.monitoring import ALARM_DEFAULTS
+from scatter_gather.original_component import OriginalScatterGatherStack
+from scatter_gather.refactored_component import RefactoredlScatterGatherStack
+
+SNAPSHOTS = pathlib.Path(__file__).parent.joinpath("snapshots")
+# SNAPSHOT_UPDATE=1 rewrites the snapshots after an intended change of the monitoring
+SNAPSHOT_UPDATE = os.getenv("SNAPSHOT_UPDATE", "").lower() in ("1", "true")
+MONITORING_TYPES = ("AWS::CloudWatch::Dashboard", "AWS::CloudWatch::Alarm")
+
+
+# the dashboards and alarms of a template, the function code assets change their hashes with every edit
+def monitoring_resources(template):
+    return {logical_id: resource for logical_id, resource in template.to_json()["Resources"].items()
+            if resource["Type"] in MONITORING_TYPES}
+
+
+def assert_snapshot(name, template):
+    path = SNAPSHOTS.joinpath(f"{name}.json")
+    resources = monitoring_resources(template)
+    if SNAPSHOT_UPDATE:
+        SNAPSHOTS.mkdir(exist_ok=True)
+        path.write_text(json.dumps(resources, indent=2, sort_keys=True) + "\n")
+    assert path.exists(), f"missing snapshot {path.name}, run the tests with SNAPSHOT_UPDATE=1 to write it"
+    assert resources == json.loads(path.read_text())
+
+
+@pytest.mark.parametrize("stack_class", [OriginalScatterGatherStack, RefactoredlScatterGatherStack])
+def test_dashboard_per_vendor(stack_class, synth, context):
+    template = synth(stack_class)
+    vendors = context()["car_rentals"]
+    template.resource_count_is("AWS::CloudWatch::Dashboard", len(vendors))
+    for vendor in vendors:
+        template.has_resource_properties("AWS::CloudWatch::Dashboard", {"DashboardName": f"{stack_class.__name__}-{vendor}"})
+
+
+@pytest.mark.parametrize("stack_class", [OriginalScatterGatherStack, RefactoredlScatterGatherStack])
+def test_responder_alarms(stack_class, synth):
+    template = synth(stack_class)
+    template.has_resource_properties("AWS::CloudWatch::Alarm", {
+        "MetricName": "Duration",
+        "Namespace": "AWS/Lambda",
+        "ExtendedStatistic": "p99",
+        "Threshold": RESPONDER_TIMEOUT_SECONDS * 1000 * ALARM_DEFAULTS["duration_p99_timeout_ratio"],
+    })
+    template.has_resource_properties("AWS::CloudWatch::Alarm", {
+        "MetricName": "Throttles",
+        "Namespace": "AWS/Lambda",
+        "Threshold": ALARM_DEFAULTS["throttles"],
+        "EvaluationPeriods": 1,
+    })
+
+
+def test_state_machine_alarm(synth):
+    template = synth(OriginalScatterGatherStack)
+    template.has_resource_properties("AWS::CloudWatch::Alarm", {
+        "MetricName": "ExecutionTime",
+        "Namespace": "AWS/States",
+        "ExtendedStatistic": "p99",
+        "Threshold": ALARM_DEFAULTS["execution_time_p99_seconds"] * 1000,
+    })
+
+
+def test_queue_and_table_alarms(synth):
+    template = synth(RefactoredlScatterGatherStack, alarms={"queue_age_seconds": 30})
+    template.has_resource_properties("AWS::CloudWatch::Alarm", {
+        "MetricName": "ApproximateAgeOfOldestMessage",
+        "Namespace": "AWS/SQS",
+        "Threshold": 30,
+    })
+    template.has_resource_properties("AWS::CloudWatch::Alarm", {
+        "MetricName": "ApproximateNumberOfMessagesVisible",
+        "Namespace": "AWS/SQS",
+        "Threshold": 0,
+        "AlarmDescription": Match.string_like_regexp("dead-letter"),
+    })
+    for metric_name in ("ConsumedWriteCapacityUnits", "ConsumedReadCapacityUnits"):
+        template.has_resource_properties("AWS::CloudWatch::Alarm", {"MetricName": metric_name, "Namespace": "AWS/DynamoDB"})
+
+
+# batched responders consume a queue each, its backlog and age are alarmed per vendor
+def test_responder_queue_alarms(synth, context):
+    template = synth(RefactoredlScatterGatherStack, performance_profile="throughput")
+    vendors = context()["car_rentals"]
+    alarms = template.find_resources("AWS::CloudWatch::Alarm", {"Properties": {"MetricName": "ApproximateAgeOfOldestMessage"}})
+    # the aggregator and gather-deadline queues, and one queue per vendor
+    assert len(alarms) == 2 + len(vendors)
+
+
+# every dead-letter queue has an alarm: the aggregator and gather-deadline queues, and the queue of every batched responder
+def test_dead_letter_queue_alarms(synth, context):
+    template = synth(RefactoredlScatterGatherStack, performance_profile="throughput")
+    alarms = template.find_resources("AWS::CloudWatch::Alarm", {"Properties": {"AlarmDescription": Match.string_like_regexp("dead-letter")}})
+    assert len(alarms) == 2 + len(context()["car_rentals"])
+    for name in ["aggregator", "gather-deadline"] + [f"responder-{vendor}" for vendor in context()["car_rentals"]]:
+        template.has_resource_properties("AWS::CloudWatch::Alarm", {"AlarmDescription": f"messages moved to the {name} dead-letter queue"})
+
+
+def test_map_workflow_alarms_the_vendor_responder_once(synth, context):
+    template = synth(OriginalScatterGatherStack, sfn_fan_out="map")
+    template.resource_count_is("AWS::CloudWatch::Dashboard", len(context()["car_rentals"]))
+    alarms = template.find_resources("AWS::CloudWatch::Alarm", {"Properties": {"MetricName": "Duration"}})
+    assert len(alarms) == 1
+
+
+@pytest.mark.parametrize("stack_class", [OriginalScatterGatherStack, RefactoredlScatterGatherStack])
+def test_monitoring_snapshot(stack_class, synth):
+    assert_snapshot(stack_class.__name__, synth(stack_class))
+
+
+# the batched responders add their queues and dead-letter queues to the monitoring
+def test_monitoring_snapshot_with_responder_queues(synth):
+    assert_snapshot("RefactoredlScatterGatherStack-throughput", synth(RefactoredlScatterGatherStack, performance_profile="throughput"))
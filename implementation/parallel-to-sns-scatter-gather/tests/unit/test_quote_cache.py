@@ -0,0 +1,39 @@
+import datetime
+import pathlib
+
+import pytest
+from lambda_loader import LambdaContext, load_handler
+
+LAMBDA_DIR = pathlib.Path(__file__).parents[2].joinpath("scatter_gather", "lambda_")
+TABLE = "QuoteCacheTable"
+
+
+@pytest.fixture
+def requester(local_aws):
+    local_aws.dynamodb.create_table(TABLE, "cacheKey")
+    return load_handler(LAMBDA_DIR.joinpath("requester", "app.py"),
+                        {"QUOTE_CACHE_TABLE_NAME": TABLE, "QUOTE_CACHE_TTL_SECONDS": "300"})
+
+
+# the quotes of the step function are cached without the quote id, a hit carries the id of its own request
+def test_cache_hit_gets_the_quote_id_of_its_request(requester):
+    first = requester.lambda_handler({"data": {"car_type": "compact", "days_rental": 3}}, LambdaContext("requester"))
+    quotes = [dict(first["body"]["data"], vendor=vendor, price_quote=40.0) for vendor in ("avis", "hertz")]
+    requester.cache_handler({"request": first["body"], "quotes": quotes}, LambdaContext("quote-cache-writer"))
+    second = requester.lambda_handler({"data": {"car_type": "compact", "days_rental": 3}}, LambdaContext("requester"))
+    uuid = second["body"]["data"]["uuid"]
+    assert uuid != first["body"]["data"]["uuid"]
+    assert [quote["uuid"] for quote in second["body"]["quotes"]] == [uuid, uuid]
+    # a miss of the memory reads the entry of the table, it has no quote id either
+    requester.cache.entries.clear()
+    third = requester.lambda_handler({"data": {"car_type": "compact", "days_rental": 3}}, LambdaContext("requester"))
+    assert {quote["uuid"] for quote in third["body"]["quotes"]} == {third["body"]["data"]["uuid"]}
+
+
+# a request without a pickup date is priced for the current month, the key changes with the month
+def test_cache_key_includes_the_pricing_month(requester):
+    quote_cache = requester.quote_cache
+    request = {"car_type": "compact", "days_rental": 3}
+    assert quote_cache.cache_key(request, today=datetime.date(2023, 1, 31)) != quote_cache.cache_key(request, today=datetime.date(2023, 7, 1))
+    dated = dict(request, pickup_date="2023-07-14")
+    assert quote_cache.cache_key(dated, today=datetime.date(2023, 1, 31)) == quote_cache.cache_key(dated, today=datetime.date(2023, 7, 1))
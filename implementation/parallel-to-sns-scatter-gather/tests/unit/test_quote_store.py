@@ -0,0 +1,267 @@
+import decimal
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from lambda_loader import SHARED_LAYER, load_handler
+
+TABLE = "QuoteAggregatorTable"
+RANK_INDEX = "quote-rank"
+
+
+@pytest.fixture
+def aws(local_aws):
+    local_aws.dynamodb.create_table(TABLE, "quoteId", "vendor", indexes={RANK_INDEX: ("quoteId", "bestRate")})
+    return local_aws
+
+
+# a fresh quote_store for every test, so its clients and table handles are created on the stand-ins of the test
+@pytest.fixture
+def quote_store(aws):
+    return load_handler(SHARED_LAYER.joinpath("quote_store.py"))
+
+
+def bank_quote(bank, rate):
+    return {"bankId": bank, "rate": decimal.Decimal(rate)}
+
+
+def items(aws, sort_prefix="VENDOR#"):
+    return [item for item in aws.dynamodb.items(TABLE) if item["vendor"].startswith(sort_prefix)]
+
+
+def test_duplicate_writer_is_appended_once(aws, quote_store):
+    store = quote_store.QuoteStore(TABLE, "quoteId", "vendor", idempotency_field="bankId", rank_field="rate")
+    key = ("q1", "VENDOR#banks")
+    assert store.write({key: [bank_quote("Bank1", "4.50")]}) == set()
+    # a redelivered record, and the same quote twice in one batch
+    assert store.write({key: [bank_quote("Bank1", "4.50"), bank_quote("Bank1", "4.50")]}) == set()
+    [item] = items(aws)
+    assert item["Quotes"] == [bank_quote("Bank1", "4.50")]
+    assert item[quote_store.WRITERS_ATTRIBUTE] == {"Bank1"}
+
+
+# without an idempotency field the id of a quote is its writer, a redelivered quote is not appended again
+def test_redelivered_quote_is_appended_once(aws, quote_store):
+    store = quote_store.QuoteStore(TABLE, "quoteId", "vendor")
+    key = ("q1", "VENDOR#avis")
+    quotes = [{"carType": "compact", "rate": decimal.Decimal("40.00")}, {"carType": "suv", "rate": decimal.Decimal("65.00")}]
+    assert store.write({key: quotes}) == set()
+    assert store.write({key: quotes[:1]}) == set()
+    assert store.write({key: quotes}) == set()
+    assert store.read(key, consistent_read=True) == quotes
+    assert items(aws)[0][quote_store.WRITERS_ATTRIBUTE] == {quote_store.quote_id(quote) for quote in quotes}
+
+
+# the conditional append of a group fails on the writer stored before, the others are appended one by one
+def test_conditional_check_failure_appends_the_new_writers(aws, quote_store):
+    store = quote_store.QuoteStore(TABLE, "quoteId", "vendor", idempotency_field="bankId", rank_field="rate")
+    key = ("q1", "VENDOR#banks")
+    store.write({key: [bank_quote("Bank1", "4.50")]})
+    assert store.write({key: [bank_quote("Bank1", "4.50"), bank_quote("Bank2", "3.90"), bank_quote("Bank3", "5.10")]}) == set()
+    [item] = items(aws)
+    assert [quote["bankId"] for quote in item["Quotes"]] == ["Bank1", "Bank2", "Bank3"]
+    assert item[quote_store.WRITERS_ATTRIBUTE] == {"Bank1", "Bank2", "Bank3"}
+    assert item[quote_store.BEST_RATE_ATTRIBUTE] == decimal.Decimal("3.90")
+
+
+def test_best_rate_is_only_lowered(aws, quote_store):
+    store = quote_store.QuoteStore(TABLE, "quoteId", "vendor", idempotency_field="bankId", rank_field="rate")
+    key = ("q1", "VENDOR#banks")
+    for bank, rate in [("Bank1", "4.50"), ("Bank2", "3.90"), ("Bank3", "5.10")]:
+        store.write({key: [bank_quote(bank, rate)]})
+    assert items(aws)[0][quote_store.BEST_RATE_ATTRIBUTE] == decimal.Decimal("3.90")
+
+
+def test_single_writer_redelivery_rewrites_the_item(aws, quote_store):
+    store = quote_store.QuoteStore(TABLE, "quoteId", "vendor", single_writer=True, rank_field="rate")
+    groups = {("q1", f"VENDOR#{vendor}"): [{"carType": "compact", "rate": decimal.Decimal(rate)}]
+              for vendor, rate in [("avis", "40.00"), ("hertz", "35.50")]}
+    assert store.write(groups) == set()
+    assert store.write(groups) == set()
+    assert aws.calls.snapshot()[("dynamodb", "BatchWriteItem")] == 2
+    assert {item["vendor"]: item["Quotes"] for item in items(aws)} == {key[1]: quotes for key, quotes in groups.items()}
+
+
+# two aggregators write records of the same request in concurrent batches: the quotes of both are kept
+def test_two_writers_on_one_partition(aws, quote_store):
+    writers = [quote_store.QuoteStore(TABLE, "quoteId", "vendor", rank_field="rate") for _ in range(2)]
+    compact, suv = {"carType": "compact", "rate": decimal.Decimal("40.00")}, {"carType": "suv", "rate": decimal.Decimal("38.00")}
+    batches = [{("q1", "VENDOR#avis"): [compact], ("q1", "VENDOR#hertz"): [compact]},
+               {("q1", "VENDOR#avis"): [suv], ("q1", "VENDOR#sixt"): [suv]}]
+    for _ in range(3):
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            assert list(pool.map(lambda writer, groups: writer.write(groups), writers, batches)) == [set(), set()]
+    stored = writers[0].read_partition("q1", "VENDOR#", consistent_read=True)
+    assert sorted(stored["VENDOR#avis"], key=lambda quote: quote["rate"]) == [suv, compact]
+    assert stored["VENDOR#hertz"] == [compact] and stored["VENDOR#sixt"] == [suv]
+    assert {item["vendor"]: item[quote_store.BEST_RATE_ATTRIBUTE] for item in items(aws)}["VENDOR#avis"] == decimal.Decimal("38.00")
+
+
+# a throttled partition leaves items unprocessed, the keys still unprocessed after the last attempt are returned
+def test_unprocessed_items_are_reported_as_failed_keys(aws, quote_store):
+    aws.dynamodb.partition_write_capacity = 2
+    store = quote_store.QuoteStore(TABLE, "quoteId", "vendor", single_writer=True)
+    groups = {("q1", f"VENDOR#{index}"): [{"rate": decimal.Decimal(index)}] for index in range(5)}
+    failed = store.write(groups)
+    assert len(failed) == 3
+    assert {item["vendor"] for item in items(aws)} == {key[1] for key in groups} - {key[1] for key in failed}
+    assert aws.calls.snapshot()[("dynamodb", "BatchWriteItem")] == quote_store.BATCH_WRITE_ATTEMPTS
+
+
+# identical quotes collapse into one item of the item layout
+def test_item_layout_stores_a_quote_once(aws, quote_store):
+    store = quote_store.QuoteStore(TABLE, "quoteId", "vendor", layout=quote_store.ITEM)
+    key = ("q1", "VENDOR#avis")
+    quote = {"carType": "compact", "rate": decimal.Decimal("40.00")}
+    store.write({key: [quote, quote]})
+    store.write({key: [quote]})
+    assert len(items(aws)) == 1
+    assert store.read(key, consistent_read=True) == [quote]
+
+
+def test_read_page_returns_every_vendor_once(aws, quote_store):
+    store = quote_store.QuoteStore(TABLE, "quoteId", "vendor", single_writer=True)
+    groups = {("q1", f"VENDOR#{index:02d}"): [{"rate": decimal.Decimal(index)}] for index in range(7)}
+    store.write(groups)
+    pages = []
+    start_key = None
+    while True:
+        page, start_key = store.read_page("q1", "VENDOR#", page_size=3, start_key=start_key)
+        pages.append(page)
+        if start_key is None:
+            break
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [sort_value for page in pages for sort_value, _ in page] == [key[1] for key in groups]
+    assert dict(entry for page in pages for entry in page) == dict(store.read_partition("q1", "VENDOR#"))
+
+
+def test_best_reads_the_cheapest_vendor(aws, quote_store):
+    store = quote_store.QuoteStore(TABLE, "quoteId", "vendor", single_writer=True, rank_field="rate", rank_index=RANK_INDEX)
+    store.write({("q1", f"VENDOR#{vendor}"): [{"rate": decimal.Decimal(rate)}]
+                 for vendor, rate in [("avis", "40.00"), ("hertz", "35.50"), ("sixt", "38.00")]})
+    assert store.best("q1") == ("VENDOR#hertz", decimal.Decimal("35.50"), [{"rate": decimal.Decimal("35.50")}])
+    assert store.best("q2") is None
+
+
+def compact_store(quote_store, top_k=3, history_ttl=3600):
+    return quote_store.QuoteStore(TABLE, "quoteId", "vendor", layout=quote_store.COMPACT, idempotency_field="bankId",
+                                  rank_field="rate", top_k=top_k, history_ttl=history_ttl)
+
+
+RATES = ["5.10", "4.50", "6.00", "3.90", "4.80", "7.25", "4.10", "5.55", "3.95", "6.40"]
+
+
+def test_compact_keeps_the_top_k_quotes(aws, quote_store):
+    store = compact_store(quote_store)
+    key = ("q1", "VENDOR#banks")
+    for index, rate in enumerate(RATES):
+        assert store.write({key: [bank_quote(f"Bank{index}", rate)]}) == set()
+    [item] = items(aws)
+    assert item["Quotes"] == [bank_quote("Bank3", "3.90"), bank_quote("Bank8", "3.95"), bank_quote("Bank6", "4.10")]
+    assert item[quote_store.BEST_RATE_ATTRIBUTE] == decimal.Decimal("3.90")
+    # the merges of 7.25, 5.55 and 6.40 read the item and leave it as it is
+    assert item[quote_store.VERSION_ATTRIBUTE] == len(RATES) - 3
+    assert sorted(quote["bankId"] for quote in store.history(key, consistent_read=True)) == sorted(f"Bank{index}" for index in range(len(RATES)))
+
+
+def test_history_items_expire_after_the_ttl(aws, quote_store):
+    store = compact_store(quote_store, history_ttl=3600)
+    key = ("q1", "VENDOR#banks")
+    before = int(quote_store.time.time())
+    store.write({key: [bank_quote(f"Bank{index}", rate) for index, rate in enumerate(RATES)]})
+    after = int(quote_store.time.time())
+    history = items(aws, quote_store.HISTORY_PREFIX)
+    assert len(history) == len(RATES)
+    for item in history:
+        assert before + 3600 <= item[quote_store.TTL_ATTRIBUTE] <= after + 3600
+    # the inline item holds quotes, it never expires
+    assert quote_store.TTL_ATTRIBUTE not in items(aws)[0]
+
+
+def test_redelivered_quote_costs_a_read_only(aws, quote_store):
+    store = compact_store(quote_store)
+    key = ("q1", "VENDOR#banks")
+    store.write({key: [bank_quote("Bank1", "4.50"), bank_quote("Bank2", "3.90")]})
+    aws.calls.reset()
+    assert store.write({key: [bank_quote("Bank1", "4.50")]}) == set()
+    calls = aws.calls.snapshot()
+    assert calls[("dynamodb", "GetItem")] == 1
+    assert ("dynamodb", "PutItem") not in calls
+    assert items(aws)[0][quote_store.VERSION_ATTRIBUTE] == 1
+
+
+# another aggregator merges between the read and the put of a merge, the version condition fails and the merge is repeated
+def test_concurrent_merge_is_repeated(aws, quote_store, monkeypatch):
+    store = compact_store(quote_store)
+    key = ("q1", "VENDOR#banks")
+    store.write({key: [bank_quote("Bank1", "4.50")]})
+    put_item = aws.dynamodb.put_item
+
+    def interleaved(**kwargs):
+        monkeypatch.setattr(aws.dynamodb, "put_item", put_item)
+        assert store.write({key: [bank_quote("Bank2", "3.90")]}) == set()
+        return put_item(**kwargs)
+    monkeypatch.setattr(aws.dynamodb, "put_item", interleaved)
+    aws.calls.reset()
+    assert store.write({key: [bank_quote("Bank3", "4.10")]}) == set()
+    [item] = items(aws)
+    assert item["Quotes"] == [bank_quote("Bank2", "3.90"), bank_quote("Bank3", "4.10"), bank_quote("Bank1", "4.50")]
+    assert item[quote_store.VERSION_ATTRIBUTE] == 3
+    # the put of the interleaved merge, and the failed and the repeated put of the merge
+    assert aws.calls.snapshot()[("dynamodb", "PutItem")] == 3
+
+
+# a key changed by another merge on every attempt is reported as failed, its history item is stored already
+def test_merge_gives_up_after_its_attempts(aws, quote_store, monkeypatch):
+    store = compact_store(quote_store)
+    key = ("q1", "VENDOR#banks")
+    store.write({key: [bank_quote("Bank1", "4.50")]})
+    put_item = aws.dynamodb.put_item
+    competitors = iter(range(quote_store.MERGE_ATTEMPTS))
+
+    def interleaved(**kwargs):
+        monkeypatch.setattr(aws.dynamodb, "put_item", put_item)
+        competitor = next(competitors)
+        store.write({key: [bank_quote(f"Other{competitor}", f"{3 - competitor / 10:.2f}")]})
+        monkeypatch.setattr(aws.dynamodb, "put_item", interleaved)
+        return put_item(**kwargs)
+    monkeypatch.setattr(aws.dynamodb, "put_item", interleaved)
+    assert store.write({key: [bank_quote("Bank2", "1.00")]}) == {key}
+    monkeypatch.setattr(aws.dynamodb, "put_item", put_item)
+    assert "Bank2" not in [quote["bankId"] for quote in items(aws)[0]["Quotes"]]
+    assert "Bank2" in [quote["bankId"] for quote in store.history(key, consistent_read=True)]
+
+
+# distinct rates, so the cheapest vendor is the same however the items are spread
+def vendor_groups(vendors=40):
+    return {("q1", f"VENDOR#{index:03d}"): [{"carType": "compact", "rate": decimal.Decimal(f"{30 + index * 7 % 41}.50")}]
+            for index in range(vendors)}
+
+
+def test_sharded_writes_spread_over_the_shards(aws, quote_store):
+    store = quote_store.QuoteStore(TABLE, "quoteId", "vendor", single_writer=True, shards=4)
+    assert store.write(vendor_groups()) == set()
+    stored = items(aws)
+    assert {item["quoteId"] for item in stored} == {f"q1#{shard}" for shard in range(4)}
+    for item in stored:
+        assert item["quoteId"] == f"q1#{quote_store.shard_of(item['vendor'], 4)}"
+
+
+# a sharded request reads back the same quotes, in the same order, as the request in one partition
+@pytest.mark.parametrize("layout", ["list", "item"])
+def test_sharded_partition_reads_like_the_unsharded_one(aws, quote_store, layout):
+    aws.dynamodb.create_table("ShardedTable", "quoteId", "vendor", indexes={RANK_INDEX: ("quoteId", "bestRate")})
+    options = dict(layout=layout, single_writer=True, rank_field="rate", rank_index=RANK_INDEX)
+    unsharded = quote_store.QuoteStore(TABLE, "quoteId", "vendor", **options)
+    sharded = quote_store.QuoteStore("ShardedTable", "quoteId", "vendor", shards=8, **options)
+    groups = vendor_groups()
+    for store in (unsharded, sharded):
+        assert store.write(groups) == set()
+    expected = unsharded.read_partition("q1", "VENDOR#")
+    assert list(expected) == [key[1] for key in groups]
+    assert sharded.read_partition("q1", "VENDOR#") == expected
+    assert sharded.best("q1") == unsharded.best("q1")
+    for key in list(groups)[:5]:
+        assert sharded.read(key) == unsharded.read(key)
+    # a page ends inside a shard or at its end, every vendor is read once
+    streamed = list(sharded.stream_partition("q1", "VENDOR#", page_size=7))
+    assert sorted(streamed) == sorted(expected.items())
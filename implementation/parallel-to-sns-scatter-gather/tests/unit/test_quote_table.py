@@ -0,0 +1,49 @@
+import pytest
+from aws_cdk.assertions import Match
+
+from scatter_gather.refactored_component import RefactoredlScatterGatherStack
+
+
+# the refactored stack in a region of the account, the global table settings depend on it
+@pytest.fixture
+def synth_in_region(synth):
+    def synthesize(region="us-east-1", **overrides):
+        return synth(RefactoredlScatterGatherStack, region=region, **overrides)
+    return synthesize
+
+
+def test_write_sharding_environment(synth_in_region):
+    template = synth_in_region(quote_table_shards=8)
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "app.lambda_handler",
+        "Environment": {"Variables": Match.object_like({"QUOTE_TABLE_SHARDS": "8"})},
+    })
+
+
+def test_no_sharding_by_default(synth_in_region):
+    template = synth_in_region()
+    functions = template.find_resources("AWS::Lambda::Function", {
+        "Properties": {"Environment": {"Variables": Match.object_like({"QUOTE_TABLE_SHARDS": Match.any_value()})}}
+    })
+    assert functions == {}
+
+
+# the stack of the first region creates the global table, with a replica in every other region
+def test_global_table_replicas(synth_in_region):
+    template = synth_in_region(quote_table_regions=["us-east-1", "eu-west-1", "ap-southeast-2"])
+    template.has_resource_properties("AWS::DynamoDB::Table", {"TableName": "QuoteAggregatorTable"})
+    template.resource_count_is("Custom::DynamoDBReplica", 2)
+
+
+# the stacks of the other regions use their replica of the table
+def test_global_table_replica_region(synth_in_region):
+    template = synth_in_region(region="eu-west-1", quote_table_regions="us-east-1,eu-west-1")
+    template.resource_count_is("AWS::DynamoDB::Table", 0)
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Environment": {"Variables": Match.object_like({"QUOTE_TABLE_NAME": "QuoteAggregatorTable"})},
+    })
+
+
+def test_global_table_region_not_listed(synth_in_region):
+    with pytest.raises(ValueError):
+        synth_in_region(region="sa-east-1", quote_table_regions=["us-east-1", "eu-west-1"])
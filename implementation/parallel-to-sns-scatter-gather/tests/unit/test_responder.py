@@ -0,0 +1,43 @@
+import json
+import pathlib
+import uuid
+
+import pytest
+from lambda_loader import LambdaContext, load_handler
+
+LAMBDA_DIR = pathlib.Path(__file__).parents[2].joinpath("scatter_gather", "lambda_")
+QUEUE_URL_PREFIX = "https://sqs.local.amazonaws.com/000000000000"
+
+
+@pytest.fixture
+def responder(local_aws):
+    return load_handler(LAMBDA_DIR.joinpath("responder", "app.py"), {
+        "vendor": "avis", "base_rate": "50", "faults": json.dumps({"error_rate": 1.0}),
+        "QUOTE_QUEUE_URL": f"{QUEUE_URL_PREFIX}/sqs-aggregator", "DEAD_LETTER_QUEUE_URL": f"{QUEUE_URL_PREFIX}/sqs-avis-dlq"
+    })
+
+
+def sqs_record(body):
+    return {"messageId": str(uuid.uuid4()), "body": body, "eventSource": "aws:sqs",
+            "eventSourceARN": "arn:aws:sqs:local:000000000000:sqs-avis"}
+
+
+# a failed vendor call reports its records as failed, the poison record of the batch is dead-lettered once
+def test_failed_vendor_call_fails_its_records(local_aws, responder):
+    dead_letters = local_aws.queue("sqs-avis-dlq")
+    local_aws.queue("sqs-aggregator")
+    request = sqs_record(json.dumps({"responsePayload": {"statusCode": 200, "body": {"data": {"uuid": "q1", "days_rental": 3}}}}))
+    poison = sqs_record("{}")
+    response = responder.lambda_handler({"Records": [request, poison]}, LambdaContext("responder-avis"))
+    # only the priced record comes back, the poison record is not delivered again
+    assert response["batchItemFailures"] == [{"itemIdentifier": request["messageId"]}]
+    assert len(dead_letters) == 1
+
+
+# a record without an eventSourceARN is dead-lettered without a source attribute, SQS rejects empty values
+def test_dead_letter_without_event_source(local_aws, responder):
+    dead_letters = local_aws.queue("sqs-avis-dlq")
+    poison = {"messageId": str(uuid.uuid4()), "body": "{}"}
+    assert responder.sqs_batch.dead_letter([(poison, "ValueError: no responsePayload")]) == []
+    [record] = dead_letters.receive(1, 0.0)
+    assert set(record["messageAttributes"]) == {"error"}
@@ -0,0 +1,34 @@
+from aws_cdk.assertions import Match
+
+from scatter_gather.refactored_component import UNCACHED_REQUESTS_FILTER_POLICY, RefactoredlScatterGatherStack
+
+
+# a cached request is answered by the requester, its destination record does not reach the responders
+def test_quote_cache_filters_cached_requests(synth, context):
+    template = synth(RefactoredlScatterGatherStack, quote_cache_ttl_seconds=60)
+    subscriptions = template.find_resources("AWS::SNS::Subscription", {
+        "Properties": {"FilterPolicyScope": "MessageBody", "FilterPolicy": UNCACHED_REQUESTS_FILTER_POLICY}
+    })
+    # one per responder
+    assert len(subscriptions) == len(template.find_resources("AWS::SNS::Subscription", {
+        "Properties": {"TopicArn": {"Ref": Match.string_like_regexp("ScatterTopic")}}
+    }))
+    assert len(subscriptions) == len(context()["car_rentals"])
+
+
+def test_no_filter_policy_without_quote_cache(synth):
+    template = synth(RefactoredlScatterGatherStack)
+    subscriptions = template.find_resources("AWS::SNS::Subscription", {
+        "Properties": {"FilterPolicy": Match.any_value()}
+    })
+    assert subscriptions == {}
+
+
+# the requester sends the deadline message of a request with the delay of the request, the queue delays nothing itself
+def test_deadline_is_sent_by_the_requester(synth):
+    template = synth(RefactoredlScatterGatherStack, gather_deadline_seconds=45)
+    deadline_queues = template.find_resources("AWS::SQS::Queue", {"Properties": {"DelaySeconds": Match.any_value()}})
+    assert deadline_queues == {}
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Environment": {"Variables": Match.object_like({"DEADLINE_QUEUE_URL": Match.any_value(), "GATHER_DEADLINE_SECONDS": "45"})}
+    })
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: cache_admin.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Operator tool for the quote cache (quote_cache_ttl_seconds in cdk.json). Entries are keyed on a version
+# derived from the car_rentals context, so redeploying a changed base_rate stops hits on older entries
+# right away; this tool removes those stale entries, a single request or the whole cache before their TTL.
+#
+# usage: python tools/cache_admin.py --table <QuoteCacheTableName> invalidate --stale
+#        python tools/cache_admin.py --table <QuoteCacheTableName> invalidate --car-type L --days-rental 30
+#        python tools/cache_admin.py --table <QuoteCacheTableName> invalidate --all
+import argparse
+import hashlib
+import json
+import pathlib
+import sys
+
+import boto3
+
+PROJECT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT.parent.joinpath("shared", "layer", "python")))
+
+import quote_cache  # noqa: E402
+
+
+# QUOTE_CACHE_VERSION as set by LambdaStates for the car_rentals context in cdk.json
+def current_version():
+    with open(PROJECT.joinpath("cdk.json")) as cdk_json:
+        car_rentals = json.load(cdk_json)['context']['car_rentals']
+    return hashlib.sha256(json.dumps(car_rentals, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def delete_where(table, keep):
+    deleted = 0
+    scan = {'ProjectionExpression': 'cacheKey, version'}
+    with table.batch_writer() as batch:
+        while True:
+            response = table.scan(**scan)
+            for item in response.get('Items', []):
+                if not keep(item):
+                    batch.delete_item(Key={'cacheKey': item['cacheKey']})
+                    deleted += 1
+            if 'LastEvaluatedKey' not in response:
+                return deleted
+            scan['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--table', required=True, help='QuoteCacheTableName output of the stack')
+    commands = parser.add_subparsers(dest='command', required=True)
+    invalidate = commands.add_parser('invalidate', help='delete cache entries')
+    scope = invalidate.add_mutually_exclusive_group(required=True)
+    scope.add_argument('--stale', action='store_true', help='entries written for an older car_rentals configuration')
+    scope.add_argument('--all', action='store_true', help='every entry')
+    scope.add_argument('--car-type', help='the entry of a single request, together with --days-rental')
+    invalidate.add_argument('--days-rental', type=int)
+    invalidate.add_argument('--pickup-date')
+    args = parser.parse_args()
+    if args.car_type and args.days_rental is None:
+        parser.error('--car-type needs --days-rental')
+
+    table = boto3.resource('dynamodb').Table(args.table)
+    version = current_version()
+    if args.car_type:
+        request = {'car_type': args.car_type, 'days_rental': args.days_rental, 'pickup_date': args.pickup_date}
+        table.delete_item(Key={'cacheKey': quote_cache.cache_key(request, version)})
+        print(f"deleted the entry of {request}")
+        return
+    if args.all:
+        deleted = delete_where(table, lambda item: False)
+    else:
+        deleted = delete_where(table, lambda item: item.get('version') == version)
+    print(f"deleted {deleted} entries")
+
+
+if __name__ == '__main__':
+    main()
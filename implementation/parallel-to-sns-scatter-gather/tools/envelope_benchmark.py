@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: envelope_benchmark.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Micro-benchmark of the message envelope of the SNS scatter-gather: the nested JSON of the original
+# handlers (the requester body and the responder quotes are JSON strings inside the destination record)
+# against the envelope codec, with the json module and with orjson when it is installed. A quote
+# request goes requester -> SNS destination -> responder -> SQS destination -> aggregator. The bytes are
+# those of the SNS message and the SQS message body, the CPU time is what the three functions spend
+# encoding their responses and decoding their records (the destination record itself is built by Lambda).
+#
+# usage: python tools/envelope_benchmark.py --requests 20000
+import argparse
+import json
+import pathlib
+import sys
+import time
+import uuid
+
+PROJECT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT.parent.joinpath("shared", "layer", "python")))
+sys.path.insert(0, str(PROJECT.parent.joinpath("shared", "local")))
+
+import envelope  # noqa: E402
+from aws_stand_ins import destination_record  # noqa: E402
+from benchmark import format_table  # noqa: E402
+
+
+def sample_requests(count):
+    return [{'data': {'car_type': 'LX'[index % 2], 'days_rental': index % 40 + 1, 'pickup_date': '2024-07-15'}} for index in range(count)]
+
+
+# handlers before the envelope codec
+def nested_requester(event):
+    event['data']['uuid'] = str(uuid.uuid4())
+    return {'statusCode': 200, 'body': json.dumps(event)}
+
+
+def nested_responder(event):
+    sns_message = json.loads(event['Records'][0]['Sns']['Message'])
+    body = sns_message['responsePayload']['body']
+    if isinstance(body, str):
+        body = json.loads(body)
+    body['data']['price_quote'] = 99 * body['data']['days_rental']
+    body['data']['vendor'] = 'Avis'
+    return {'statusCode': 200, 'quotes': [json.dumps(body['data'])]}
+
+
+def nested_aggregator(record):
+    payload = json.loads(record['body'])['responsePayload']
+    return [json.loads(data) for data in payload['quotes']]
+
+
+# handlers with the envelope codec
+def envelope_requester(event):
+    event['data']['uuid'] = str(uuid.uuid4())
+    return envelope.request_response(event)
+
+
+def envelope_responder(event):
+    body = envelope.request(event['Records'][0])
+    body['data']['price_quote'] = 99 * body['data']['days_rental']
+    body['data']['vendor'] = 'Avis'
+    return envelope.quotes_response([body['data']])
+
+
+def envelope_aggregator(record):
+    return envelope.quotes(record)
+
+
+# the Lambda runtime encodes the response of a function with the json module
+def runtime_encode(response):
+    return json.dumps(response)
+
+
+def measure(name, requests, requester, responder, aggregator):
+    spent = 0.0
+    sns_bytes = sqs_bytes = 0
+    for request in requests:
+        started = time.perf_counter()
+        response = requester(dict(request, data=dict(request['data'])))
+        runtime_encode(response)
+        spent += time.perf_counter() - started
+        message = json.dumps(destination_record("requester", request, response))
+        sns_bytes += len(message.encode('utf-8'))
+
+        event = {'Records': [{'EventSource': 'aws:sns', 'Sns': {'Message': message}}]}
+        started = time.perf_counter()
+        response = responder(event)
+        runtime_encode(response)
+        spent += time.perf_counter() - started
+        body = json.dumps(destination_record("responder-Avis", event, response))
+        sqs_bytes += len(body.encode('utf-8'))
+
+        started = time.perf_counter()
+        quotes = aggregator({'messageId': '0', 'body': body, 'eventSource': 'aws:sqs'})
+        spent += time.perf_counter() - started
+        assert quotes[0]['price_quote'] == 99 * request['data']['days_rental']
+    count = len(requests)
+    return {'envelope': name, 'requests': count, 'sns bytes/quote': sns_bytes / count, 'sqs bytes/quote': sqs_bytes / count,
+            'us/quote': spent / count * 1e6}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=20000, help='number of quote requests (default: 20000)')
+    args = parser.parse_args()
+
+    requests = sample_requests(args.requests)
+    results = [measure('nested json', requests, nested_requester, nested_responder, nested_aggregator)]
+    orjson = envelope.orjson
+    modes = [('codec (json)', None)] + ([('codec (orjson)', orjson)] if orjson is not None else [])
+    for name, module in modes:
+        envelope.orjson = module
+        results.append(measure(name, requests, envelope_requester, envelope_responder, envelope_aggregator))
+    envelope.orjson = orjson
+    print(format_table(results))
+    if orjson is None:
+        print("orjson is not installed, only the json module was measured")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: pricing_benchmark.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Micro-benchmark of the responder pricing: the original per-call function (int(base_rate) * days for
+# every request) against the pricing engine pricing whole batches, with and without NumPy.
+#
+# usage: python tools/pricing_benchmark.py --requests 100000 --batch-size 10
+import argparse
+import json
+import os
+import pathlib
+import random
+import sys
+import time
+
+PROJECT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT.joinpath("scatter_gather", "lambda_", "responder")))
+sys.path.insert(0, str(PROJECT.parent.joinpath("shared", "local")))
+
+import pricing  # noqa: E402
+from benchmark import format_table  # noqa: E402
+
+CAR_TYPES = ['S', 'M', 'L', 'X']
+RATE_TABLE = {
+    'base_rate': 99,
+    'car_types': {'S': 0.8, 'L': 1.5, 'X': 2.0},
+    'seasons': {'7': 1.2, '8': 1.2, '12': 1.1},
+    'discounts': {'7': 0.05, '28': 0.15}
+}
+
+
+# generate_price_quote before the pricing engine, the base rate is parsed from the environment on every call
+def per_call_price(data):
+    return int(os.environ['base_rate']) * int(data['days_rental'])
+
+
+def sample_requests(count, seed=1):
+    rng = random.Random(seed)
+    return [
+        {'car_type': rng.choice(CAR_TYPES), 'days_rental': rng.randint(1, 40), 'pickup_date': f"2024-{rng.randint(1, 12):02d}-15"}
+        for _ in range(count)
+    ]
+
+
+def measure(name, batches, price_batch, rate_table):
+    started = time.perf_counter()
+    priced = 0
+    for batch in batches:
+        priced += len(price_batch(batch))
+    elapsed = time.perf_counter() - started
+    return {'pricing': name, 'rate table': rate_table, 'batch size': len(batches[0]), 'requests': priced,
+            'requests/s': priced / elapsed if elapsed else 0.0, 'us/request': elapsed / priced * 1e6}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=100000, help='number of quote requests (default: 100000)')
+    parser.add_argument('--batch-size', type=int, default=10, help='quote requests per responder invocation (default: 10)')
+    args = parser.parse_args()
+
+    os.environ['base_rate'] = str(RATE_TABLE['base_rate'])
+    requests = sample_requests(args.requests)
+    batches = [requests[start:start + args.batch_size] for start in range(0, len(requests), args.batch_size)]
+    engines = {'base rate': pricing.PricingEngine(pricing.RateTable(RATE_TABLE['base_rate'])),
+               'full': pricing.PricingEngine(pricing.RateTable.from_config(json.loads(json.dumps(RATE_TABLE))))}
+
+    results = [measure('per call', batches, lambda batch: [per_call_price(data) for data in batch], 'base rate')]
+    numpy = pricing.numpy
+    modes = [('engine (lists)', None)] + ([('engine (numpy)', numpy)] if numpy is not None else [])
+    for name, module in modes:
+        pricing.numpy = module
+        for rate_table, engine in engines.items():
+            results.append(measure(name, batches, engine.price_batch, rate_table))
+    pricing.numpy = numpy
+    print(format_table(results))
+    if numpy is None:
+        print("numpy is not installed, only the list based engine was measured")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: simulator.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Runs the real requester, responder and aggregator handlers in-process against in-memory
+# stand-ins for SNS, SQS, Step Functions and DynamoDB, and compares the two designs:
+#
+#   parallel: requester -> Parallel state with one LambdaInvoke branch per vendor (SFNWorkflow)
+#   map:      requester -> Map state over the vendor list, one vendor responder (SFNWorkflow with fan_out="map")
+#   sns:      requester -> SNS destination -> responders -> SQS destination -> aggregator (RefactoredlScatterGatherStack)
+#
+# usage: python tools/simulator.py --design both --requests 500 --concurrency 20
+import argparse
+import contextlib
+import copy
+import json
+import pathlib
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+PROJECT = pathlib.Path(__file__).resolve().parents[1]
+LAMBDA_DIR = PROJECT.joinpath("scatter_gather", "lambda_")
+sys.path.insert(0, str(PROJECT.parent.joinpath("shared", "local")))
+
+from aws_stand_ins import LocalAWS, destination_record, json_default  # noqa: E402
+from benchmark import MetricSink, format_table, latency_summary  # noqa: E402
+from lambda_loader import LambdaContext, load_handler  # noqa: E402
+
+QUOTE_TABLE_NAME = 'QuoteAggregatorTable'
+QUOTE_RANK_INDEX = 'BestRateIndex'
+SCATTER_TOPIC_ARN = 'arn:aws:sns:local:000000000000:scatter-topic'
+QUOTES_TOPIC_ARN = 'arn:aws:sns:local:000000000000:quotes-topic'
+# filter policy of the scatter subscriptions with the quote cache, as in refactored_component.py
+UNCACHED_REQUESTS_FILTER_POLICY = {"responsePayload": {"body": {"data": {"cached": [{"exists": False}]}}}}
+QUOTE_CACHE_TABLE_NAME = 'QuoteCacheTable'
+QUEUE_URL_PREFIX = 'https://sqs.local.amazonaws.com/000000000000'
+# Lambda retries a failed asynchronous invocation twice (without the delays of the service here)
+ASYNC_RETRIES = 2
+
+
+# vendors as defined in the car_rentals context of cdk.json, extended with synthetic vendors when more are asked for
+def car_rentals(vendor_count=None):
+    with open(PROJECT.joinpath("cdk.json")) as cdk_json:
+        vendors = json.load(cdk_json)['context']['car_rentals']
+    names = list(vendors)
+    if vendor_count is None:
+        return vendors
+    result = {}
+    for index in range(vendor_count):
+        name = names[index] if index < len(names) else f"Vendor{index + 1}"
+        result[name] = dict(vendors[names[index % len(names)]])
+    return result
+
+
+# the faults of the command line for the vendors without faults of their own, only the first faulty_vendors when given
+def with_faults(vendors, faults, faulty_vendors=None):
+    if not faults:
+        return vendors
+    result = {}
+    for index, (vendor, config) in enumerate(vendors.items()):
+        config = dict(config)
+        if 'faults' not in config and (faulty_vendors is None or index < faulty_vendors):
+            config['faults'] = faults
+        result[vendor] = config
+    return result
+
+
+def sample_request(days_rental=None):
+    with open(PROJECT.joinpath("scatter_gather", "input.json")) as input_json:
+        request = json.load(input_json)
+    if days_rental is not None:
+        request['data']['days_rental'] = days_rental
+    return request
+
+
+class Simulation:
+
+    design = None
+    # environment of the requester besides the quote cache
+    requester_environment = {}
+
+    def __init__(self, vendors, hop_latency=0.0, ddb_latency=0.0, workers=64, cache_ttl=0, hedge_percentile=0, hedge_initial_delay_ms=0):
+        self.vendors = vendors
+        self.hop_latency = hop_latency
+        # asynchronous invocations (SNS deliveries, Parallel branches) run on this pool
+        self.invoker = ThreadPoolExecutor(max_workers=workers)
+        self.aws = LocalAWS(ddb_latency=ddb_latency, sns_latency=hop_latency, sqs_latency=hop_latency, dispatcher=self.invoker)
+        self.aws.dynamodb.create_table(QUOTE_TABLE_NAME, 'quoteId', 'vendor', indexes={QUOTE_RANK_INDEX: ('quoteId', 'bestRate')})
+        # quote_cache_ttl_seconds: the environment LambdaStates gives the functions using the quote cache
+        self.cache_environment = {}
+        if cache_ttl:
+            self.aws.dynamodb.create_table(QUOTE_CACHE_TABLE_NAME, 'cacheKey')
+            self.cache_environment = {'QUOTE_CACHE_TABLE_NAME': QUOTE_CACHE_TABLE_NAME, 'QUOTE_CACHE_TTL_SECONDS': str(cache_ttl),
+                                      'QUOTE_CACHE_VERSION': 'local'}
+        self.metrics = MetricSink()
+        # the stage metrics of the handlers are tagged with the simulated design
+        self.design_environment = {'SCATTER_GATHER_DESIGN': self.design}
+        # hedge_percentile / hedge_initial_delay_ms: the environment LambdaStates gives the responders
+        self.responder_environment = dict(self.design_environment)
+        if hedge_percentile:
+            self.responder_environment.update(HEDGE_PERCENTILE=str(hedge_percentile), HEDGE_INITIAL_DELAY_MS=str(hedge_initial_delay_ms))
+        with self.aws.install():
+            self.requester = load_handler(LAMBDA_DIR.joinpath("requester", "app.py"),
+                                          dict(self.requester_environment, **self.cache_environment, **self.design_environment))
+            self.responders = {
+                vendor: load_handler(LAMBDA_DIR.joinpath("responder", "app.py"), dict(config, vendor=vendor, **self.responder_environment))
+                for vendor, config in vendors.items()
+            }
+
+    def hop(self):
+        if self.hop_latency:
+            time.sleep(self.hop_latency)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        self.invoker.shutdown(wait=True)
+
+    def run_request(self, request):
+        raise NotImplementedError
+
+    # what the clients send, one request each unless a simulation sends them in bulk
+    def units(self, requests):
+        return requests
+
+    def run(self, requests, concurrency):
+        latencies = []
+        failures = []
+        lock = threading.Lock()
+
+        # a request whose execution fails (e.g. a failed branch of the Parallel state) is counted, not timed
+        def timed(request):
+            started = time.monotonic()
+            try:
+                self.run_request(request)
+            except Exception as error:
+                with lock:
+                    failures.append(error)
+                return
+            with lock:
+                latencies.append(time.monotonic() - started)
+
+        with self.aws.install(), contextlib.redirect_stdout(self.metrics):
+            self.start()
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=concurrency) as clients:
+                list(clients.map(timed, self.units(requests)))
+            elapsed = time.monotonic() - started
+            self.stop()
+        calls = self.aws.calls
+        result = {
+            'design': self.design,
+            'vendors': len(self.vendors),
+            'requests': len(requests),
+            'concurrency': concurrency,
+            'req/s': len(requests) / elapsed if elapsed else 0.0
+        }
+        result.update(latency_summary(latencies))
+        result['ddb calls/req'] = calls.total('dynamodb') / len(requests)
+        result['ddb wcu/req'] = self.aws.dynamodb.consumed(kind='write') / len(requests)
+        result['sns calls/req'] = calls.total('sns') / len(requests)
+        result['sqs calls/req'] = calls.total('sqs') / len(requests)
+        result['invocations/req'] = self.metrics.invocations() / len(requests)
+        result['failed'] = len(failures)
+        if self.cache_environment:
+            result['cache hits'] = self.metrics.totals.get('CacheHit', 0)
+        return result
+
+
+class ParallelSimulation(Simulation):
+    """SFNWorkflow: the requester task followed by a Parallel state with one branch per vendor."""
+
+    design = 'parallel'
+
+    def __init__(self, vendors, latency_budget=0, **kwargs):
+        super().__init__(vendors, **kwargs)
+        # sfn_latency_budget_seconds, the TimeoutSeconds of the responder tasks
+        self.latency_budget = latency_budget
+        self.unavailable = 0
+        self.lock = threading.Lock()
+        self.cache_writer = None
+        if self.cache_environment:
+            with self.aws.install():
+                self.cache_writer = load_handler(LAMBDA_DIR.joinpath("requester", "app.py"), dict(self.cache_environment, **self.design_environment))
+
+    def invoke_responder(self, vendor, request):
+        # input_path="$.request", result_selector={"quote": $.Payload.data}
+        self.hop()
+        response = self.responders[vendor].lambda_handler(copy.deepcopy(request), LambdaContext(f"responder-{vendor}"))
+        return response['data']
+
+    # TimeoutSeconds of a responder task: the latency budget, or the timeout_seconds of the vendor when it is lower
+    def vendor_timeout(self, config):
+        timeouts = [seconds for seconds in (self.latency_budget, float(config.get('timeout_seconds', 0))) if seconds]
+        return min(timeouts) if timeouts else None
+
+    # waits for the responder tasks, a task that timed out or failed is caught into an unavailable quote
+    def gather(self, tasks, request):
+        started = time.monotonic()
+        quotes = []
+        for vendor, task, timeout in tasks:
+            try:
+                quotes.append(task.result(timeout=None if timeout is None else max(0.0, timeout - (time.monotonic() - started))))
+            except Exception as error:
+                error_name = 'States.Timeout' if isinstance(error, FutureTimeoutError) else type(error).__name__
+                quotes.append({'uuid': request['data']['uuid'], 'vendor': vendor, 'unavailable': True, 'error': error_name})
+                with self.lock:
+                    self.unavailable += 1
+        return quotes
+
+    def run(self, requests, concurrency):
+        result = super().run(requests, concurrency)
+        result['unavailable'] = self.unavailable
+        return result
+
+    def run_request(self, request):
+        self.hop()
+        response = self.requester.lambda_handler(copy.deepcopy(request), LambdaContext("requester"))
+        # result_selector={"request": $.Payload.body}
+        state = {'request': response['body']}
+        # Choice "Cached" -> Pass "CachedQuotes"
+        if state['request']['data'].get('cached'):
+            return {'quotes': state['request']['quotes']}
+        self.hop()
+        branches = [(vendor, self.invoker.submit(self.invoke_responder, vendor, state['request']), self.vendor_timeout(self.vendors[vendor]))
+                    for vendor in self.responders]
+        result = {'quotes': self.gather(branches, state['request'])}
+        if self.cache_writer is not None:
+            # LambdaInvoke "CacheQuotes" with the execution input, result discarded
+            self.hop()
+            self.cache_writer.cache_handler({'request': copy.deepcopy(request), 'quotes': result['quotes']}, LambdaContext("quote-cache-writer"))
+        return result
+
+
+class MapSimulation(ParallelSimulation):
+    """SFNWorkflow with fan_out="map": a Map state over the vendors of the request, one vendor responder for all of them."""
+
+    design = 'map'
+
+    def __init__(self, vendors, max_concurrency=0, **kwargs):
+        super().__init__(vendors, **kwargs)
+        with self.aws.install():
+            self.vendor_responder = load_handler(LAMBDA_DIR.joinpath("responder", "app.py"), self.responder_environment)
+        # MaxConcurrency of the Map state, 0 runs every iteration at once
+        self.max_concurrency = max_concurrency
+        self.vendor_list = [dict(config, vendor=vendor) for vendor, config in vendors.items()]
+
+    def invoke_responder(self, vendor, request, slots=None):
+        # parameters={"data": $.request.data, "vendor": $$.Map.Item.Value}
+        self.hop()
+        with slots or contextlib.nullcontext():
+            response = self.vendor_responder.lambda_handler({'data': copy.deepcopy(request['data']), 'vendor': vendor}, LambdaContext("responder-any-vendor"))
+        return response['data']
+
+    def run_request(self, request):
+        self.hop()
+        response = self.requester.lambda_handler(copy.deepcopy(request), LambdaContext("requester"))
+        state = {'request': response['body']}
+        if state['request']['data'].get('cached'):
+            return {'quotes': state['request']['quotes']}
+        # Choice "VendorsGiven" -> Pass "DefaultVendors"
+        vendors = state['request'].get('vendors') or self.vendor_list
+        slots = threading.Semaphore(self.max_concurrency) if self.max_concurrency else None
+        self.hop()
+        iterations = [(vendor['vendor'], self.invoker.submit(self.invoke_responder, vendor, state['request'], slots), self.vendor_timeout({}))
+                      for vendor in vendors]
+        result = {'quotes': self.gather(iterations, state['request'])}
+        if self.cache_writer is not None:
+            self.hop()
+            self.cache_writer.cache_handler({'request': copy.deepcopy(request), 'quotes': result['quotes']}, LambdaContext("quote-cache-writer"))
+        return result
+
+
+class SnsSimulation(Simulation):
+    """RefactoredlScatterGatherStack: SNS fan-out to the responders, SQS gather into the aggregator.
+
+    A quote request is complete when the aggregator (or the gather deadline function) publishes its aggregate."""
+
+    design = 'sns'
+    requester_environment = {'RESULT_TOPIC_ARN': QUOTES_TOPIC_ARN, 'SCATTER_TOPIC_ARN': SCATTER_TOPIC_ARN}
+
+    def __init__(self, vendors, batch_size=None, batch_window=1.0, deadline=30, pollers=5,
+                 responder_batch_size=0, responder_batch_window=1.0, malformed_rate=0.0, max_receive_count=5, bulk_size=0,
+                 quote_top_k=0, quote_shards=1, **kwargs):
+        # the requester sends every quote request that is not cached to the deadline queue, delayed by the deadline
+        self.requester_environment = dict(self.requester_environment, DEADLINE_QUEUE_URL=f"{QUEUE_URL_PREFIX}/sqs-gather-deadline",
+                                          GATHER_DEADLINE_SECONDS=str(deadline))
+        super().__init__(vendors, **kwargs)
+        # quote requests per bulk request of a client, 0 sends every request on its own
+        self.bulk_size = bulk_size
+        self.batch_size = batch_size or len(vendors)
+        self.batch_window = batch_window
+        self.poller_count = pollers
+        self.responder_batch_size = responder_batch_size
+        self.responder_batch_window = responder_batch_window
+        self.queue = self.aws.queue('sqs-aggregator')
+        # poison records are moved to the dead-letter queue by the aggregator, anything else by the redrive policy
+        self.dead_letter_queue = self.aws.queue('sqs-aggregator-dlq')
+        self.queue.redrive(self.dead_letter_queue, max_receive_count)
+        # share of the quote requests followed by a malformed record (no responsePayload) on the aggregator queue
+        self.malformed_rate = malformed_rate
+        self.malformed = random.Random(1)
+        # responder_batch_size: SNS -> one SQS queue per responder, the responders send their quotes to the aggregator queue
+        self.responder_queues = {}
+        if responder_batch_size:
+            with self.aws.install():
+                self.responders = {
+                    vendor: [load_handler(LAMBDA_DIR.joinpath("responder", "app.py"),
+                                          dict(config, vendor=vendor, QUOTE_QUEUE_URL=f"{QUEUE_URL_PREFIX}/sqs-aggregator", **self.responder_environment))
+                             for _ in range(pollers)]
+                    for vendor, config in vendors.items()
+                }
+            self.responder_queues = {vendor: self.aws.queue(f"sqs-responder-{vendor}") for vendor in vendors}
+        self.deadline_queue = self.aws.queue('sqs-gather-deadline')
+        self.deadline_queue.redrive(self.aws.queue('sqs-gather-deadline-dlq'), max_receive_count)
+        gather_environment = {
+            'QUOTE_TABLE_NAME': QUOTE_TABLE_NAME,
+            'QUOTE_RANK_INDEX': QUOTE_RANK_INDEX,
+            'EXPECTED_VENDORS': ','.join(vendors),
+            'RESULT_TOPIC_ARN': QUOTES_TOPIC_ARN
+        }
+        # quote_top_k: the compact layout of the quote store
+        if quote_top_k:
+            gather_environment.update(QUOTE_STORE_LAYOUT='compact', QUOTE_TOP_K=str(quote_top_k))
+        # quote_table_shards: write sharding of the quote table
+        if quote_shards > 1:
+            gather_environment.update(QUOTE_TABLE_SHARDS=str(quote_shards))
+        gather_environment.update(self.cache_environment)
+        gather_environment.update(self.design_environment)
+        # the SQS event source mapping polls with several concurrent batches, each one served by its own container
+        with self.aws.install():
+            self.aggregators = [load_handler(LAMBDA_DIR.joinpath("aggregator", "app.py"),
+                                             dict(gather_environment, DEAD_LETTER_QUEUE_URL=f"{QUEUE_URL_PREFIX}/sqs-aggregator-dlq"))
+                                for _ in range(pollers)]
+            self.gather_deadline = load_handler(LAMBDA_DIR.joinpath("aggregator", "app.py"),
+                                                dict(gather_environment, DEAD_LETTER_QUEUE_URL=f"{QUEUE_URL_PREFIX}/sqs-gather-deadline-dlq"))
+        self.completed = {}
+        self.published = {}
+        self.partial = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.pollers = []
+        # with the quote cache the scatter subscriptions filter out the cached requests (UNCACHED_REQUESTS_FILTER_POLICY
+        # of refactored_component.py), the requester publishes their aggregates itself
+        filter_policy = UNCACHED_REQUESTS_FILTER_POLICY if self.cache_environment else None
+        for vendor in self.responders:
+            if vendor in self.responder_queues:
+                self.aws.sns.subscribe(SCATTER_TOPIC_ARN, self.raw_subscriber(self.responder_queues[vendor]), filter_policy)
+            else:
+                self.aws.sns.subscribe(SCATTER_TOPIC_ARN, self.responder_subscriber(vendor), filter_policy)
+        self.aws.sns.subscribe(QUOTES_TOPIC_ARN, self.quotes_published)
+
+    def responder_subscriber(self, vendor):
+        def deliver(event):
+            for _ in range(ASYNC_RETRIES + 1):
+                try:
+                    response = self.responders[vendor].lambda_handler(event, LambdaContext(f"responder-{vendor}"))
+                except Exception:
+                    self.hop()
+                    continue
+                # on_success SqsDestination
+                self.queue.send(json.dumps(destination_record(f"responder-{vendor}", event, response), default=json_default))
+                return
+            # no on_failure destination, the gather deadline publishes the request without the quotes of the vendor
+        return deliver
+
+    # SqsSubscription with raw message delivery
+    @staticmethod
+    def raw_subscriber(queue):
+        def deliver(event):
+            queue.send(event['Records'][0]['Sns']['Message'])
+        return deliver
+
+    def quotes_published(self, event):
+        aggregate = json.loads(event['Records'][0]['Sns']['Message'])
+        with self.lock:
+            self.partial += 1 if aggregate['partial'] else 0
+            self.published[aggregate['uuid']] = aggregate
+            if aggregate['uuid'] in self.completed:
+                self.completed[aggregate['uuid']].set()
+
+    # an SqsEventSource: batch_size / max_batching_window, failed records come back
+    def poll(self, queue, handler, batch_size, batch_window, function_name):
+        while not self.stopped.is_set():
+            records = queue.receive(batch_size, batch_window, self.stopped)
+            if not records:
+                continue
+            try:
+                response = handler(queue.event(records), LambdaContext(function_name, timeout_seconds=10))
+            except Exception:
+                # a failed invocation returns every record of the batch to the queue
+                queue.redeliver(records)
+                continue
+            failed = {failure['itemIdentifier'] for failure in (response or {}).get('batchItemFailures', [])}
+            queue.redeliver([record for record in records if record['messageId'] in failed])
+
+    def start(self):
+        self.pollers = [
+            threading.Thread(target=self.poll, daemon=True,
+                             args=(self.queue, aggregator.lambda_handler, self.batch_size, self.batch_window, "aggregator"))
+            for aggregator in self.aggregators
+        ]
+        self.pollers.append(threading.Thread(target=self.poll, daemon=True,
+                                             args=(self.deadline_queue, self.gather_deadline.deadline_handler, 10, 0.0, "gather-deadline")))
+        for vendor, queue in self.responder_queues.items():
+            self.pollers.extend(
+                threading.Thread(target=self.poll, daemon=True,
+                                 args=(queue, responder.lambda_handler, self.responder_batch_size, self.responder_batch_window, f"responder-{vendor}"))
+                for responder in self.responders[vendor]
+            )
+        for poller in self.pollers:
+            poller.start()
+
+    def stop(self):
+        self.stopped.set()
+        for poller in self.pollers:
+            poller.join()
+        super().stop()
+
+    def units(self, requests):
+        if not self.bulk_size:
+            return requests
+        return [{'requests': [copy.deepcopy(request) for request in requests[start:start + self.bulk_size]]}
+                for start in range(0, len(requests), self.bulk_size)]
+
+    # waits until the aggregates of the quote requests are published
+    def wait_published(self, quote_uuids):
+        events = []
+        with self.lock:
+            for quote_uuid in quote_uuids:
+                done = self.completed[quote_uuid] = threading.Event()
+                if quote_uuid in self.published:
+                    done.set()
+                events.append(done)
+        for done in events:
+            done.wait()
+
+    # lambda invoke (RequestResponse) of the requester in bulk mode, no destination is involved
+    def run_bulk(self, request):
+        self.hop()
+        response = self.requester.lambda_handler(copy.deepcopy(request), LambdaContext("requester"))
+        self.wait_published(response['body']['bulk']['uuids'])
+
+    def run_request(self, request):
+        if 'requests' in request:
+            return self.run_bulk(request)
+        # lambda invoke-async of the requester
+        self.hop()
+        response = self.requester.lambda_handler(copy.deepcopy(request), LambdaContext("requester"))
+        quote_uuid = response['body']['data']['uuid']
+        done = threading.Event()
+        with self.lock:
+            self.completed[quote_uuid] = done
+            if quote_uuid in self.published:
+                done.set()
+        # on_success SnsDestination
+        self.aws.sns.publish(TopicArn=SCATTER_TOPIC_ARN, Message=json.dumps(destination_record("requester", request, response)))
+        with self.lock:
+            malformed = self.malformed.random() < self.malformed_rate
+        if malformed:
+            self.queue.send(json.dumps({'requestContext': {'condition': 'Success'}, 'responseContext': {'statusCode': 200}}))
+        done.wait()
+
+    def run(self, requests, concurrency):
+        result = super().run(requests, concurrency)
+        result['partial'] = self.partial
+        result['dead letters'] = len(self.dead_letter_queue)
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--design', choices=['parallel', 'map', 'sns', 'both', 'all'], default='both',
+                        help='both: parallel and sns, all: parallel, map and sns (default: both)')
+    parser.add_argument('--requests', type=int, default=200, help='number of quote requests (default: 200)')
+    parser.add_argument('--concurrency', type=int, default=10, help='concurrent quote requests (default: 10)')
+    parser.add_argument('--vendors', type=int, default=None, help='number of vendors (default: the car_rentals in cdk.json)')
+    parser.add_argument('--hop-latency-ms', type=float, default=0.0, help='latency of each SNS / SQS / Step Functions hop')
+    parser.add_argument('--ddb-latency-ms', type=float, default=0.0, help='latency of each DynamoDB call')
+    parser.add_argument('--batch-size', type=int, default=None, help='aggregator SQS batch size (default: number of vendors)')
+    parser.add_argument('--batch-window', type=float, default=2.0, help='aggregator SQS batching window in seconds (default: 2)')
+    parser.add_argument('--pollers', type=int, default=5, help='concurrent aggregator batches (default: 5)')
+    parser.add_argument('--responder-batch-size', type=int, default=0,
+                        help='consume quote requests through one SQS queue per responder with this batch size (default: 0, SNS invokes the responders)')
+    parser.add_argument('--responder-batch-window', type=float, default=1.0, help='responder SQS batching window in seconds (default: 1)')
+    parser.add_argument('--max-concurrency', type=int, default=0, help='MaxConcurrency of the Map state (default: 0, unlimited)')
+    parser.add_argument('--cache-ttl', type=int, default=0, help='quote cache TTL in seconds (default: 0, no cache)')
+    parser.add_argument('--distinct-requests', type=int, default=None,
+                        help='number of distinct quote requests (days_rental values) the requests are drawn from (default: all equal)')
+    parser.add_argument('--deadline', type=int, default=30, help='gather deadline of a quote request in whole seconds, the delay of its deadline message (default: 30)')
+    parser.add_argument('--malformed-rate', type=float, default=0.0,
+                        help='share of the quote requests followed by a malformed record on the aggregator queue (default: 0)')
+    parser.add_argument('--faults', type=json.loads, default=None,
+                        help='latency and faults of the vendors without faults in cdk.json, as JSON (see responder/faults.py), '
+                             'e.g. \'{"latency_ms": {"distribution": "lognormal", "median": 50, "p99": 800}}\'')
+    parser.add_argument('--faulty-vendors', type=int, default=None, help='apply --faults to the first N vendors only (default: all)')
+    parser.add_argument('--latency-budget', type=float, default=0.0,
+                        help='TimeoutSeconds of the responder tasks of the workflow, 0 waits for every vendor (default: 0)')
+    parser.add_argument('--hedge-percentile', type=float, default=0.0,
+                        help='hedge a vendor call that took longer than this percentile of its latencies (default: 0, no hedging)')
+    parser.add_argument('--hedge-initial-delay-ms', type=float, default=0.0,
+                        help='hedge delay until the responder observed enough latencies (default: 0, no hedge until then)')
+    parser.add_argument('--bulk-size', type=int, default=0,
+                        help='sns design: quote requests per bulk request to the requester (default: 0, one request per invocation)')
+    parser.add_argument('--quote-top-k', type=int, default=0,
+                        help='sns design: quotes kept inline per vendor item by the compact quote store layout (default: 0, list layout)')
+    parser.add_argument('--quote-shards', type=int, default=1,
+                        help='sns design: partition key values the vendor items of a request are spread over (default: 1, no sharding). '
+                             'writes only get faster up to the smallest count that is not throttled, every read queries all shards')
+    parser.add_argument('--stages', action='store_true', help='also print the latency per stage from the embedded metrics of the handlers')
+    args = parser.parse_args()
+
+    vendors = with_faults(car_rentals(args.vendors), args.faults, args.faulty_vendors)
+    requests = [sample_request(index % args.distinct_requests + 1 if args.distinct_requests else None) for index in range(args.requests)]
+    common = {'hop_latency': args.hop_latency_ms / 1000.0, 'ddb_latency': args.ddb_latency_ms / 1000.0,
+              'workers': max(64, args.concurrency * len(vendors)), 'cache_ttl': args.cache_ttl,
+              'hedge_percentile': args.hedge_percentile, 'hedge_initial_delay_ms': args.hedge_initial_delay_ms}
+    results = []
+    stages = []
+    simulations = []
+    if args.design in ('parallel', 'both', 'all'):
+        simulations.append(lambda: ParallelSimulation(vendors, latency_budget=args.latency_budget, **common))
+    if args.design in ('map', 'all'):
+        simulations.append(lambda: MapSimulation(vendors, max_concurrency=args.max_concurrency, latency_budget=args.latency_budget, **common))
+    if args.design in ('sns', 'both', 'all'):
+        simulations.append(lambda: SnsSimulation(vendors, batch_size=args.batch_size, batch_window=args.batch_window,
+                                                 deadline=args.deadline, pollers=args.pollers, responder_batch_size=args.responder_batch_size,
+                                                 responder_batch_window=args.responder_batch_window,
+                                                 malformed_rate=args.malformed_rate, bulk_size=args.bulk_size,
+                                                 quote_top_k=args.quote_top_k, quote_shards=args.quote_shards, **common))
+    for create in simulations:
+        simulation = create()
+        results.append(simulation.run(requests, args.concurrency))
+        stages.extend(simulation.metrics.stage_summary(simulation.design))
+    print(format_table(results))
+    if args.stages:
+        print()
+        print(format_table(stages))
+
+
+if __name__ == '__main__':
+    main()
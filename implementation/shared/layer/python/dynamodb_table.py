@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: dynamodb_table.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Table handles on the low-level DynamoDB client. They take and return plain python values like the
+# Table of the boto3 resource (Decimal numbers, sets, boto3 conditions), but convert them in one pass
+# over the parameters the handlers use instead of walking the service model on every call, and no
+# resource model is loaded to create them.
+import lambda_runtime
+
+# parameters holding attribute values, and the fields of a response holding items
+_VALUE_PARAMETERS = ('Item', 'Key', 'ExclusiveStartKey')
+_ITEM_FIELDS = ('Item', 'Attributes', 'LastEvaluatedKey')
+_CONDITION_PARAMETERS = (('KeyConditionExpression', True), ('ConditionExpression', False), ('FilterExpression', False))
+
+_serializer = None
+_deserializer = None
+
+
+def _types():
+    global _serializer, _deserializer
+    if _serializer is None:
+        from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+        _serializer, _deserializer = TypeSerializer(), TypeDeserializer()
+    return _serializer, _deserializer
+
+
+def serialize(item):
+    serializer, _ = _types()
+    return {name: serializer.serialize(value) for name, value in item.items()}
+
+
+def deserialize(item):
+    _, deserializer = _types()
+    return {name: deserializer.deserialize(value) for name, value in item.items()}
+
+
+# builds boto3 conditions (Key('quoteId').eq(...)) into expressions with placeholders, strings are passed on as they are
+def _expressions(parameters):
+    from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+    builder = None
+    for parameter, is_key_condition in _CONDITION_PARAMETERS:
+        condition = parameters.get(parameter)
+        if not isinstance(condition, ConditionBase):
+            continue
+        # one builder per call, the placeholders of the conditions of a call must not collide
+        builder = builder or ConditionExpressionBuilder()
+        built = builder.build_expression(condition, is_key_condition=is_key_condition)
+        parameters[parameter] = built.condition_expression
+        parameters['ExpressionAttributeNames'] = dict(parameters.get('ExpressionAttributeNames') or {}, **built.attribute_name_placeholders)
+        parameters['ExpressionAttributeValues'] = dict(parameters.get('ExpressionAttributeValues') or {}, **built.attribute_value_placeholders)
+    return parameters
+
+
+def _request(parameters):
+    parameters = _expressions(dict(parameters))
+    for parameter in _VALUE_PARAMETERS:
+        if parameter in parameters:
+            parameters[parameter] = serialize(parameters[parameter])
+    if parameters.get('ExpressionAttributeValues'):
+        parameters['ExpressionAttributeValues'] = serialize(parameters['ExpressionAttributeValues'])
+    return parameters
+
+
+def _response(response):
+    for field in _ITEM_FIELDS:
+        if field in response:
+            response[field] = deserialize(response[field])
+    if 'Items' in response:
+        response['Items'] = [deserialize(item) for item in response['Items']]
+    return response
+
+
+class Table:
+
+    def __init__(self, name, client=None):
+        self.name = name
+        self.table_name = name
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client or lambda_runtime.client('dynamodb')
+
+    def _call(self, operation, parameters):
+        return _response(getattr(self.client, operation)(TableName=self.name, **_request(parameters)))
+
+    def get_item(self, **parameters):
+        return self._call('get_item', parameters)
+
+    def put_item(self, **parameters):
+        return self._call('put_item', parameters)
+
+    def update_item(self, **parameters):
+        return self._call('update_item', parameters)
+
+    def delete_item(self, **parameters):
+        return self._call('delete_item', parameters)
+
+    def query(self, **parameters):
+        return self._call('query', parameters)
+
+
+# BatchWriteItem of the resource: {table name: [{'PutRequest': {'Item': item}} | {'DeleteRequest': {'Key': key}}]},
+# the unprocessed requests come back in the same shape
+def batch_write_item(RequestItems, client=None):
+    def convert(requests, convert_item):
+        return [{'PutRequest': {'Item': convert_item(request['PutRequest']['Item'])}} if 'PutRequest' in request
+                else {'DeleteRequest': {'Key': convert_item(request['DeleteRequest']['Key'])}} for request in requests]
+    response = (client or lambda_runtime.client('dynamodb')).batch_write_item(
+        RequestItems={name: convert(requests, serialize) for name, requests in RequestItems.items()})
+    response['UnprocessedItems'] = {name: convert(requests, deserialize) for name, requests in response.get('UnprocessedItems', {}).items()}
+    return response
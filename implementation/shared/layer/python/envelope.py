@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: envelope.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Envelope codec of the scatter-gather hop chain (requester -> SNS -> responder -> SQS -> aggregator).
+# The payloads of the handlers are plain JSON objects, never JSON strings inside a message: the Lambda
+# destination encodes a response once and the next handler decodes the record once. orjson is used when
+# it is installed in the layer, the json module otherwise. Payloads of the former nested format (a JSON
+# string in responsePayload.body / .data / .quotes) are still accepted while they are in flight.
+import decimal
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_default(value):
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"{type(value)} is not JSON serializable")
+
+
+def dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value, default=json_default).decode('utf-8')
+    return json.dumps(value, separators=(',', ':'), default=json_default)
+
+
+def loads(raw):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+# a value read from DynamoDB with its numbers and sets as JSON types, for responses the Lambda runtime encodes
+def plain(value):
+    return loads(dumps(value))
+
+
+def _decoded(value):
+    return loads(value) if isinstance(value, (str, bytes)) else value
+
+
+# responsePayload of the destination record carried by an SNS record, or by an SQS record with or without
+# raw message delivery of the SNS subscription
+def response_payload(record):
+    if 'Sns' in record:
+        message = loads(record['Sns']['Message'])
+    else:
+        message = loads(record['body'])
+        if 'responsePayload' not in message:
+            message = loads(message['Message'])
+    return message['responsePayload']
+
+
+# quote request sent by the requester ({"data": {...}, "vendors": [...]})
+def request(record):
+    return _decoded(response_payload(record)['body'])
+
+
+# quote requests of a record: the request itself, the requests of a bulk message, or none for the
+# acknowledgement a bulk request returns to its destination
+def requests(record):
+    body = request(record)
+    if 'requests' in body:
+        return [_decoded(item) for item in body['requests']]
+    if 'bulk' in body:
+        return []
+    return [body]
+
+
+# quotes of a responder record, a responder that priced a batch of quote requests returns all of them at once
+def quotes(record):
+    payload = response_payload(record)
+    if 'quotes' in payload:
+        return [_decoded(quote) for quote in payload['quotes']]
+    return [_decoded(payload['data'])]
+
+
+# responses of the handlers, encoded once by the Lambda destination or the step function
+def request_response(message):
+    return {'statusCode': 200, 'body': message}
+
+
+def quote_response(quote):
+    return {'statusCode': 200, 'data': quote}
+
+
+def quotes_response(quotes, **fields):
+    return dict({'statusCode': 200, 'quotes': quotes}, **fields)
+
+
+# acknowledgement of a bulk request, the requests themselves travel in bulk messages
+def bulk_response(uuids, **fields):
+    return request_response({'bulk': dict(fields, uuids=uuids)})
+
+
+# message the requester publishes for a chunk of a bulk request, shaped like a destination record
+def bulk_message(requests):
+    return dumps({'responsePayload': request_response({'requests': requests})})
+
+
+# message the requester sends to the deadline queue for a quote request, shaped like a destination record
+def request_message(message):
+    return dumps({'responsePayload': request_response(message)})
+
+
+# message body sent by a responder that consumes its quote requests from SQS, shaped like a destination record
+def quote_message(quote):
+    return dumps({'responsePayload': quote_response(quote)})
+
+
+def quotes_message(quotes):
+    return dumps({'responsePayload': quotes_response(quotes)})
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: instrumentation.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Hot-path instrumentation of the python functions. The stages of an invocation (parsing, pricing, every
+# DynamoDB / SNS / SQS call) are timed as spans and written to the function log as CloudWatch embedded
+# metric format when the invocation ends, one log line per span: the latency is a metric with the
+# dimensions Design / Service / Stage (and Vendor when the span has one), the quote ids are properties.
+# Values of an invocation that are no latency (e.g. the quotes a responder returned) are written the same way.
+# Payloads are logged lazily, at DEBUG or at INFO for a sample of the invocations (LOG_PAYLOAD_SAMPLE_RATE).
+# A sample of the events (EVENT_CAPTURE_SAMPLE_RATE) is logged whole, redacted, for shared/local/replay.py.
+import collections.abc
+import contextlib
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+METRIC_NAMESPACE = os.getenv('METRICS_NAMESPACE', 'ScatterGather')
+# design of the stack the function belongs to (sfn or sns), the same responder code runs in both
+DESIGN = os.getenv('SCATTER_GATHER_DESIGN', '')
+PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE') or 0)
+STAGE_METRICS = os.getenv('STAGE_METRICS', 'on').lower() not in ('off', 'false', '0')
+CAPTURE_SAMPLE_RATE = float(os.getenv('EVENT_CAPTURE_SAMPLE_RATE') or 0)
+# fields whose values are redacted in captured events, inside the JSON strings of SQS bodies and SNS messages too
+CAPTURE_REDACT = frozenset(name.strip() for name in os.getenv('EVENT_CAPTURE_REDACT', 'SSN,receiptHandle').split(',') if name.strip())
+REDACTED = 'REDACTED'
+
+# log names of the common span tags, any other tag is logged as it is (e.g. product_id)
+PROPERTY_NAMES = {'quote_id': 'QuoteId', 'error': 'Error'}
+
+# spans of the invocation running on a thread, the local simulators run several invocations at once
+_local = threading.local()
+
+
+# one embedded metric format record, properties are searchable in the logs without becoming metrics
+def metric_record(metrics, dimensions, units, properties=None, namespace=METRIC_NAMESPACE):
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': dimensions,
+                'Metrics': [{'Name': name, 'Unit': units.get(name, 'None')} for name in metrics]
+            }]
+        }
+    }
+    record.update(properties or {})
+    record.update(metrics)
+    return record
+
+
+def emit(*records):
+    if records:
+        print('\n'.join(json.dumps(record, default=str) for record in records))
+
+
+def _spans():
+    if not hasattr(_local, 'spans'):
+        _local.spans = []
+    return _local.spans
+
+
+# times a stage of the running invocation. the tags (quote_id, vendor) can be completed inside the span,
+# e.g. once a batch is parsed: with span('parse') as tags: ...; tags['quote_id'] = [...]
+@contextlib.contextmanager
+def span(stage, **tags):
+    started = time.perf_counter()
+    try:
+        yield tags
+    except BaseException:
+        tags['error'] = True
+        raise
+    finally:
+        _spans().append((stage, (time.perf_counter() - started) * 1000, tags))
+
+
+def _metrics():
+    if not hasattr(_local, 'metrics'):
+        _local.metrics = []
+    return _local.metrics
+
+
+# wraps a function another thread runs for the running invocation (e.g. a hedged vendor call), so its spans and
+# metrics are written with the ones of the invocation. the invocation must wait for the thread before it returns
+def in_invocation(function):
+    spans, metrics = _spans(), _metrics()
+
+    def run(*args, **kwargs):
+        _local.spans, _local.metrics = spans, metrics
+        return function(*args, **kwargs)
+    return run
+
+
+# records a value of the running invocation, written with the spans under Design / Service (and Vendor):
+# metric('Quotes', len(quotes), vendor=vendor)
+def metric(name, value, unit='Count', **tags):
+    _metrics().append((name, value, unit, tags))
+
+
+def _span_record(service, request_id, stage, latency, tags):
+    return _record(service, request_id, stage, {'Latency': latency}, {'Latency': 'Milliseconds'}, tags)
+
+
+def _record(service, request_id, stage, metrics, units, tags):
+    dimensions = {'Design': DESIGN, 'Service': service, 'Stage': stage}
+    if tags.get('vendor'):
+        dimensions['Vendor'] = tags['vendor']
+    # CloudWatch rejects empty dimension values
+    dimensions = {name: value for name, value in dimensions.items() if value}
+    names = [name for name in dimensions if name != 'Vendor']
+    dimension_sets = [names] + ([names + ['Vendor']] if 'Vendor' in dimensions else [])
+    properties = dict(dimensions, RequestId=request_id)
+    for name, value in tags.items():
+        if name != 'vendor' and value is not None:
+            properties[PROPERTY_NAMES.get(name, name)] = value
+    return metric_record(metrics, dimension_sets, units, properties)
+
+
+def _redacted(value):
+    return 0 if isinstance(value, (int, float)) and not isinstance(value, bool) else REDACTED
+
+
+# the value with the fields redacted, a JSON string holding none of the fields is kept as it is
+def redact(value, fields=CAPTURE_REDACT):
+    if isinstance(value, dict):
+        return {name: _redacted(item) if name in fields else redact(item, fields) for name, item in value.items()}
+    if isinstance(value, list):
+        return [redact(item, fields) for item in value]
+    if isinstance(value, str) and value[:1] in ('{', '['):
+        try:
+            parsed = json.loads(value)
+        except ValueError:
+            return value
+        redacted = redact(parsed, fields)
+        return value if redacted == parsed else json.dumps(redacted)
+    return value
+
+
+# logs the event of an invocation as one line, the tags tell the replay which function to run it with (e.g. the vendor)
+def capture(service, event, tags=None):
+    emit({'EventCapture': {'Service': service, 'Timestamp': int(time.time() * 1000), 'Tags': tags or {}, 'Event': redact(event)}})
+
+
+# writes the spans of the running invocation to the log
+def flush():
+    spans, _local.spans = _spans(), []
+    metrics, _local.metrics = _metrics(), []
+    if STAGE_METRICS:
+        service = getattr(_local, 'service', '')
+        request_id = getattr(_local, 'request_id', None)
+        emit(*(_span_record(service, request_id, stage, latency, tags) for stage, latency, tags in spans),
+             *(_record(service, request_id, None, {name: value}, {name: unit}, tags) for name, value, unit, tags in metrics))
+
+
+# wraps a handler: the whole invocation is the stage "invocation" and the spans are flushed when it ends.
+# the tags are logged with the captured events of the handler
+def handler(service, **tags):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(event, context):
+            _local.service = service
+            _local.request_id = getattr(context, 'aws_request_id', None)
+            _local.sampled = PAYLOAD_SAMPLE_RATE > 0 and random.random() < PAYLOAD_SAMPLE_RATE
+            # the handlers change the events they are given, the event is captured before
+            if CAPTURE_SAMPLE_RATE > 0 and random.random() < CAPTURE_SAMPLE_RATE:
+                capture(service, event, tags)
+            try:
+                with span('invocation'):
+                    return function(event, context)
+            finally:
+                flush()
+        return wrapper
+    return decorator
+
+
+# logs a payload only for sampled invocations (INFO) or when debug logging is on, the JSON is built only then.
+# a payload that is expensive to build is passed as a callable returning it, or as a generator of its items
+def log_payload(logger, message, value):
+    if getattr(_local, 'sampled', False):
+        level = logging.INFO
+    elif logger.isEnabledFor(logging.DEBUG):
+        level = logging.DEBUG
+    else:
+        return
+    if callable(value):
+        value = value()
+    if isinstance(value, collections.abc.Iterator):
+        value = list(value)
+    logger.log(level, "%s%s", message, json.dumps(value, default=str))
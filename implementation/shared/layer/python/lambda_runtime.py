@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: lambda_runtime.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Lightweight runtime helpers for the python functions. boto3 is only imported when the first client is
+# needed and every client, resource and table is created once per container, so the init phase of a
+# function only pays for what its handler really uses.
+import copy
+import json
+import logging
+import os
+import threading
+
+# creating clients on the default boto3 session is not thread safe
+_lock = threading.RLock()
+_clients = {}
+_resources = {}
+_tables = {}
+
+# botocore Config options per client profile. The standard and adaptive retry modes back off exponentially
+# with full jitter (up to 1s, 2s, ... after a throttle), adaptive also rate limits the client while the
+# service throttles it. Connections are kept alive between the invocations of a container.
+PROFILES = {
+    'default': {'tcp_keepalive': True, 'retries': {'mode': 'standard', 'max_attempts': 3}},
+    # a caller waits for the function (REST API, workflow task): fail fast rather than retry for long
+    'interactive': {'tcp_keepalive': True, 'connect_timeout': 2, 'read_timeout': 5, 'retries': {'mode': 'standard', 'max_attempts': 2}},
+    # bursts of writes, possibly from several threads: a pooled connection per thread and more attempts
+    'burst': {'tcp_keepalive': True, 'max_pool_connections': 50, 'connect_timeout': 2, 'read_timeout': 10,
+              'retries': {'mode': 'standard', 'max_attempts': 5}},
+    # work nobody waits for: slows down while the table throttles and leaves its capacity to the request path
+    'background': {'tcp_keepalive': True, 'max_pool_connections': 50, 'retries': {'mode': 'adaptive', 'max_attempts': 8}},
+}
+# profile of the function (CLIENT_PROFILE) and single options on top of it (CLIENT_CONFIG, e.g. {"max_pool_connections": 20})
+PROFILE = os.getenv('CLIENT_PROFILE') or 'default'
+PROFILE_CONFIG = json.loads(os.getenv('CLIENT_CONFIG') or '{}')
+
+
+def _merged(*configs):
+    merged = {}
+    for config in configs:
+        for name, value in config.items():
+            if isinstance(value, dict) and isinstance(merged.get(name), dict):
+                value = dict(merged[name], **value)
+            merged[name] = copy.deepcopy(value)
+    return merged
+
+
+# botocore Config options of a client: the profile, the CLIENT_CONFIG of the function and the options of the caller
+def profile_config(profile=None, **config):
+    profile = profile or PROFILE
+    if profile not in PROFILES:
+        raise ValueError(f"unknown client profile {profile}, expected one of {sorted(PROFILES)}")
+    return _merged(PROFILES[profile], PROFILE_CONFIG, config)
+
+
+# botocore Config options (e.g. connect_timeout=5, retries={'max_attempts': 1}) are part of the cache key
+def _config_key(config):
+    return json.dumps(config, sort_keys=True, default=str)
+
+
+def _config(config):
+    if not config:
+        return None
+    from botocore.config import Config
+    # botocore fills in the retries options of a Config, the caller's dict (and so the cache key) stays as it is
+    return Config(**copy.deepcopy(config))
+
+
+def client(service_name, profile=None, **config):
+    key = (service_name, profile, _config_key(config))
+    if key not in _clients:
+        with _lock:
+            if key not in _clients:
+                import boto3
+                _clients[key] = boto3.client(service_name, config=_config(profile_config(profile, **config)))
+    return _clients[key]
+
+
+def resource(service_name, profile=None, **config):
+    key = (service_name, profile, _config_key(config))
+    if key not in _resources:
+        with _lock:
+            if key not in _resources:
+                import boto3
+                _resources[key] = boto3.resource(service_name, config=_config(profile_config(profile, **config)))
+    return _resources[key]
+
+
+# DynamoDB tables on the low-level client of the function's profile, see dynamodb_table
+def table(name):
+    if name not in _tables:
+        with _lock:
+            if name not in _tables:
+                import dynamodb_table
+                _tables[name] = dynamodb_table.Table(name)
+    return _tables[name]
+
+
+# logger of a handler, the Lambda runtime installs the log handler already so only the level is set (LOG_LEVEL, INFO by default)
+def get_logger(name=None):
+    logger = logging.getLogger(name)
+    logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    return logger
+
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: quote_cache.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Cache of aggregated quotes keyed on the normalized parameters of a quote request. Lookups go to an
+# in-memory LRU of the container first and to a DynamoDB table with TTL second. The key includes a
+# version (a hash of the vendor configuration), so a changed base_rate never hits an older entry.
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import envelope
+import instrumentation
+import lambda_runtime
+
+# request parameters that change the price of a quote
+KEY_FIELDS = ('car_type', 'days_rental', 'pickup_date')
+METRIC_NAMESPACE = 'ScatterGather'
+
+
+def _normalize(data, today=None):
+    normalized = {}
+    for field in KEY_FIELDS:
+        value = data.get(field)
+        if value is None:
+            continue
+        if field == 'days_rental':
+            value = int(value)
+        else:
+            value = str(value).strip().upper()
+        normalized[field] = value
+    # without a pickup date the responders price a request for the current month (the seasons of a rate table),
+    # an entry cached in another month is not hit
+    if 'pickup_date' not in normalized:
+        normalized['pickup_month'] = (today or datetime.date.today()).month
+    return normalized
+
+
+# canonical hash of the parameters of a quote request ({'car_type': 'L', 'days_rental': 30, ...})
+def cache_key(data, version='', today=None):
+    canonical = json.dumps({'version': version, 'request': _normalize(data, today)}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+# hit / miss counters as CloudWatch embedded metric format, written to the function log without an API call
+def emit_metrics(cache_name, hits, misses, source=None):
+    properties = {'Cache': cache_name}
+    if source is not None:
+        properties['CacheSource'] = source
+    instrumentation.emit(instrumentation.metric_record({'CacheHit': hits, 'CacheMiss': misses}, [['Cache']],
+                                                       {'CacheHit': 'Count', 'CacheMiss': 'Count'}, properties, METRIC_NAMESPACE))
+
+
+class QuoteCache:
+
+    def __init__(self, table_name, ttl_seconds, version='', max_entries=1024, name='quotes'):
+        self.table_name = table_name
+        self.ttl_seconds = int(ttl_seconds)
+        self.version = version
+        self.max_entries = max_entries
+        self.name = name
+        # cache key -> (expires at, quotes), least recently used first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    # cache configured by the stack, None when caching is switched off
+    @classmethod
+    def from_environment(cls, environ=os.environ):
+        table_name = environ.get('QUOTE_CACHE_TABLE_NAME')
+        ttl_seconds = int(environ.get('QUOTE_CACHE_TTL_SECONDS') or 0)
+        if not table_name or ttl_seconds <= 0:
+            return None
+        return cls(table_name, ttl_seconds, environ.get('QUOTE_CACHE_VERSION', ''), int(environ.get('QUOTE_CACHE_SIZE') or 1024))
+
+    @property
+    def table(self):
+        return lambda_runtime.table(self.table_name)
+
+    def key(self, data):
+        return cache_key(data, self.version)
+
+    def _remember(self, key, expires_at, quotes):
+        with self.lock:
+            self.entries[key] = (expires_at, quotes)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    # cached quotes of a request or None, DynamoDB deletes expired items lazily so the expiry is checked here
+    def get(self, data):
+        key = self.key(data)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.entries.move_to_end(key)
+                    emit_metrics(self.name, 1, 0, 'memory')
+                    return entry[1]
+                del self.entries[key]
+        try:
+            item = self.table.get_item(Key={'cacheKey': key}).get('Item')
+        except Exception:
+            # the cache is an optimization, a failed lookup is a miss
+            logging.exception("quote cache lookup failed")
+            item = None
+        if item is None or int(item['expiresAt']) <= now:
+            emit_metrics(self.name, 0, 1)
+            return None
+        quotes = json.loads(item['quotes'])
+        self._remember(key, int(item['expiresAt']), quotes)
+        emit_metrics(self.name, 1, 0, 'table')
+        return quotes
+
+    def put(self, data, quotes):
+        key = self.key(data)
+        expires_at = int(time.time()) + self.ttl_seconds
+        self.table.put_item(Item={
+            'cacheKey': key,
+            'quotes': json.dumps(quotes, sort_keys=True, default=envelope.json_default),
+            'version': self.version,
+            'expiresAt': expires_at
+        })
+        self._remember(key, expires_at, quotes)
+
+    def invalidate(self, data):
+        key = self.key(data)
+        with self.lock:
+            self.entries.pop(key, None)
+        self.table.delete_item(Key={'cacheKey': key})
@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: quote_store.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Quote store shared by the quote aggregators. Quotes are never read before they are written:
+# either appended to the Quotes list of an item with an atomic UpdateItem (LIST layout) or
+# stored as one item per quote under the sort key of the request (ITEM layout). Every write is
+# idempotent, so a redelivered SQS record never stores its quotes twice: an append is conditional on the
+# writers of an item, an item of the ITEM layout is keyed by its quote id. With a rank field every item
+# keeps the lowest value of its quotes as a number (BEST_RATE_ATTRIBUTE), a sparse index on it serves
+# the cheapest item of a partition in one read.
+# The COMPACT layout bounds the item of a request: it keeps only the top_k quotes by rank inline and
+# stores every quote as a history item of its own (HISTORY_PREFIX sort keys, expiring with TTL_ATTRIBUTE),
+# so an append costs the same write units however many quotes the request collected.
+# With shards > 1 the items of a partition are spread over that many partition key values (the partition
+# followed by SHARD_SEPARATOR and a shard picked by a stable hash of the sort key), so the writers of a hot
+# request write to several DynamoDB partitions. A key still maps to one item, the partition is read from
+# all of its shards at once.
+import concurrent.futures
+import decimal
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+import dynamodb_table
+import lambda_runtime
+
+LIST = 'list'
+ITEM = 'item'
+COMPACT = 'compact'
+
+# BatchWriteItem accepts at most 25 put requests per call
+BATCH_WRITE_LIMIT = 25
+BATCH_WRITE_ATTEMPTS = 3
+# string set of the writers whose quotes were appended to an item: their idempotency_field values, or the quote ids
+WRITERS_ATTRIBUTE = 'Writers'
+# lowest rank_field value of the quotes of an item, only items holding quotes have it (sparse index)
+BEST_RATE_ATTRIBUTE = 'bestRate'
+# quotes kept inline by the compact layout
+TOP_K = 10
+# sort keys of the history items start with the prefix, so the readers querying a prefix (e.g. VENDOR#) skip them
+HISTORY_PREFIX = 'HISTORY#'
+HISTORY_TTL_SECONDS = 7 * 24 * 60 * 60
+TTL_ATTRIBUTE = 'expiresAt'
+# version of a compacted item, a merge only replaces the version it read
+VERSION_ATTRIBUTE = 'version'
+MERGE_ATTEMPTS = 5
+# unprocessed items of a batch write are sent again after 25 ms, 50 ms, ... (a throttled partition)
+BATCH_WRITE_BACKOFF_SECONDS = 0.025
+SHARD_SEPARATOR = '#'
+
+# table handles are created once per container and re-used by every invocation
+def table(name):
+    return lambda_runtime.table(name)
+
+
+# shard of a sort key value, the same in every container (unlike hash())
+def shard_of(sort_value, shards):
+    if shards <= 1:
+        return 0
+    return int(hashlib.sha1(str(sort_value).encode('utf-8')).hexdigest()[:8], 16) % shards
+
+
+# deterministic id of a quote, a redelivered quote ends up in the same item instead of a new one
+def quote_id(quote):
+    return hashlib.sha1(json.dumps(quote, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+class QuoteStore:
+
+    def __init__(self, table_name, partition_key, sort_key=None, layout=LIST, consistent_read=False, single_writer=False,
+                 idempotency_field=None, rank_field=None, rank_index=None, top_k=TOP_K, history_table=None,
+                 history_sort_key=None, history_ttl=HISTORY_TTL_SECONDS, shards=1):
+        if layout not in (LIST, ITEM, COMPACT):
+            raise ValueError(f"unknown layout: {layout}")
+        if layout == ITEM and sort_key is None:
+            raise ValueError("the item layout needs a table with a sort key")
+        if layout == COMPACT and rank_field is None:
+            raise ValueError("the compact layout keeps the quotes of the best rank, it needs a rank field")
+        if layout == COMPACT and (history_sort_key or sort_key) is None:
+            raise ValueError("the compact layout needs a sort key for its history items")
+        if int(shards) > 1 and sort_key is None:
+            raise ValueError("write sharding spreads the sort keys of a partition, it needs a table with a sort key")
+        self.table_name = table_name
+        self.partition_key = partition_key
+        self.sort_key = sort_key
+        self.layout = layout
+        self.consistent_read = consistent_read
+        # with a single writer per key (e.g. one vendor answering a quote request) the writer owns the whole item,
+        # every write is a plain put batched with other keys and a redelivery rewrites the same quotes.
+        # BatchWriteItem takes no conditions, the last put of a key wins: a store shared by several writers of
+        # a key must leave single_writer off, or a concurrent or redelivered write replaces the quotes of another
+        self.single_writer = single_writer
+        # with several writers per key (e.g. banks answering a mortgage request) each quote names its writer in this
+        # field, a writer's quote is appended to an item once. without it a quote is appended once per quote id
+        self.idempotency_field = idempotency_field
+        # numeric field of a quote ranking the items (e.g. rate), and the index on (partition key, BEST_RATE_ATTRIBUTE)
+        self.rank_field = rank_field
+        self.rank_index = rank_index
+        # compact layout: quotes kept inline, and the table (same key names, history_sort_key as its sort key)
+        # holding one item per quote, the table of the store by default
+        self.top_k = int(top_k)
+        self.history_table_name = history_table or table_name
+        self.history_sort_key = history_sort_key or sort_key
+        self.history_ttl = int(history_ttl)
+        # partition key values a partition is spread over, 1 keeps the partition as it is
+        self.shards = max(1, int(shards))
+
+    @property
+    def table(self):
+        return table(self.table_name)
+
+    # partition key value of a shard of a partition
+    def shard_partition(self, partition, shard):
+        if self.shards == 1:
+            return partition
+        return f"{partition}{SHARD_SEPARATOR}{shard}"
+
+    # partition key value a (partition,) or (partition, sort) key is stored under
+    def partition_value(self, key):
+        if self.shards == 1:
+            return key[0]
+        return self.shard_partition(key[0], shard_of(key[1], self.shards))
+
+    # builds the DDB key from a (partition,) or (partition, sort) tuple
+    def key(self, key):
+        item_key = {self.partition_key: self.partition_value(key)}
+        if self.sort_key is not None:
+            item_key[self.sort_key] = key[1]
+        return item_key
+
+    # lowest rank of quotes as a DynamoDB number, None without a rank field
+    def best_rate(self, quotes):
+        if self.rank_field is None or not quotes:
+            return None
+        return min(decimal.Decimal(str(quote[self.rank_field])) for quote in quotes)
+
+    # item of a key holding quotes, with the best rate of the quotes when the store ranks them
+    def new_item(self, key, quotes):
+        item = dict(self.key(key), Quotes=quotes)
+        if self.rank_field is not None:
+            item[BEST_RATE_ATTRIBUTE] = self.best_rate(quotes)
+        return item
+
+    # lowers the best rate of an item after an append, a higher rate leaves it as it is
+    def lower_best_rate(self, key, quotes):
+        best_rate = self.best_rate(quotes)
+        if best_rate is None:
+            return
+        try:
+            self.table.update_item(
+                Key=self.key(key),
+                UpdateExpression=f"SET {BEST_RATE_ATTRIBUTE} = :rate",
+                ConditionExpression=f"attribute_not_exists({BEST_RATE_ATTRIBUTE}) OR {BEST_RATE_ATTRIBUTE} > :rate",
+                ExpressionAttributeValues={':rate': best_rate}
+            )
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+    # identity of a quote within its key: its writer, or the quote itself
+    def identity(self, quote):
+        if self.idempotency_field is not None:
+            return str(quote[self.idempotency_field])
+        return quote_id(quote)
+
+    # drops repeated quotes of a group, e.g. the same record delivered twice in one batch
+    def unique(self, quotes):
+        return list(OrderedDict((self.identity(quote), quote) for quote in quotes).values())
+
+    # appends quotes to the Quotes list of an item in one atomic call, creating the item if needed.
+    # the append is conditional on none of the writers (the identities of the quotes) being in the item yet,
+    # if one of them is the quotes are appended one by one and the ones stored before are skipped.
+    # the append creating an item sets its best rate, a later one that brings a lower rate lowers it
+    def append(self, key, quotes):
+        writers = [self.identity(quote) for quote in quotes]
+        values = {f":writer{index}": writer for index, writer in enumerate(writers)}
+        update = "SET Quotes = list_append(if_not_exists(Quotes, :empty), :quotes)"
+        best_rate = self.best_rate(quotes)
+        if best_rate is not None:
+            update += f", {BEST_RATE_ATTRIBUTE} = if_not_exists({BEST_RATE_ATTRIBUTE}, :rate)"
+            values[':rate'] = best_rate
+        try:
+            item = self.table.update_item(
+                Key=self.key(key),
+                UpdateExpression=f"{update} ADD {WRITERS_ATTRIBUTE} :writers",
+                ConditionExpression=" AND ".join(f"NOT contains({WRITERS_ATTRIBUTE}, :writer{index})" for index in range(len(writers))),
+                ExpressionAttributeValues=dict(values, **{':empty': [], ':quotes': quotes, ':writers': set(writers)}),
+                ReturnValues='ALL_NEW'
+            )['Attributes']
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            if len(quotes) > 1:
+                for quote in quotes:
+                    self.append(key, [quote])
+            else:
+                logging.info("quote of %s for %s stored already", writers[0], key)
+            return
+        if best_rate is not None and item[BEST_RATE_ATTRIBUTE] > best_rate:
+            self.lower_best_rate(key, quotes)
+
+    # writes items with as few BatchWriteItem calls as possible, returns the keys of items that were not written
+    def batch_put(self, items, table_name=None):
+        table_name = table_name or self.table_name
+        failed = []
+        for start in range(0, len(items), BATCH_WRITE_LIMIT):
+            requests = [{'PutRequest': {'Item': item}} for item in items[start:start + BATCH_WRITE_LIMIT]]
+            for attempt in range(BATCH_WRITE_ATTEMPTS):
+                try:
+                    response = dynamodb_table.batch_write_item(RequestItems={table_name: requests})
+                except ClientError:
+                    logging.exception("batch write failed")
+                    break
+                requests = response.get('UnprocessedItems', {}).get(table_name, [])
+                if not requests:
+                    break
+                time.sleep(BATCH_WRITE_BACKOFF_SECONDS * 2 ** attempt)
+            failed.extend(request['PutRequest']['Item'] for request in requests)
+        return failed
+
+    # (partition,) or (partition, sort) key of an item, without the shard of its partition key value
+    def item_key(self, item):
+        if self.sort_key is None:
+            return (item[self.partition_key],)
+        partition = item[self.partition_key]
+        if self.shards > 1:
+            partition = partition.rsplit(SHARD_SEPARATOR, 1)[0]
+        return (partition, item[self.sort_key])
+
+    # writes groups of quotes ({key: [quote, ...]}) and returns the set of keys that failed. single_writer overrides
+    # the setting of the store for one write, e.g. by a writer holding a claim on the partition. items are other items
+    # of the table put by the same BatchWriteItem calls as the quotes, the key of an item that failed is returned too
+    def write(self, groups, single_writer=None, items=()):
+        single_writer = self.single_writer if single_writer is None else single_writer
+        if self.layout == ITEM:
+            return self._write_items(groups, items)
+        if self.layout == COMPACT:
+            return self._write_compact(groups, single_writer, items)
+        return self._write_lists(groups, single_writer, items)
+
+    def _write_lists(self, groups, single_writer, items):
+        groups = OrderedDict((key, self.unique(quotes)) for key, quotes in groups.items())
+        if single_writer:
+            puts = [self.new_item(key, quotes) for key, quotes in groups.items()] + list(items)
+            return {self.item_key(item) for item in self.batch_put(puts)}
+        failed = set()
+        for key, quotes in groups.items():
+            try:
+                self.append(key, quotes)
+            except ClientError:
+                logging.exception(f"update failed for {key}")
+                failed.add(key)
+        return failed | {self.item_key(item) for item in self.batch_put(list(items))}
+
+    # one item per quote: sort key is the sort key of the request followed by the quote id
+    def _write_items(self, groups, other_items):
+        # BatchWriteItem rejects duplicate keys in one call, identical quotes collapse into one item anyway
+        items = OrderedDict((self.item_key(item), item) for item in other_items)
+        owners = {key: key for key in items}
+        for key, quotes in groups.items():
+            for quote in quotes:
+                item = dict(quote)
+                item[self.partition_key] = self.partition_value(key)
+                item[self.sort_key] = f"{key[1]}#{quote_id(quote)}"
+                if self.rank_field is not None:
+                    item[BEST_RATE_ATTRIBUTE] = self.best_rate([quote])
+                owners[self.item_key(item)] = key
+                items[self.item_key(item)] = item
+        return {owners[self.item_key(item)] for item in self.batch_put(list(items.values()))}
+
+    # the top_k quotes by rank, a quote appears once (its latest copy)
+    def top(self, quotes):
+        return sorted(self.unique(quotes), key=lambda quote: decimal.Decimal(str(quote[self.rank_field])))[:self.top_k]
+
+    # history item of a quote, a redelivered quote rewrites the same item
+    def history_item(self, key, quote):
+        sort_value = f"{HISTORY_PREFIX}{key[1]}#{self.identity(quote)}" if self.sort_key is not None else f"{HISTORY_PREFIX}{self.identity(quote)}"
+        return dict(quote, **{self.partition_key: self.partition_value(key), self.history_sort_key: sort_value,
+                              TTL_ATTRIBUTE: int(time.time()) + self.history_ttl})
+
+    # merges quotes into the top_k quotes of an item: a consistent read and a put conditional on the version
+    # that was read, a concurrent merge makes the put fail and the merge is repeated. quotes that do not
+    # change the top_k (a redelivery, a worse rate) cost the read only
+    def merge_top(self, key, quotes):
+        for _ in range(MERGE_ATTEMPTS):
+            item = self.table.get_item(Key=self.key(key), ConsistentRead=True).get('Item')
+            current = item.get('Quotes', []) if item else []
+            top = self.top(current + quotes)
+            if item is not None and top == current:
+                return
+            version = item.get(VERSION_ATTRIBUTE) if item else None
+            new_item = dict(self.new_item(key, top), **{VERSION_ATTRIBUTE: (version or 0) + 1})
+            names = {'#version': VERSION_ATTRIBUTE}
+            if item is None:
+                condition = {'ConditionExpression': f"attribute_not_exists({self.partition_key})"}
+            elif version is None:
+                # an item of the list layout, compacted by its first merge
+                condition = {'ConditionExpression': "attribute_not_exists(#version)", 'ExpressionAttributeNames': names}
+            else:
+                condition = {'ConditionExpression': "#version = :version", 'ExpressionAttributeNames': names,
+                             'ExpressionAttributeValues': {':version': version}}
+            try:
+                self.table.put_item(Item=new_item, **condition)
+                return
+            except ClientError as error:
+                if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+        raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException',
+                                     'Message': f"{key} changed on every one of {MERGE_ATTEMPTS} merges"}}, 'PutItem')
+
+    # history items first: a quote ranked inline always has its history item
+    def _write_compact(self, groups, single_writer, other_items):
+        groups = OrderedDict((key, self.unique(quotes)) for key, quotes in groups.items())
+        history = OrderedDict()
+        owners = {}
+        for key, quotes in groups.items():
+            for quote in quotes:
+                item = self.history_item(key, quote)
+                history_key = (item[self.partition_key], item[self.history_sort_key])
+                history[history_key] = item
+                owners[history_key] = key
+        failed = {owners[(item[self.partition_key], item[self.history_sort_key])]
+                  for item in self.batch_put(list(history.values()), self.history_table_name)}
+        if single_writer:
+            items = [self.new_item(key, self.top(quotes)) for key, quotes in groups.items() if key not in failed]
+            return failed | {self.item_key(item) for item in self.batch_put(items + list(other_items))}
+        for key, quotes in groups.items():
+            if key in failed:
+                continue
+            try:
+                self.merge_top(key, quotes)
+            except ClientError:
+                logging.exception(f"merge failed for {key}")
+                failed.add(key)
+        return failed | {self.item_key(item) for item in self.batch_put(list(other_items))}
+
+    # every quote stored for a key by the compact layout, not only the top_k. history items expire after history_ttl
+    def history(self, key, consistent_read=None):
+        from boto3.dynamodb.conditions import Key
+        consistent_read = self.consistent_read if consistent_read is None else consistent_read
+        prefix = f"{HISTORY_PREFIX}{key[1]}#" if self.sort_key is not None else HISTORY_PREFIX
+        query = {'KeyConditionExpression': Key(self.partition_key).eq(self.partition_value(key)) & Key(self.history_sort_key).begins_with(prefix),
+                 'ConsistentRead': consistent_read}
+        quotes = []
+        while True:
+            response = table(self.history_table_name).query(**query)
+            quotes.extend({name: value for name, value in item.items()
+                           if name not in (self.partition_key, self.history_sort_key, TTL_ATTRIBUTE)}
+                          for item in response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                return quotes
+            query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    # sort key an item is stored under, without the quote id of the ITEM layout
+    def item_sort_value(self, item):
+        if self.layout == ITEM:
+            return item[self.sort_key].rsplit('#', 1)[0]
+        return item[self.sort_key]
+
+    # quotes of an item, without the keys and attributes kept by the store
+    def item_quotes(self, item):
+        if self.layout in (LIST, COMPACT):
+            return item.get('Quotes', [])
+        return [{name: value for name, value in item.items()
+                 if name not in (self.partition_key, self.sort_key, BEST_RATE_ATTRIBUTE)}]
+
+    # one query page of the items under a partition key value
+    def _query_page(self, partition_value, sort_prefix=None, consistent_read=None, page_size=None, start_key=None):
+        from boto3.dynamodb.conditions import Key
+        consistent_read = self.consistent_read if consistent_read is None else consistent_read
+        condition = Key(self.partition_key).eq(partition_value)
+        if sort_prefix is not None:
+            condition = condition & Key(self.sort_key).begins_with(sort_prefix)
+        query = {'KeyConditionExpression': condition, 'ConsistentRead': consistent_read}
+        if page_size:
+            query['Limit'] = page_size
+        if start_key:
+            query['ExclusiveStartKey'] = start_key
+        response = self.table.query(**query)
+        page = [(self.item_sort_value(item), self.item_quotes(item)) for item in response.get('Items', [])]
+        return page, response.get('LastEvaluatedKey')
+
+    # one query page of the items under a partition, optionally limited to a sort key prefix:
+    # ([(sort key, quotes), ...], key to start the next page from or None after the last page).
+    # a sharded partition is read shard after shard, the start key names the shard to go on with
+    def read_page(self, partition, sort_prefix=None, consistent_read=None, page_size=None, start_key=None):
+        if self.shards == 1:
+            return self._query_page(partition, sort_prefix, consistent_read, page_size, start_key)
+        shard, shard_key = (start_key['shard'], start_key.get('key')) if start_key else (0, None)
+        page = []
+        while shard < self.shards and not (page_size and len(page) >= page_size):
+            shard_page, shard_key = self._query_page(self.shard_partition(partition, shard), sort_prefix, consistent_read,
+                                                     page_size - len(page) if page_size else None, shard_key)
+            page.extend(shard_page)
+            if shard_key is not None:
+                return page, {'shard': shard, 'key': shard_key}
+            shard += 1
+        return page, {'shard': shard, 'key': None} if shard < self.shards else None
+
+    # yields (sort key, quotes) for the items under a partition one query page at a time,
+    # a caller streams a large partition without holding all of it
+    def stream_partition(self, partition, sort_prefix=None, consistent_read=None, page_size=None):
+        start_key = None
+        while True:
+            page, start_key = self.read_page(partition, sort_prefix, consistent_read, page_size, start_key)
+            yield from page
+            if start_key is None:
+                return
+
+    # every page of one partition key value
+    def _query_all(self, partition_value, sort_prefix=None, consistent_read=None):
+        items = []
+        start_key = None
+        while True:
+            page, start_key = self._query_page(partition_value, sort_prefix, consistent_read, start_key=start_key)
+            items.extend(page)
+            if start_key is None:
+                return items
+
+    # runs a function for every shard of a partition at once and returns the results in shard order
+    def scatter(self, partition, function):
+        partition_values = [self.shard_partition(partition, shard) for shard in range(self.shards)]
+        if self.shards == 1:
+            return [function(partition_values[0])]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.shards) as executor:
+            return list(executor.map(function, partition_values))
+
+    # returns the quotes of every sort key under a partition ({sort key: [quote, ...]}), optionally limited to a sort key prefix.
+    # the shards of a partition are queried at once, the sort keys come in the order of the sort key
+    def read_partition(self, partition, sort_prefix=None, consistent_read=None):
+        pages = self.scatter(partition, lambda partition_value: self._query_all(partition_value, sort_prefix, consistent_read))
+        quotes = OrderedDict()
+        for sort_value, item_quotes in sorted((entry for page in pages for entry in page), key=lambda entry: entry[0]):
+            quotes.setdefault(sort_value, []).extend(item_quotes)
+        return quotes
+
+    # cheapest item of a partition from the rank index: (sort key, best rate, quotes) or None, the cheapest of
+    # the shards for a sharded partition. the index is eventually consistent, a quote written a moment ago may
+    # not be ranked yet
+    def best(self, partition):
+        if self.rank_index is None:
+            raise ValueError("the store has no rank index")
+        from boto3.dynamodb.conditions import Key
+
+        def shard_best(partition_value):
+            response = self.table.query(IndexName=self.rank_index, KeyConditionExpression=Key(self.partition_key).eq(partition_value),
+                                        ScanIndexForward=True, Limit=1)
+            return response.get('Items', [])[:1]
+        items = [item for shard_items in self.scatter(partition, shard_best) for item in shard_items]
+        if not items:
+            return None
+        item = min(items, key=lambda item: item[BEST_RATE_ATTRIBUTE])
+        return self.item_sort_value(item), item[BEST_RATE_ATTRIBUTE], self.item_quotes(item)
+
+    # returns the quotes stored for a key, eventually consistent unless asked otherwise
+    def read(self, key, consistent_read=None):
+        consistent_read = self.consistent_read if consistent_read is None else consistent_read
+        if self.layout in (LIST, COMPACT):
+            response = self.table.get_item(Key=self.key(key), ConsistentRead=consistent_read)
+            return response.get('Item', {}).get('Quotes', [])
+        # the items of a key are on the shard of the key
+        return [quote for _, item_quotes in self._query_all(self.partition_value(key), f"{key[1]}#", consistent_read) for quote in item_quotes]
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: sns_batch.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Batched SNS publishing. PublishBatch takes at most 10 messages and 256 KiB per call, the messages are
+# packed into as few calls as fit both limits. Returns the indexes of the messages that were not published.
+import logging
+
+import lambda_runtime
+
+PUBLISH_BATCH_LIMIT = 10
+PUBLISH_BATCH_BYTES = 256 * 1024
+
+
+# groups of message indexes, each within the limits of one PublishBatch call
+def batches(messages):
+    batch = []
+    size = 0
+    for index, message in enumerate(messages):
+        message_size = len(message.encode('utf-8'))
+        if batch and (len(batch) == PUBLISH_BATCH_LIMIT or size + message_size > PUBLISH_BATCH_BYTES):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(index)
+        size += message_size
+    if batch:
+        yield batch
+
+
+def publish(topic_arn, messages):
+    failed = []
+    for batch in batches(messages):
+        entries = [{'Id': str(index), 'Message': messages[index]} for index in batch]
+        try:
+            result = lambda_runtime.client('sns').publish_batch(TopicArn=topic_arn, PublishBatchRequestEntries=entries)
+        except Exception:
+            logging.exception("publishing a batch of %d messages failed", len(batch))
+            failed.extend(batch)
+            continue
+        failed.extend(int(failure['Id']) for failure in result.get('Failed', []))
+    return failed
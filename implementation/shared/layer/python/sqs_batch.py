@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: sqs_batch.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Partial batch responses of the functions consuming SQS queues (ReportBatchItemFailures). A record that
+# failed for a transient reason (throttling, a failed write) is reported back and retried on its own, the
+# other records of the batch are not processed again. A record that can never succeed (a poison message,
+# e.g. without a responsePayload) is moved to the dead-letter queue of the function right away instead of
+# being retried until the maxReceiveCount of the queue.
+import logging
+import os
+
+import lambda_runtime
+import sns_batch
+
+# SendMessageBatch accepts at most 10 messages per call
+SEND_BATCH_LIMIT = 10
+
+DEAD_LETTER_QUEUE_URL = os.getenv('DEAD_LETTER_QUEUE_URL')
+
+
+# partial batch response of any event source with ReportBatchItemFailures. the item identifiers are the message ids
+# of SQS records, or the sequence numbers of DynamoDB and Kinesis stream records (the stream retries from the first)
+def batch_item_failures(item_identifiers, **fields):
+    return dict(fields, batchItemFailures=[{'itemIdentifier': item_identifier} for item_identifier in item_identifiers])
+
+
+def response(failed_message_ids, **fields):
+    return batch_item_failures(failed_message_ids, **fields)
+
+
+# message attributes of a dead-lettered record: the error, and the queue it came from when the record names one.
+# SQS rejects an empty string value
+def attributes(record, reason):
+    attributes = {'error': {'DataType': 'String', 'StringValue': reason[:256]}}
+    if record.get('eventSourceARN'):
+        attributes['source'] = {'DataType': 'String', 'StringValue': record['eventSourceARN']}
+    return attributes
+
+
+# moves poison records ([(record, reason)]) to the dead-letter queue and returns the message ids of the
+# records that could not be moved, they are reported as failures and end up there by the redrive policy
+def dead_letter(poisoned, queue_url=None):
+    queue_url = queue_url or DEAD_LETTER_QUEUE_URL
+    if not poisoned:
+        return []
+    if not queue_url:
+        return [record['messageId'] for record, _ in poisoned]
+    failed = []
+    for start in range(0, len(poisoned), SEND_BATCH_LIMIT):
+        chunk = poisoned[start:start + SEND_BATCH_LIMIT]
+        entries = [{'Id': str(index), 'MessageBody': record['body'], 'MessageAttributes': attributes(record, reason)}
+                   for index, (record, reason) in enumerate(chunk)]
+        try:
+            result = lambda_runtime.client('sqs').send_message_batch(QueueUrl=queue_url, Entries=entries)
+        except Exception:
+            logging.exception("moving poison records to the dead-letter queue failed")
+            failed.extend(record['messageId'] for record, _ in chunk)
+            continue
+        failed.extend(chunk[int(failure['Id'])][0]['messageId'] for failure in result.get('Failed', []))
+    logging.warning("moved %d poison records to the dead-letter queue", len(poisoned) - len(failed))
+    return failed
+
+
+# sends messages to a queue in as few SendMessageBatch calls as fit its limits (the limits of PublishBatch), each one
+# delayed by delay_seconds when given. returns the indexes of the messages that were not sent
+def send(queue_url, bodies, delay_seconds=None):
+    delay = {} if delay_seconds is None else {'DelaySeconds': delay_seconds}
+    failed = []
+    for batch in sns_batch.batches(bodies):
+        entries = [dict({'Id': str(index), 'MessageBody': bodies[index]}, **delay) for index in batch]
+        try:
+            result = lambda_runtime.client('sqs').send_message_batch(QueueUrl=queue_url, Entries=entries)
+        except Exception:
+            logging.exception("sending a batch of %d messages failed", len(batch))
+            failed.extend(batch)
+            continue
+        failed.extend(int(failure['Id']) for failure in result.get('Failed', []))
+    return failed
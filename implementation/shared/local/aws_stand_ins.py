@@ -0,0 +1,1125 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: aws_stand_ins.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# In-memory stand-ins for the AWS services used by the Lambda functions, so the real handlers can be
+# run and measured locally. install() patches boto3.client / boto3.resource to return them and every
+# call is counted per (service, operation).
+import contextlib
+import copy
+import decimal
+import http.server
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, deque
+
+import boto3
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+
+class CallCounter:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def add(self, service, operation, count=1):
+        with self._lock:
+            self._counts[(service, operation)] += count
+
+    def total(self, service=None):
+        with self._lock:
+            return sum(count for (name, _), count in self._counts.items() if service is None or name == service)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+def client_error(code, message, operation):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+# ------------------------------------------------------------------------------------------------
+# DynamoDB expressions (the subset used by the handlers of this repo)
+# ------------------------------------------------------------------------------------------------
+_TOKEN = re.compile(r"\s*(<>|<=|>=|[=<>(),+\-]|[#:]?[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*|\[\d+\])")
+
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if match is None:
+            raise client_error('ValidationException', f"Invalid expression: {expression}", 'Expression')
+        tokens.append(match.group(1))
+        position = match.end()
+        while position < len(expression) and expression[position].isspace():
+            position += 1
+    return tokens
+
+
+class _Expression:
+
+    def __init__(self, expression, names, values):
+        self.tokens = _tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self, expected=None):
+        token = self.peek()
+        if expected is not None and (token is None or token.upper() != expected):
+            raise client_error('ValidationException', f"expected {expected} got {token}", 'Expression')
+        self.position += 1
+        return token
+
+    def path(self, token):
+        return self.names.get(token, token)
+
+    def value(self, token):
+        if token not in self.values:
+            raise client_error('ValidationException', f"missing value {token}", 'Expression')
+        return self.values[token]
+
+    def operand(self, item):
+        token = self.take()
+        if token.startswith(':'):
+            return self.value(token)
+        if token in ('if_not_exists', 'list_append', 'size') and self.peek() == '(':
+            self.take('(')
+            if token == 'size':
+                value = self.operand(item)
+                self.take(')')
+                # the size of a missing attribute compares false
+                return None if value is None else len(value)
+            first_token = self.peek()
+            first = self.operand(item)
+            self.take(',')
+            second = self.operand(item)
+            self.take(')')
+            if token == 'if_not_exists':
+                return second if self.path(first_token) not in item else first
+            return list(first) + list(second)
+        return item.get(self.path(token))
+
+    # value expression of a SET action: operand [+|- operand]
+    def set_value(self, item):
+        value = self.operand(item)
+        if self.peek() in ('+', '-'):
+            operator = self.take()
+            other = self.operand(item)
+            value = value + other if operator == '+' else value - other
+        return value
+
+    def apply_update(self, item):
+        item = copy.deepcopy(item)
+        clause = None
+        while self.peek() is not None:
+            if self.peek().upper() in ('SET', 'ADD', 'REMOVE', 'DELETE'):
+                clause = self.take().upper()
+                continue
+            if self.peek() == ',':
+                self.take()
+                continue
+            name = self.path(self.take())
+            if clause == 'SET':
+                self.take('=')
+                item[name] = self.set_value(item)
+            elif clause == 'ADD':
+                value = self.value(self.take())
+                if isinstance(value, set):
+                    item[name] = set(item.get(name, set())) | value
+                else:
+                    item[name] = item.get(name, 0) + value
+            elif clause == 'DELETE':
+                item[name] = set(item.get(name, set())) - self.value(self.take())
+            elif clause == 'REMOVE':
+                item.pop(name, None)
+            else:
+                raise client_error('ValidationException', 'update expression without clause', 'UpdateItem')
+        return item
+
+    # value compared for equality with an attribute (e.g. the partition key of a key condition), None if there is none
+    def equality(self, name):
+        for index in range(len(self.tokens) - 2):
+            if self.path(self.tokens[index]) == name and self.tokens[index + 1] == '=' and self.tokens[index + 2].startswith(':'):
+                return self.value(self.tokens[index + 2])
+        return None
+
+    # evaluates the whole expression as a condition, the parsed tokens are re-used for every item
+    def matches(self, item):
+        self.position = 0
+        return self.condition(item)
+
+    # condition := disjunction ; disjunction := conjunction (OR conjunction)* ; ...
+    def condition(self, item):
+        result = self._conjunction(item)
+        while self.peek() is not None and self.peek().upper() == 'OR':
+            self.take()
+            other = self._conjunction(item)
+            result = result or other
+        return result
+
+    def _conjunction(self, item):
+        result = self._negation(item)
+        while self.peek() is not None and self.peek().upper() == 'AND':
+            self.take()
+            other = self._negation(item)
+            result = result and other
+        return result
+
+    def _negation(self, item):
+        if self.peek() is not None and self.peek().upper() == 'NOT':
+            self.take()
+            return not self._negation(item)
+        return self._comparison(item)
+
+    def _comparison(self, item):
+        token = self.peek()
+        if token == '(':
+            self.take('(')
+            result = self.condition(item)
+            self.take(')')
+            return result
+        if token in ('attribute_exists', 'attribute_not_exists', 'begins_with', 'contains'):
+            self.take()
+            self.take('(')
+            name = self.path(self.take())
+            if token in ('begins_with', 'contains'):
+                self.take(',')
+                argument = self.operand(item)
+            self.take(')')
+            if token == 'attribute_exists':
+                return name in item
+            if token == 'attribute_not_exists':
+                return name not in item
+            if name not in item:
+                return False
+            if token == 'begins_with':
+                return str(item[name]).startswith(argument)
+            return argument in item[name]
+        left = self.operand(item)
+        operator = self.take()
+        if operator.upper() == 'BETWEEN':
+            low = self.operand(item)
+            self.take('AND')
+            high = self.operand(item)
+            return left is not None and low <= left <= high
+        right = self.operand(item)
+        if operator == '=':
+            return left == right
+        if operator == '<>':
+            return left != right
+        if left is None or right is None:
+            return False
+        return {'<': left < right, '<=': left <= right, '>': left > right, '>=': left >= right}[operator]
+
+
+def _expression(expression, names, values, is_key_condition=False):
+    if isinstance(expression, ConditionBase):
+        built = ConditionExpressionBuilder().build_expression(expression, is_key_condition=is_key_condition)
+        names = dict(names or {}, **built.attribute_name_placeholders)
+        values = dict(values or {}, **built.attribute_value_placeholders)
+        expression = built.condition_expression
+    return _Expression(expression, names, values)
+
+
+# ------------------------------------------------------------------------------------------------
+# DynamoDB
+# ------------------------------------------------------------------------------------------------
+def _check_types(value):
+    if isinstance(value, float):
+        raise TypeError("Float types are not supported. Use Decimal types instead.")
+    if isinstance(value, dict):
+        for element in value.values():
+            _check_types(element)
+    elif isinstance(value, (list, set, tuple)):
+        for element in value:
+            _check_types(element)
+
+
+def _item_size(item):
+    return len(json.dumps(item, default=str).encode('utf-8'))
+
+
+class _TableData:
+    """Items of a table grouped by partition key value, so a query only looks at its own partition."""
+
+    def __init__(self):
+        self.partitions = {}
+
+    def get(self, key):
+        return self.partitions.get(key[0], {}).get(key)
+
+    def __setitem__(self, key, item):
+        self.partitions.setdefault(key[0], {})[key] = item
+
+    def pop(self, key, default=None):
+        partition = self.partitions.get(key[0], {})
+        item = partition.pop(key, default)
+        if not partition:
+            self.partitions.pop(key[0], None)
+        return item
+
+    def values(self, partition=None):
+        if partition is not None:
+            return list(self.partitions.get(partition, {}).values())
+        return [item for items in self.partitions.values() for item in items.values()]
+
+
+class InMemoryDynamoDB:
+    """Tables are dictionaries keyed by the primary key values, every call takes the optional latency."""
+
+    # DynamoDB rejects items larger than 400 KB
+    ITEM_SIZE_LIMIT = 400 * 1024
+    # a write unit covers 1 KB of the item written, a strongly consistent read unit 4 KB of the items read
+    WRITE_UNIT_BYTES = 1024
+    READ_UNIT_BYTES = 4096
+
+    def __init__(self, calls=None, latency=0.0, partition_write_capacity=0.0):
+        self.calls = calls or CallCounter()
+        self.latency = latency
+        # write units per second a partition key value takes before its writes are throttled, 0 for no limit.
+        # DynamoDB serves at most 1000 write units per second for one partition key value
+        self.partition_write_capacity = partition_write_capacity
+        # (table, partition key value) -> (units left, time they were counted)
+        self._partition_units = {}
+        self.throttled = Counter()
+        self._lock = threading.RLock()
+        self._tables = {}
+        self._schemas = {}
+        self._indexes = {}
+        self._streams = {}
+        # capacity units consumed per (table, 'read' | 'write')
+        self.capacity = Counter()
+
+    # indexes: {index name: (partition key, sort key)}
+    def create_table(self, name, partition_key, sort_key=None, indexes=None):
+        with self._lock:
+            self._schemas[name] = (partition_key, sort_key)
+            self._indexes[name] = dict(indexes or {})
+            self._tables.setdefault(name, _TableData())
+
+    # every write to the table is recorded on the stream, read it like a queue (InMemoryStream)
+    def stream(self, name, record_filter=None):
+        with self._lock:
+            if name not in self._streams:
+                self._streams[name] = InMemoryStream(name, self.calls, record_filter=record_filter)
+            return self._streams[name]
+
+    def items(self, name):
+        with self._lock:
+            return [copy.deepcopy(item) for item in self._tables[name].values()]
+
+    def consumed(self, name=None, kind='write'):
+        with self._lock:
+            return sum(units for (table, unit_kind), units in self.capacity.items() if unit_kind == kind and name in (None, table))
+
+    # a write is charged for the larger of the old and the new item, transactions twice
+    def _write_units(self, old, new, factor=1):
+        size = max(_item_size(old) if old is not None else 0, _item_size(new) if new is not None else 0)
+        return factor * max(1, math.ceil(size / self.WRITE_UNIT_BYTES))
+
+    def _consume_write(self, name, old, new, factor=1):
+        self.capacity[(name, 'write')] += self._write_units(old, new, factor)
+
+    # takes the units of a write from the partition key value, refilled at partition_write_capacity per second
+    # up to one second of it. a write above the rate is throttled and consumes nothing
+    def _admit_write(self, name, partition, units, operation):
+        if not self.partition_write_capacity:
+            return
+        now = time.monotonic()
+        left, counted = self._partition_units.get((name, partition), (self.partition_write_capacity, now))
+        left = min(self.partition_write_capacity, left + (now - counted) * self.partition_write_capacity)
+        if left < units:
+            self._partition_units[(name, partition)] = (left, now)
+            self.throttled[name] += 1
+            raise client_error('ProvisionedThroughputExceededException',
+                               'The level of configured provisioned throughput for the table was exceeded', operation)
+        self._partition_units[(name, partition)] = (left - units, now)
+
+    # eventually consistent reads cost half, a read of no item still costs its minimum
+    def _consume_read(self, name, items, consistent_read):
+        units = max(1, math.ceil(sum(_item_size(item) for item in items) / self.READ_UNIT_BYTES))
+        self.capacity[(name, 'read')] += units if consistent_read else units / 2
+
+    def _call(self, operation, count=1):
+        self.calls.add('dynamodb', operation, count)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _schema(self, name, operation):
+        if name not in self._schemas:
+            raise client_error('ResourceNotFoundException', f"Requested resource not found: {name}", operation)
+        return self._schemas[name]
+
+    def _key(self, name, key, operation):
+        partition_key, sort_key = self._schema(name, operation)
+        try:
+            return (key[partition_key],) if sort_key is None else (key[partition_key], key[sort_key])
+        except KeyError:
+            raise client_error('ValidationException', 'The provided key element does not match the schema', operation)
+
+    def _store(self, name, item, operation, factor=1):
+        _check_types(item)
+        if _item_size(item) > self.ITEM_SIZE_LIMIT:
+            raise client_error('ValidationException', 'Item size has exceeded the maximum allowed size', operation)
+        key = self._key(name, item, operation)
+        old = self._tables[name].get(key)
+        self._admit_write(name, key[0], self._write_units(old, item, factor), operation)
+        self._tables[name][key] = copy.deepcopy(item)
+        self._consume_write(name, old, item, factor)
+        self._changed(name, key, old, item)
+
+    def _remove(self, name, key, factor=1):
+        self._admit_write(name, key[0], self._write_units(self._tables[name].get(key), None, factor), 'DeleteItem')
+        old = self._tables[name].pop(key, None)
+        self._consume_write(name, old, None, factor)
+        if old is not None:
+            self._changed(name, key, old, None)
+
+    def _changed(self, name, key, old, new):
+        if name in self._streams:
+            partition_key, sort_key = self._schemas[name]
+            keys = dict(zip((partition_key, sort_key) if sort_key else (partition_key,), key))
+            self._streams[name].record(keys, old, new)
+
+    # ReturnValuesOnConditionCheckFailure=ALL_OLD: the error carries the item the condition failed on, typed
+    # like the low-level client returns it (the resource API does not convert the items of errors)
+    def _check_condition(self, condition, names, values, item, operation, return_values=None):
+        if condition is not None and not _expression(condition, names, values).matches(item or {}):
+            error = client_error('ConditionalCheckFailedException', 'The conditional request failed', operation)
+            if return_values == 'ALL_OLD' and item is not None:
+                error.response['Item'] = _DynamoDBClient._typed(item)
+            raise error
+
+    @staticmethod
+    def _returned(return_values, old, new):
+        if return_values in ('ALL_NEW', 'UPDATED_NEW'):
+            return {'Attributes': copy.deepcopy(new)}
+        if return_values in ('ALL_OLD', 'UPDATED_OLD') and old is not None:
+            return {'Attributes': copy.deepcopy(old)}
+        return {}
+
+    def get_item(self, TableName, Key, ConsistentRead=False, ProjectionExpression=None, ExpressionAttributeNames=None, **_):
+        self._call('GetItem')
+        with self._lock:
+            item = self._tables[TableName].get(self._key(TableName, Key, 'GetItem'))
+            self._consume_read(TableName, [item] if item is not None else [], ConsistentRead)
+            if item is None:
+                return {}
+            item = copy.deepcopy(item)
+        if ProjectionExpression:
+            names = ExpressionAttributeNames or {}
+            projected = [names.get(name.strip(), name.strip()) for name in ProjectionExpression.split(',')]
+            item = {name: value for name, value in item.items() if name in projected}
+        return {'Item': item}
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, ReturnValues=None, ReturnValuesOnConditionCheckFailure=None, **_):
+        self._call('PutItem')
+        with self._lock:
+            old = self._tables[TableName].get(self._key(TableName, Item, 'PutItem'))
+            self._check_condition(ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, old, 'PutItem',
+                                  ReturnValuesOnConditionCheckFailure)
+            self._store(TableName, Item, 'PutItem')
+        return self._returned(ReturnValues, old, Item)
+
+    def update_item(self, TableName, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues=None, ReturnValuesOnConditionCheckFailure=None, **_):
+        self._call('UpdateItem')
+        with self._lock:
+            old = self._tables[TableName].get(self._key(TableName, Key, 'UpdateItem'))
+            self._check_condition(ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, old, 'UpdateItem',
+                                  ReturnValuesOnConditionCheckFailure)
+            new = _expression(UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues).apply_update(dict(old or Key))
+            self._store(TableName, new, 'UpdateItem')
+        return self._returned(ReturnValues, old, new)
+
+    def delete_item(self, TableName, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, **_):
+        self._call('DeleteItem')
+        with self._lock:
+            key = self._key(TableName, Key, 'DeleteItem')
+            self._check_condition(ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues,
+                                  self._tables[TableName].get(key), 'DeleteItem')
+            self._remove(TableName, key)
+        return {}
+
+    def query(self, TableName, KeyConditionExpression, IndexName=None, FilterExpression=None, ExpressionAttributeNames=None,
+              ExpressionAttributeValues=None, ScanIndexForward=True, Limit=None, ExclusiveStartKey=None, ConsistentRead=False, **_):
+        self._call('Query')
+        key_condition = _expression(KeyConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, True)
+        partition_key, sort_key = self._schemas[TableName]
+        partition = key_condition.equality(partition_key) if IndexName is None else None
+        with self._lock:
+            items = [copy.deepcopy(item) for item in self._tables[TableName].values(partition) if key_condition.matches(item)]
+        order_key = sort_key
+        if IndexName is not None:
+            # only items carrying the index keys are part of a (sparse) index
+            index_partition, order_key = self._indexes[TableName][IndexName]
+            items = [item for item in items if index_partition in item and (order_key is None or order_key in item)]
+        if order_key is not None:
+            items.sort(key=lambda item: item.get(order_key), reverse=not ScanIndexForward)
+        if FilterExpression is not None:
+            item_filter = _expression(FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+            items = [item for item in items if item_filter.matches(item)]
+        if ExclusiveStartKey is not None:
+            start = self._key(TableName, ExclusiveStartKey, 'Query')
+            keys = [self._key(TableName, item, 'Query') for item in items]
+            items = items[keys.index(start) + 1:] if start in keys else items
+        response = {'Items': items, 'Count': len(items)}
+        with self._lock:
+            self._consume_read(TableName, items[:Limit] if Limit is not None else items, ConsistentRead)
+        if Limit is not None and len(items) > Limit:
+            response['Items'] = items[:Limit]
+            response['Count'] = Limit
+            response['LastEvaluatedKey'] = {name: items[Limit - 1][name] for name in (partition_key, sort_key) if name}
+        return response
+
+    def batch_write_item(self, RequestItems, **_):
+        self._call('BatchWriteItem')
+        if sum(len(requests) for requests in RequestItems.values()) > 25:
+            raise client_error('ValidationException', 'Too many items requested for the BatchWriteItem call', 'BatchWriteItem')
+        unprocessed = {}
+        with self._lock:
+            for name, requests in RequestItems.items():
+                keys = [self._key(name, request.get('PutRequest', {}).get('Item') or request['DeleteRequest']['Key'], 'BatchWriteItem')
+                        for request in requests]
+                if len(set(keys)) != len(keys):
+                    raise client_error('ValidationException', 'Provided list of item keys contains duplicates', 'BatchWriteItem')
+                for request, key in zip(requests, keys):
+                    # a throttled request comes back as unprocessed, the others are written
+                    try:
+                        if 'PutRequest' in request:
+                            self._store(name, request['PutRequest']['Item'], 'BatchWriteItem')
+                        else:
+                            self._remove(name, key)
+                    except ClientError as error:
+                        if error.response['Error']['Code'] != 'ProvisionedThroughputExceededException':
+                            raise
+                        unprocessed.setdefault(name, []).append(request)
+        return {'UnprocessedItems': unprocessed}
+
+    # all actions or none: every condition is checked before the first write, a failed one cancels the transaction
+    def transact_write_items(self, TransactItems, **_):
+        self._call('TransactWriteItems')
+        if len(TransactItems) > 100:
+            raise client_error('ValidationException', 'Member must have length less than or equal to 100', 'TransactWriteItems')
+        actions = []
+        with self._lock:
+            for action in TransactItems:
+                (kind, params), = action.items()
+                key = self._key(params['TableName'], params.get('Item') or params['Key'], 'TransactWriteItems')
+                actions.append((kind, params, key, self._tables[params['TableName']].get(key)))
+            keys = [(params['TableName'], key) for _, params, key, _ in actions]
+            if len(set(keys)) != len(keys):
+                raise client_error('ValidationException', 'Transaction request cannot include multiple operations on one item', 'TransactWriteItems')
+            reasons = []
+            for kind, params, key, old in actions:
+                condition = params.get('ConditionExpression')
+                passed = condition is None or _expression(condition, params.get('ExpressionAttributeNames'),
+                                                          params.get('ExpressionAttributeValues')).matches(old or {})
+                reasons.append({'Code': 'None'} if passed else {'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'})
+            if any(reason['Code'] != 'None' for reason in reasons):
+                error = client_error('TransactionCanceledException', 'Transaction cancelled, please refer cancellation reasons for specific reasons', 'TransactWriteItems')
+                error.response['CancellationReasons'] = reasons
+                raise error
+            for kind, params, key, old in actions:
+                name = params['TableName']
+                if kind == 'Put':
+                    self._store(name, params['Item'], 'TransactWriteItems', factor=2)
+                elif kind == 'Update':
+                    new = _expression(params['UpdateExpression'], params.get('ExpressionAttributeNames'),
+                                      params.get('ExpressionAttributeValues')).apply_update(dict(old or params['Key']))
+                    self._store(name, new, 'TransactWriteItems', factor=2)
+                elif kind == 'Delete':
+                    self._remove(name, key, factor=2)
+        return {}
+
+    def batch_get_item(self, RequestItems, **_):
+        self._call('BatchGetItem')
+        responses = {}
+        with self._lock:
+            for name, request in RequestItems.items():
+                found = [self._tables[name].get(self._key(name, key, 'BatchGetItem')) for key in request['Keys']]
+                responses[name] = [copy.deepcopy(item) for item in found if item is not None]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def resource(self):
+        return _DynamoDBResource(self)
+
+    def client(self):
+        return _DynamoDBClient(self)
+
+
+class _Table:
+
+    def __init__(self, ddb, name):
+        self.ddb = ddb
+        self.name = name
+        self.table_name = name
+
+    def __getattr__(self, operation):
+        method = getattr(self.ddb, operation)
+
+        def call(**kwargs):
+            return method(TableName=self.name, **kwargs)
+        return call
+
+
+class _DynamoDBResource:
+
+    def __init__(self, ddb):
+        self.ddb = ddb
+
+    def Table(self, name):
+        return _Table(self.ddb, name)
+
+    def batch_write_item(self, **kwargs):
+        return self.ddb.batch_write_item(**kwargs)
+
+    def batch_get_item(self, **kwargs):
+        return self.ddb.batch_get_item(**kwargs)
+
+
+class _DynamoDBClient:
+    """Low-level client on top of the same tables: attribute values are typed ({'S': '20'}) on the way in and out."""
+
+    _serializer = TypeSerializer()
+    _deserializer = TypeDeserializer()
+
+    def __init__(self, ddb):
+        self.ddb = ddb
+
+    @classmethod
+    def _plain(cls, item):
+        return None if item is None else {name: cls._deserializer.deserialize(value) for name, value in item.items()}
+
+    @classmethod
+    def _typed(cls, item):
+        return None if item is None else {name: cls._serializer.serialize(value) for name, value in item.items()}
+
+    def _call(self, operation, **kwargs):
+        for parameter in ('Item', 'Key', 'ExpressionAttributeValues', 'ExclusiveStartKey'):
+            if parameter in kwargs:
+                kwargs[parameter] = self._plain(kwargs[parameter])
+        response = getattr(self.ddb, operation)(**kwargs)
+        for field in ('Item', 'Attributes', 'LastEvaluatedKey'):
+            if field in response:
+                response[field] = self._typed(response[field])
+        if 'Items' in response:
+            response['Items'] = [self._typed(item) for item in response['Items']]
+        return response
+
+    def get_item(self, **kwargs):
+        return self._call('get_item', **kwargs)
+
+    def put_item(self, **kwargs):
+        return self._call('put_item', **kwargs)
+
+    def update_item(self, **kwargs):
+        return self._call('update_item', **kwargs)
+
+    def delete_item(self, **kwargs):
+        return self._call('delete_item', **kwargs)
+
+    def query(self, **kwargs):
+        return self._call('query', **kwargs)
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        requests = {
+            name: [{'PutRequest': {'Item': self._plain(request['PutRequest']['Item'])}} if 'PutRequest' in request
+                   else {'DeleteRequest': {'Key': self._plain(request['DeleteRequest']['Key'])}} for request in table_requests]
+            for name, table_requests in RequestItems.items()
+        }
+        response = self.ddb.batch_write_item(RequestItems=requests, **kwargs)
+        response['UnprocessedItems'] = {
+            name: [{'PutRequest': {'Item': self._typed(request['PutRequest']['Item'])}} if 'PutRequest' in request
+                   else {'DeleteRequest': {'Key': self._typed(request['DeleteRequest']['Key'])}} for request in table_requests]
+            for name, table_requests in response['UnprocessedItems'].items()
+        }
+        return response
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        actions = []
+        for action in TransactItems:
+            (kind, params), = action.items()
+            params = dict(params)
+            for parameter in ('Item', 'Key', 'ExpressionAttributeValues'):
+                if parameter in params:
+                    params[parameter] = self._plain(params[parameter])
+            actions.append({kind: params})
+        return self.ddb.transact_write_items(TransactItems=actions, **kwargs)
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        requests = {name: dict(request, Keys=[self._plain(key) for key in request['Keys']]) for name, request in RequestItems.items()}
+        response = self.ddb.batch_get_item(RequestItems=requests, **kwargs)
+        response['Responses'] = {name: [self._typed(item) for item in items] for name, items in response['Responses'].items()}
+        return response
+
+
+# ------------------------------------------------------------------------------------------------
+# SNS and SQS
+# ------------------------------------------------------------------------------------------------
+class InMemorySNS:
+    """Delivers every published message to the subscribed callables, asynchronously when a dispatcher is given."""
+
+    def __init__(self, calls=None, latency=0.0, dispatcher=None):
+        self.calls = calls or CallCounter()
+        self.latency = latency
+        self.dispatcher = dispatcher
+        self._subscriptions = {}
+
+    # filter_policy is a filter policy with the MessageBody scope: exact values and {"exists": bool} of nested keys
+    def subscribe(self, topic_arn, subscriber, filter_policy=None):
+        self._subscriptions.setdefault(topic_arn, []).append((subscriber, filter_policy))
+
+    # SNS does not deliver a message body that is not JSON to a subscription filtering on the body
+    @classmethod
+    def _body_matches(cls, policy, message):
+        try:
+            return cls._matches(policy, json.loads(message))
+        except ValueError:
+            return False
+
+    @classmethod
+    def _matches(cls, policy, body):
+        for key, condition in policy.items():
+            present = isinstance(body, dict) and key in body
+            if isinstance(condition, dict):
+                if not cls._matches(condition, body.get(key) if present else None):
+                    return False
+                continue
+            if not any(present == rule['exists'] if isinstance(rule, dict) else present and body[key] == rule
+                       for rule in condition):
+                return False
+        return True
+
+    def _deliver(self, topic_arn, message, attributes=None):
+        record = {'Records': [{
+            'EventSource': 'aws:sns',
+            'EventSubscriptionArn': f"{topic_arn}:{uuid.uuid4()}",
+            'Sns': {
+                'Type': 'Notification',
+                'MessageId': str(uuid.uuid4()),
+                'TopicArn': topic_arn,
+                'Message': message,
+                'MessageAttributes': attributes or {},
+                'Timestamp': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+            }
+        }]}
+        for subscriber, filter_policy in self._subscriptions.get(topic_arn, []):
+            if filter_policy is not None and not self._body_matches(filter_policy, message):
+                continue
+            if self.dispatcher is None:
+                subscriber(copy.deepcopy(record))
+            else:
+                self.dispatcher.submit(subscriber, copy.deepcopy(record))
+
+    @staticmethod
+    def _message(message, structure):
+        if structure == 'json':
+            return json.loads(message)['default']
+        return message
+
+    def publish(self, TopicArn, Message, MessageStructure=None, MessageAttributes=None, **_):
+        self.calls.add('sns', 'Publish')
+        if self.latency:
+            time.sleep(self.latency)
+        self._deliver(TopicArn, self._message(Message, MessageStructure), MessageAttributes)
+        return {'MessageId': str(uuid.uuid4())}
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries, **_):
+        self.calls.add('sns', 'PublishBatch')
+        if len(PublishBatchRequestEntries) > 10:
+            raise client_error('TooManyEntriesInBatchRequest', 'The batch request contains more entries than permissible', 'PublishBatch')
+        if self.latency:
+            time.sleep(self.latency)
+        successful = []
+        for entry in PublishBatchRequestEntries:
+            self._deliver(TopicArn, self._message(entry['Message'], entry.get('MessageStructure')), entry.get('MessageAttributes'))
+            successful.append({'Id': entry['Id'], 'MessageId': str(uuid.uuid4())})
+        return {'Successful': successful, 'Failed': []}
+
+
+class InMemoryQueue:
+    """SQS queue with the receive semantics of the Lambda event source mapping: batch size and batching window."""
+
+    def __init__(self, name, calls=None, latency=0.0, delivery_delay=0.0):
+        self.name = name
+        self.calls = calls or CallCounter()
+        self.latency = latency
+        self.delivery_delay = delivery_delay
+        # redrive policy: records received max_receive_count times go to the dead-letter queue instead
+        self.dead_letter_queue = None
+        self.max_receive_count = 0
+        # (visible at, record) in the order the messages were sent
+        self._messages = deque()
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._messages)
+
+    def send(self, body, attributes=None, delay=None):
+        self.calls.add('sqs', 'SendMessage')
+        if self.latency:
+            time.sleep(self.latency)
+        self._put([(body, attributes)], delay)
+
+    # delays: the DelaySeconds of every message, None for the delay of the call or of the queue.
+    # attributes: the MessageAttributes of every message
+    def send_batch(self, bodies, delay=None, delays=None, attributes=None):
+        self.calls.add('sqs', 'SendMessageBatch')
+        if len(bodies) > 10:
+            raise client_error('AWS.SimpleQueueService.TooManyEntriesInBatchRequest', 'Maximum number of entries per request are 10', 'SendMessageBatch')
+        if self.latency:
+            time.sleep(self.latency)
+        for body, message_delay, message_attributes in zip(bodies, delays or [None] * len(bodies), attributes or [None] * len(bodies)):
+            self._put([(body, message_attributes)], delay if message_delay is None else message_delay)
+
+    def _put(self, messages, delay=None):
+        visible_at = time.monotonic() + (self.delivery_delay if delay is None else delay)
+        with self._condition:
+            for body, attributes in messages:
+                self._messages.append((visible_at, {
+                    'messageId': str(uuid.uuid4()),
+                    'receiptHandle': str(uuid.uuid4()),
+                    'body': body,
+                    'attributes': {'ApproximateReceiveCount': '1', 'SentTimestamp': str(int(time.time() * 1000))},
+                    'messageAttributes': attributes or {},
+                    'md5OfBody': '',
+                    'eventSource': 'aws:sqs',
+                    'eventSourceARN': f"arn:aws:sqs:local:000000000000:{self.name}",
+                    'awsRegion': 'local'
+                }))
+            self._condition.notify_all()
+
+    def _visible(self):
+        now = time.monotonic()
+        return sum(1 for visible_at, _ in self._messages if visible_at <= now)
+
+    # returns up to batch_size records, waiting at most window seconds for the batch to fill up
+    def receive(self, batch_size, window, stop=None):
+        deadline = time.monotonic() + window
+        with self._condition:
+            while self._visible() < batch_size and (stop is None or not stop.is_set()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(min(remaining, 0.05))
+            now = time.monotonic()
+            records = []
+            pending = deque()
+            while self._messages:
+                visible_at, record = self._messages.popleft()
+                if visible_at <= now and len(records) < batch_size:
+                    records.append(record)
+                else:
+                    pending.append((visible_at, record))
+            self._messages = pending
+        return records
+
+    def redrive(self, dead_letter_queue, max_receive_count):
+        self.dead_letter_queue = dead_letter_queue
+        self.max_receive_count = max_receive_count
+
+    # puts records back as the event source mapping does once their visibility timeout expires
+    def redeliver(self, records, visibility_timeout=0.0):
+        if self.dead_letter_queue is not None:
+            exhausted = [record for record in records if int(record['attributes']['ApproximateReceiveCount']) >= self.max_receive_count]
+            records = [record for record in records if record not in exhausted]
+            self.dead_letter_queue._put([(record['body'], record['messageAttributes']) for record in exhausted])
+        visible_at = time.monotonic() + visibility_timeout
+        with self._condition:
+            for record in records:
+                record = copy.deepcopy(record)
+                record['attributes']['ApproximateReceiveCount'] = str(int(record['attributes']['ApproximateReceiveCount']) + 1)
+                self._messages.append((visible_at, record))
+            self._condition.notify_all()
+
+    def event(self, records):
+        return {'Records': records}
+
+
+class InMemoryStream(InMemoryQueue):
+    """DynamoDB stream of a table (NEW_AND_OLD_IMAGES), read by the event source mapping like a queue.
+    record_filter stands in for the filter criteria of the mapping, filtered records never reach the function."""
+
+    def __init__(self, table_name, calls=None, record_filter=None):
+        super().__init__(f"{table_name}/stream", calls)
+        self.table_name = table_name
+        self.record_filter = record_filter
+        self._sequence = 0
+
+    def record(self, keys, old, new):
+        typed = _DynamoDBClient._typed
+        change = {'Keys': typed(keys), 'SizeBytes': _item_size(new or old), 'StreamViewType': 'NEW_AND_OLD_IMAGES',
+                  'ApproximateCreationDateTime': int(time.time())}
+        if new is not None:
+            change['NewImage'] = typed(new)
+        if old is not None:
+            change['OldImage'] = typed(old)
+        record = {
+            'eventID': uuid.uuid4().hex,
+            'eventName': 'INSERT' if old is None else 'REMOVE' if new is None else 'MODIFY',
+            'eventVersion': '1.1',
+            'eventSource': 'aws:dynamodb',
+            'awsRegion': 'local',
+            'dynamodb': change,
+            'eventSourceARN': f"arn:aws:dynamodb:local:000000000000:table/{self.table_name}/stream/local"
+        }
+        if self.record_filter is not None and not self.record_filter(record):
+            return
+        with self._condition:
+            self._sequence += 1
+            change['SequenceNumber'] = str(self._sequence).zfill(21)
+            self._messages.append((time.monotonic(), record))
+            self._condition.notify_all()
+
+    # a stream retries the failed records before the rest of the shard (ReportBatchItemFailures)
+    def redeliver(self, records, visibility_timeout=0.0):
+        visible_at = time.monotonic() + visibility_timeout
+        with self._condition:
+            self._messages.extendleft((visible_at, record) for record in reversed(records))
+            self._condition.notify_all()
+
+
+class _SQSClient:
+
+    def __init__(self, queues):
+        self.queues = queues
+
+    def _queue(self, url):
+        return self.queues[url.rsplit('/', 1)[-1]]
+
+    def send_message(self, QueueUrl, MessageBody, MessageAttributes=None, DelaySeconds=None, **_):
+        self._queue(QueueUrl).send(MessageBody, MessageAttributes, DelaySeconds)
+        return {'MessageId': str(uuid.uuid4())}
+
+    def send_message_batch(self, QueueUrl, Entries, **_):
+        self._queue(QueueUrl).send_batch([entry['MessageBody'] for entry in Entries], delays=[entry.get('DelaySeconds') for entry in Entries],
+                                         attributes=[entry.get('MessageAttributes') for entry in Entries])
+        return {'Successful': [{'Id': entry['Id'], 'MessageId': str(uuid.uuid4())} for entry in Entries], 'Failed': []}
+
+
+# ------------------------------------------------------------------------------------------------
+# DynamoDB over HTTP
+# ------------------------------------------------------------------------------------------------
+class DynamoDBEndpoint:
+    """Serves the DynamoDB JSON protocol on localhost from an InMemoryDynamoDB, so real botocore clients
+    (connection pool, retries, timeouts) can be measured against it. Requests above the capacity (requests
+    per second, with a second of burst credit) are throttled like a table at its provisioned capacity, a
+    throttle_rate throttles a random share on top. Requests and new connections are counted."""
+
+    TARGET_PREFIX = 'DynamoDB_20120810.'
+    ERROR_PREFIX = 'com.amazonaws.dynamodb.v20120810#'
+
+    def __init__(self, ddb=None, throttle_rate=0.0, capacity=0.0, seed=None):
+        self.ddb = ddb or InMemoryDynamoDB()
+        self.client = self.ddb.client()
+        self.throttle_rate = throttle_rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._refilled = time.monotonic()
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.throttled = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _throttle(self):
+        with self._lock:
+            if self.throttle_rate > 0 and self.random.random() < self.throttle_rate:
+                return True
+            if not self.capacity:
+                return False
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._refilled) * self.capacity)
+            self._refilled = now
+            if self._tokens < 1:
+                return True
+            self._tokens -= 1
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'throttled': self.throttled, 'connections': self.connections}
+
+    def handle(self, target, body):
+        """Returns (status, response body) of one request."""
+        self._count('requests')
+        operation = target[len(self.TARGET_PREFIX):]
+        if self._throttle():
+            self._count('throttled')
+            return 400, {'__type': self.ERROR_PREFIX + 'ProvisionedThroughputExceededException',
+                         'message': 'The level of configured provisioned throughput for the table was exceeded'}
+        method = getattr(self.client, re.sub(r'(?<!^)(?=[A-Z])', '_', operation).lower(), None)
+        if method is None:
+            return 400, {'__type': self.ERROR_PREFIX + 'UnknownOperationException', 'message': operation}
+        try:
+            return 200, method(**body)
+        except ClientError as error:
+            return 400, {'__type': self.ERROR_PREFIX + error.response['Error']['Code'], 'message': error.response['Error']['Message']}
+
+    def start(self):
+        endpoint = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            # keeps the connection open between requests like the service does
+            protocol_version = 'HTTP/1.1'
+            # headers and body are written separately, Nagle would hold the body back until the client acknowledges
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                endpoint._count('connections')
+
+            def _send(self, status, response):
+                payload = json.dumps(response, default=json_default).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/x-amz-json-1.0')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+                self._send(*endpoint.handle(self.headers.get('X-Amz-Target', ''), body))
+
+            # the counters, for a caller running the endpoint in another process
+            def do_GET(self):
+                self._send(200, endpoint.stats())
+
+            def log_message(self, *args):
+                pass
+
+        class Server(http.server.ThreadingHTTPServer):
+            daemon_threads = True
+            # a burst opens many connections at once
+            request_queue_size = 256
+
+        self._server = Server(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+# ------------------------------------------------------------------------------------------------
+# Lambda destinations and boto3 patching
+# ------------------------------------------------------------------------------------------------
+def destination_record(function_name, request, response, condition='Success'):
+    """Invocation record that Lambda Destinations send to SNS / SQS after an asynchronous invocation."""
+    return {
+        'version': '1.0',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
+        'requestContext': {
+            'requestId': str(uuid.uuid4()),
+            'functionArn': f"arn:aws:lambda:local:000000000000:function:{function_name}:$LATEST",
+            'condition': condition,
+            'approximateInvokeCount': 1
+        },
+        'requestPayload': request,
+        'responseContext': {'statusCode': 200, 'executedVersion': '$LATEST'},
+        'responsePayload': response
+    }
+
+
+def json_default(value):
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, set):
+        return sorted(value)
+    raise TypeError(f"{type(value)} is not JSON serializable")
+
+
+class LocalAWS:
+    """Bundle of stand-ins sharing one call counter."""
+
+    def __init__(self, ddb_latency=0.0, sns_latency=0.0, sqs_latency=0.0, dispatcher=None, calls=None):
+        self.calls = calls or CallCounter()
+        self.dynamodb = InMemoryDynamoDB(self.calls, ddb_latency)
+        self.sns = InMemorySNS(self.calls, sns_latency, dispatcher)
+        self.queues = {}
+        self.sqs_latency = sqs_latency
+
+    def queue(self, name, delivery_delay=0.0):
+        if name not in self.queues:
+            self.queues[name] = InMemoryQueue(name, self.calls, self.sqs_latency, delivery_delay)
+        return self.queues[name]
+
+    def client(self, service_name, *args, **kwargs):
+        if service_name == 'dynamodb':
+            return self.dynamodb.client()
+        if service_name == 'sns':
+            return self.sns
+        if service_name == 'sqs':
+            return _SQSClient(self.queues)
+        raise NotImplementedError(f"no local stand-in for {service_name}")
+
+    def resource(self, service_name, *args, **kwargs):
+        if service_name == 'dynamodb':
+            return self.dynamodb.resource()
+        raise NotImplementedError(f"no local stand-in for {service_name} resource")
+
+    @contextlib.contextmanager
+    def install(self):
+        """Routes boto3.client / boto3.resource to the stand-ins while the context is active."""
+        original_client, original_resource = boto3.client, boto3.resource
+        boto3.client, boto3.resource = self.client, self.resource
+        try:
+            yield self
+        finally:
+            boto3.client, boto3.resource = original_client, original_resource
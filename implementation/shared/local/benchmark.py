@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: benchmark.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Small helpers shared by the local benchmarks: percentiles, plain text result tables and the embedded
+# metrics printed by the instrumented handlers.
+import json
+import math
+import threading
+
+
+def percentile(values, p):
+    """Nearest-rank percentile, p in [0, 100]."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def latency_summary(seconds):
+    """p50 / p99 / max of a list of durations in seconds, returned in milliseconds."""
+    return {
+        'p50_ms': percentile(seconds, 50) * 1000,
+        'p99_ms': percentile(seconds, 99) * 1000,
+        'max_ms': (max(seconds) if seconds else 0.0) * 1000
+    }
+
+
+def format_table(rows, columns=None):
+    """Formats a list of dicts as an aligned text table."""
+    if not rows:
+        return ''
+    if columns is None:
+        columns = []
+        for row in rows:
+            columns.extend(column for column in row if column not in columns)
+
+    def cell(value):
+        if isinstance(value, float):
+            return f"{value:,.2f}"
+        return str(value)
+    cells = [[cell(row.get(column, '')) for column in columns] for row in rows]
+    widths = [max(len(column), *(len(line[index]) for line in cells)) for index, column in enumerate(columns)]
+    lines = ['  '.join(column.ljust(width) for column, width in zip(columns, widths)),
+             '  '.join('-' * width for width in widths)]
+    lines.extend('  '.join(value.rjust(width) for value, width in zip(line, widths)) for line in cells)
+    return '\n'.join(lines)
+
+
+class MetricSink:
+    """Replaces stdout while a simulation runs and sums the embedded metric format records the handlers print."""
+
+    def __init__(self):
+        self.totals = {}
+        # stage latencies of the instrumented handlers, (service, stage) -> milliseconds
+        self.latencies = {}
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        for line in text.splitlines():
+            if not line.startswith('{'):
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            for directive in record.get('_aws', {}).get('CloudWatchMetrics', []):
+                with self.lock:
+                    for metric in directive['Metrics']:
+                        if metric['Name'] == 'Latency':
+                            self.latencies.setdefault((record.get('Service'), record.get('Stage')), []).append(record['Latency'])
+                        else:
+                            self.totals[metric['Name']] = self.totals.get(metric['Name'], 0) + record.get(metric['Name'], 0)
+        return len(text)
+
+    def stage_summary(self, design):
+        rows = []
+        for (service, stage), latencies in sorted(self.latencies.items()):
+            row = {'design': design, 'service': service, 'stage': stage, 'spans': len(latencies)}
+            row.update(latency_summary([latency / 1000.0 for latency in latencies]))
+            rows.append(row)
+        return rows
+
+    # handler invocations, every instrumented handler times its whole invocation
+    def invocations(self):
+        with self.lock:
+            return sum(len(latencies) for (_, stage), latencies in self.latencies.items() if stage == 'invocation')
+
+    def flush(self):
+        pass
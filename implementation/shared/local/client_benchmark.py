@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: client_benchmark.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Burst benchmark of the DynamoDB clients of the python handlers. A real botocore client per client profile
+# (lambda_runtime.PROFILES) talks HTTP to a local DynamoDB endpoint (aws_stand_ins.DynamoDBEndpoint) while
+# many threads fire their calls at once, through the Table of the boto3 resource or the low-level Table of
+# the layer (dynamodb_table). Reports the latency per call, the connections opened and the requests per call,
+# which grow with the retries when a share of the requests is throttled.
+#
+# usage: python client_benchmark.py --threads 50 --calls 20 --throttle-rate 0.05
+import argparse
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from aws_stand_ins import DynamoDBEndpoint, InMemoryDynamoDB
+from benchmark import format_table, latency_summary
+from lambda_loader import add_layer_path
+
+add_layer_path()
+import dynamodb_table  # noqa: E402
+import lambda_runtime  # noqa: E402
+
+TABLE_NAME = 'QuoteAggregatorTable'
+# botocore without a Config, as the handlers created their clients before the profiles
+BOTOCORE_DEFAULTS = 'botocore'
+
+
+# the endpoint runs in a process of its own, the threads of a burst do not share an interpreter with it
+def serve(ready, throttle_rate, capacity, server_latency):
+    ddb = InMemoryDynamoDB(latency=server_latency)
+    ddb.create_table(TABLE_NAME, 'quoteId', 'vendor')
+    endpoint = DynamoDBEndpoint(ddb, throttle_rate=throttle_rate, capacity=capacity, seed=1).start()
+    ready.put(endpoint.url)
+    threading.Event().wait()
+
+
+@contextlib.contextmanager
+def endpoint_process(throttle_rate, capacity, server_latency):
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(ready, throttle_rate, capacity, server_latency), daemon=True)
+    process.start()
+    try:
+        yield ready.get(timeout=30)
+    finally:
+        process.terminate()
+        process.join()
+
+
+def endpoint_stats(url):
+    with urllib.request.urlopen(url) as response:
+        return json.load(response)
+
+
+def make_table(api, profile):
+    import boto3
+    from botocore.config import Config
+    config = None if profile == BOTOCORE_DEFAULTS else Config(**lambda_runtime.profile_config(profile))
+    if api == 'resource':
+        return boto3.resource('dynamodb', config=config).Table(TABLE_NAME)
+    return dynamodb_table.Table(TABLE_NAME, boto3.client('dynamodb', config=config))
+
+
+# the writes and reads of the aggregator: appending a quote to an item and reading the quotes of a request
+def call(table, index):
+    key = {'quoteId': f"quote-{index % 100}", 'vendor': f"VENDOR#{index % 7}"}
+    if index % 2:
+        table.update_item(Key=key, UpdateExpression="SET Quotes = list_append(if_not_exists(Quotes, :empty), :quotes)",
+                          ExpressionAttributeValues={':empty': [], ':quotes': [{'rate': '99.00', 'daysRental': index}]})
+    else:
+        table.get_item(Key=key)
+
+
+def run(api, profile, threads, calls, bursts, pause, throttle_rate, capacity, server_latency):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    with endpoint_process(throttle_rate, capacity, server_latency) as url:
+        os.environ['AWS_ENDPOINT_URL_DYNAMODB'] = url
+        table = make_table(api, profile)
+        elapsed = 0.0
+        for _ in range(bursts):
+            barrier = threading.Barrier(threads)
+
+            # every thread of a burst starts at the same moment
+            def worker(thread):
+                barrier.wait()
+                for number in range(calls):
+                    started = time.perf_counter()
+                    try:
+                        call(table, thread * calls + number)
+                    except Exception as error:
+                        with lock:
+                            errors.append(error)
+                        continue
+                    with lock:
+                        latencies.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                list(pool.map(worker, range(threads)))
+            elapsed += time.perf_counter() - started
+            time.sleep(pause)
+        stats = endpoint_stats(url)
+    config = {} if profile == BOTOCORE_DEFAULTS else lambda_runtime.profile_config(profile)
+    total = threads * calls * bursts
+    result = {
+        'api': api,
+        'profile': profile,
+        'pool': config.get('max_pool_connections', 10),
+        'retries': config.get('retries', {}).get('mode', 'legacy'),
+        'threads': threads,
+        'calls': total,
+        'calls/s': total / elapsed if elapsed else 0.0
+    }
+    result.update(latency_summary(latencies))
+    # the stats request itself opened a connection
+    result['connections'] = stats['connections'] - 1
+    result['requests/call'] = stats['requests'] / total
+    result['throttled'] = stats['throttled']
+    result['errors'] = len(errors)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Burst benchmark of the DynamoDB clients of the python handlers")
+    parser.add_argument('--profile', action='append', choices=[BOTOCORE_DEFAULTS] + sorted(lambda_runtime.PROFILES),
+                        help='client profile to measure, botocore: no Config at all (default: all)')
+    parser.add_argument('--api', action='append', choices=['resource', 'client'], help='Table of the boto3 resource or of dynamodb_table (default: both)')
+    parser.add_argument('--threads', type=int, default=50, help='threads calling at once (default: 50)')
+    parser.add_argument('--calls', type=int, default=20, help='calls per thread and burst (default: 20)')
+    parser.add_argument('--bursts', type=int, default=3, help='bursts per run (default: 3)')
+    parser.add_argument('--pause', type=float, default=0.2, help='seconds between bursts (default: 0.2)')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of the requests answered with a throttling error (default: 0)')
+    parser.add_argument('--capacity', type=float, default=0.0,
+                        help='requests per second the endpoint serves before it throttles, like a provisioned table (default: 0, unlimited)')
+    parser.add_argument('--server-latency-ms', type=float, default=1.0, help='latency of every request at the endpoint (default: 1)')
+    args = parser.parse_args()
+
+    os.environ.update({'AWS_DEFAULT_REGION': 'us-east-1', 'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                       'AWS_EC2_METADATA_DISABLED': 'true'})
+    # a full connection pool is logged for every connection it discards
+    logging.getLogger('urllib3').setLevel(logging.ERROR)
+    results = [run(api, profile, args.threads, args.calls, args.bursts, args.pause, args.throttle_rate, args.capacity,
+                   args.server_latency_ms / 1000.0)
+               for api in (args.api or ['resource', 'client'])
+               for profile in (args.profile or [BOTOCORE_DEFAULTS] + sorted(lambda_runtime.PROFILES))]
+    print(format_table(results))
+
+
+if __name__ == '__main__':
+    main()
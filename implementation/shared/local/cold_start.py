@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: cold_start.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Cold-start benchmark of the python handlers of all implementations. Every run imports a handler in a
+# fresh interpreter, as a new Lambda container does, and measures the import (the init phase), the first
+# invocation and the following warm invocations. AWS calls return canned responses without leaving the
+# process, boto3 itself (session, client creation, endpoint resolution) runs for real.
+#
+# usage: python cold_start.py --runs 5 [--handler choreography/ShipOrder] [--output cold_start.jsonl]
+import argparse
+import contextlib
+import importlib.abc
+import importlib.machinery
+import io
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmark import format_table
+
+IMPLEMENTATION = pathlib.Path(__file__).resolve().parents[2]
+SCATTER_GATHER = IMPLEMENTATION.joinpath("parallel-to-sns-scatter-gather", "scatter_gather", "lambda_")
+CHOREOGRAPHY = IMPLEMENTATION.joinpath("choreography-to-orchestration", "lambda")
+MORTGAGE = IMPLEMENTATION.joinpath("orchestration-to-choreography", "lambda", "choreography")
+
+QUOTE_REQUEST = {'data': {'car_type': 'L', 'days_rental': 30, 'uuid': '00000000-0000-0000-0000-000000000001'}}
+QUOTE = dict(QUOTE_REQUEST['data'], price_quote=2970, vendor='Avis')
+SNS_ORDER = {'Records': [{'Sns': {'Message': json.dumps({'product_id': 1})}}]}
+
+
+def sqs_event(*bodies):
+    return {'Records': [{'messageId': str(index), 'body': json.dumps(body), 'eventSource': 'aws:sqs'} for index, body in enumerate(bodies)]}
+
+
+# name -> (handler file, handler function, environment, event)
+HANDLERS = {
+    'scatter-gather/requester': (SCATTER_GATHER.joinpath("requester", "app.py"), 'lambda_handler', {}, {'data': {'car_type': 'L', 'days_rental': 30}}),
+    'scatter-gather/responder': (SCATTER_GATHER.joinpath("responder", "app.py"), 'lambda_handler', {'base_rate': '99', 'vendor': 'Avis'}, QUOTE_REQUEST),
+    'scatter-gather/aggregator': (SCATTER_GATHER.joinpath("aggregator", "app.py"), 'lambda_handler', {'QUOTE_TABLE_NAME': 'QuoteAggregatorTable'},
+                                  sqs_event({'responsePayload': {'statusCode': 200, 'data': QUOTE}})),
+    'mortgage/quoteAggregator': (MORTGAGE.joinpath("quoteAggregator.py"), 'lambda_handler', {'QUOTE_TABLE_NAME': 'MortgageQuotes'},
+                                 sqs_event({'responsePayload': {'id': '1', 'bankId': 'PawnShop', 'rate': 5.1}})),
+    'choreography/ProcessPayment': (CHOREOGRAPHY.joinpath("choreography", "ProcessPayment.py"), 'lambda_handler',
+                                    {'table_name': 'temporary-data-store', 'sns_topic_arn': 'arn:aws:sns:us-east-1:000000000000:ShipOrderTopic'},
+                                    {'body': json.dumps({'product_id': 1})}),
+    'choreography/ShipOrder': (CHOREOGRAPHY.joinpath("choreography", "ShipOrder.py"), 'lambda_handler',
+                               {'table_name': 'temporary-data-store', 'sns_topic_arn': 'arn:aws:sns:us-east-1:000000000000:UpdateRewardTopic'}, SNS_ORDER),
+    'choreography/UpdateReward': (CHOREOGRAPHY.joinpath("choreography", "UpdateReward.py"), 'lambda_handler', {'table_name': 'temporary-data-store'}, SNS_ORDER),
+    'orchestration/ProcessPayment': (CHOREOGRAPHY.joinpath("orchestration", "ProcessPayment.py"), 'lambda_handler', {}, {'product_id': 1}),
+    'orchestration/ShipOrder': (CHOREOGRAPHY.joinpath("orchestration", "ShipOrder.py"), 'lambda_handler', {}, {'product_id': 1}),
+    'orchestration/UpdateReward': (CHOREOGRAPHY.joinpath("orchestration", "UpdateReward.py"), 'lambda_handler', {}, {'product_id': 1}),
+}
+
+# responses of the AWS operations the handlers call, anything else answers {}
+CANNED_RESPONSES = {
+    'GetItem': {'Item': {'product_id': {'S': '1'}, 'Payment_processed': {'BOOL': True}, 'Ship_order': {'BOOL': True}}},
+    'BatchWriteItem': {'UnprocessedItems': {}},
+    'UpdateItem': {'Attributes': {'product_id': {'S': '1'}, 'Payment_processed': {'BOOL': True}, 'Ship_order': {'BOOL': True}}},
+    'Publish': {'MessageId': '00000000-0000-0000-0000-000000000000'},
+    'SendMessageBatch': {'Successful': [], 'Failed': []},
+    'Query': {'Items': [], 'Count': 0},
+}
+
+
+def _canned_api_call(self, operation_name, api_params):
+    return json.loads(json.dumps(CANNED_RESPONSES.get(operation_name, {})))
+
+
+class _BotocoreClientPatch(importlib.abc.MetaPathFinder):
+    """Answers every AWS call with a canned response once botocore.client is imported, without importing it earlier."""
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname != 'botocore.client':
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path)
+        exec_module = spec.loader.exec_module
+
+        def patched_exec_module(module):
+            exec_module(module)
+            module.BaseClient._make_api_call = _canned_api_call
+        spec.loader.exec_module = patched_exec_module
+        return spec
+
+
+def run_child(name, warm_invocations):
+    """Runs in a fresh interpreter: import, first invocation and warm invocations of one handler."""
+    path, function, environment, event = HANDLERS[name]
+    os.environ.update({'AWS_DEFAULT_REGION': 'us-east-1', 'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                       'AWS_EC2_METADATA_DISABLED': 'true'})
+    os.environ.update(environment)
+    sys.meta_path.insert(0, _BotocoreClientPatch())
+    from lambda_loader import LambdaContext, load_handler
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        module = load_handler(path)
+        imported = time.perf_counter()
+        boto3_at_init = 'boto3' in sys.modules
+        handler = getattr(module, function)
+        handler(json.loads(json.dumps(event)), LambdaContext(path.stem))
+        first = time.perf_counter()
+        warm = []
+        for _ in range(warm_invocations):
+            invoked = time.perf_counter()
+            handler(json.loads(json.dumps(event)), LambdaContext(path.stem))
+            warm.append(time.perf_counter() - invoked)
+    return {
+        'import_ms': (imported - started) * 1000,
+        'first_invoke_ms': (first - imported) * 1000,
+        'warm_invoke_ms': statistics.median(warm) * 1000 if warm else 0.0,
+        'boto3 at init': boto3_at_init
+    }
+
+
+def measure(name, runs, warm_invocations):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, __file__, '--child', name, '--warm', str(warm_invocations)],
+                                check=True, capture_output=True, text=True, cwd=str(pathlib.Path(__file__).parent)).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    result = {'handler': name}
+    for metric in ('import_ms', 'first_invoke_ms', 'warm_invoke_ms'):
+        result[metric] = statistics.median(sample[metric] for sample in samples)
+    result['init + first_ms'] = result['import_ms'] + result['first_invoke_ms']
+    result['boto3 at init'] = 'yes' if samples[0]['boto3 at init'] else 'no'
+    return result
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True, capture_output=True, text=True,
+                              cwd=str(IMPLEMENTATION)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark of the python Lambda handlers")
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per handler, the median is reported (default: 5)')
+    parser.add_argument('--warm', type=int, default=10, help='warm invocations per run (default: 10)')
+    parser.add_argument('--handler', action='append', choices=sorted(HANDLERS), help='handler to measure (default: all)')
+    parser.add_argument('--output', help='appends the results as one JSON line (with the git commit) to this file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.warm)))
+        return
+    results = [measure(name, args.runs, args.warm) for name in (args.handler or HANDLERS)]
+    print(format_table(results))
+    if args.output:
+        with open(args.output, 'a') as output:
+            output.write(json.dumps({'timestamp': int(time.time()), 'commit': current_commit(), 'results': results}) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: lambda_loader.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Loads Lambda handler modules the way the Lambda runtime does: one module instance per function
+# (i.e. per container), with the function environment variables set while the module initializes
+# and the shared layer on sys.path.
+import importlib.util
+import json
+import logging
+import os
+import pathlib
+import sys
+import threading
+import time
+import uuid
+
+SHARED_LAYER = pathlib.Path(__file__).resolve().parents[1].joinpath("layer", "python")
+
+_lock = threading.Lock()
+_counter = 0
+
+
+def add_layer_path():
+    if str(SHARED_LAYER) not in sys.path:
+        sys.path.insert(0, str(SHARED_LAYER))
+
+
+def load_handler(path, environment=None, log_level=logging.WARNING):
+    """Imports the handler module at path as a new module instance and returns it."""
+    global _counter
+    path = pathlib.Path(path).resolve()
+    add_layer_path()
+    with _lock:
+        _counter += 1
+        name = f"_lambda_{path.stem}_{_counter}"
+        saved = {key: os.environ.get(key) for key in (environment or {})}
+        # lambda environment values are strings, objects are passed on as JSON like LambdaStates does
+        os.environ.update({key: value if isinstance(value, str) else json.dumps(value) for key, value in (environment or {}).items()})
+        # every function runs in its own container, so it gets its own copy of the layer and function modules
+        for module_name, module in list(sys.modules.items()):
+            module_file = str(getattr(module, '__file__', None) or '')
+            if module_file.startswith(str(SHARED_LAYER)) or module_file.startswith(str(path.parent)):
+                del sys.modules[module_name]
+        # the function folder comes first, as in the Lambda task root
+        sys.path.insert(0, str(path.parent))
+        try:
+            spec = importlib.util.spec_from_file_location(name, path)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[name] = module
+            spec.loader.exec_module(module)
+        finally:
+            sys.path.remove(str(path.parent))
+            for key, value in saved.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+    # handlers configure INFO logging at import time, keep the measurements free of log output
+    logging.getLogger().setLevel(log_level)
+    return module
+
+
+class LambdaContext:
+    """Minimal stand-in for the context object passed to handlers."""
+
+    def __init__(self, function_name, memory_limit_in_mb=128, timeout_seconds=3):
+        self.function_name = function_name
+        self.function_version = '$LATEST'
+        self.invoked_function_arn = f"arn:aws:lambda:local:000000000000:function:{function_name}"
+        self.memory_limit_in_mb = memory_limit_in_mb
+        self.aws_request_id = str(uuid.uuid4())
+        self.log_group_name = f"/aws/lambda/{function_name}"
+        self.log_stream_name = 'local'
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: quote_shard_benchmark.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Write throughput of a hot quote request with write sharding. Every vendor of one request quotes a few rounds,
+# the quotes reach DynamoDB in aggregator batches written by concurrent aggregator containers with the quote store
+# of the scatter-gather aggregator. The in-memory DynamoDB serves each partition key value a limited number of
+# write units per second, as DynamoDB does per partition: throttled quotes are retried after a redelivery delay
+# like the SQS records of the aggregator. With more shards the quotes of the request spread over more partition
+# key values, the table then reads the request back from all shards at once.
+# More shards are not faster: the throughput grows until the request is no longer throttled (4 shards with the
+# defaults, about 13k write units a second) and drops a little beyond that, every read queries one more shard.
+#
+# usage: python quote_shard_benchmark.py --shards 1 --shards 4 --shards 8 --vendors 500 --rounds 4
+import argparse
+import decimal
+import logging
+import queue
+import threading
+import time
+
+from aws_stand_ins import LocalAWS
+from benchmark import format_table
+from lambda_loader import add_layer_path
+
+add_layer_path()
+import quote_store  # noqa: E402
+
+REQUEST_ID = 'hot-request'
+VENDOR_PREFIX = 'VENDOR#'
+
+
+def run(aws, shards, vendors, rounds, batch_size, writers, quote_bytes, redelivery):
+    table_name = f"QuoteAggregatorTable-{shards}"
+    aws.dynamodb.create_table(table_name, 'quoteId', 'vendor', indexes={'BestRateIndex': ('quoteId', 'bestRate')})
+    store = quote_store.QuoteStore(table_name, 'quoteId', 'vendor', single_writer=True, rank_field='rate',
+                                   rank_index='BestRateIndex', shards=shards)
+    # every round each vendor quotes again, a batch carries the quotes of batch_size vendors
+    batches = queue.Queue()
+    for round_ in range(rounds):
+        for start in range(0, vendors, batch_size):
+            batches.put({(REQUEST_ID, f"{VENDOR_PREFIX}{vendor:05d}"): [{'rate': decimal.Decimal(f"{50 + (vendor * 7 + round_) % 100}.00"),
+                                                                          'terms': 'x' * quote_bytes}]
+                         for vendor in range(start, min(start + batch_size, vendors))})
+    pending = [batches.qsize()]
+    lock = threading.Lock()
+    aws.calls.reset()
+    throttled = aws.dynamodb.throttled[table_name]
+    written = aws.dynamodb.consumed(table_name)
+
+    def writer():
+        while True:
+            with lock:
+                if pending[0] == 0:
+                    return
+            try:
+                groups = batches.get(timeout=0.01)
+            except queue.Empty:
+                continue
+            failed = store.write(groups)
+            if failed:
+                # the records of the failed keys come back after the visibility timeout
+                time.sleep(redelivery)
+                batches.put({key: quotes for key, quotes in groups.items() if key in failed})
+            else:
+                with lock:
+                    pending[0] -= 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+    units = aws.dynamodb.consumed(table_name) - written
+    write_calls = aws.calls.total('dynamodb')
+
+    aws.calls.reset()
+    started = time.perf_counter()
+    quotes = store.read_partition(REQUEST_ID, VENDOR_PREFIX, consistent_read=True)
+    read_seconds = time.perf_counter() - started
+    best = store.best(REQUEST_ID)
+    return {
+        'shards': shards,
+        'writes': vendors * rounds,
+        'seconds': seconds,
+        'wcu/s': units / seconds,
+        'quotes/s': vendors * rounds / seconds,
+        'throttled': aws.dynamodb.throttled[table_name] - throttled,
+        'write calls': write_calls,
+        'read_ms': read_seconds * 1000,
+        'read calls': aws.calls.total('dynamodb'),
+        'vendors read': len(quotes),
+        'best rate': str(best[1]) if best else ''
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write throughput of a hot quote request with write sharding")
+    parser.add_argument('--shards', type=int, action='append', help='shard counts to measure (default: 1, 2, 4, 8). the throughput peaks at the smallest count '
+                             'that is not throttled, 4 with the defaults, and drops a little beyond it')
+    parser.add_argument('--vendors', type=int, default=500, help='vendors answering the request (default: 500)')
+    parser.add_argument('--rounds', type=int, default=4, help='quotes of every vendor (default: 4)')
+    parser.add_argument('--batch-size', type=int, default=10, help='vendor quotes per aggregator batch (default: 10)')
+    parser.add_argument('--writers', type=int, default=8, help='aggregator containers writing at once (default: 8)')
+    parser.add_argument('--quote-bytes', type=int, default=1500, help='size of the terms of a quote (default: 1500, 2 write units)')
+    parser.add_argument('--partition-capacity', type=float, default=1000,
+                        help='write units per second of a partition key value (default: 1000, the DynamoDB partition limit)')
+    parser.add_argument('--redelivery', type=float, default=0.05, help='seconds before a throttled batch is written again (default: 0.05)')
+    args = parser.parse_args()
+
+    # the quote store logs every throttled batch write
+    logging.getLogger().setLevel(logging.CRITICAL)
+    aws = LocalAWS()
+    aws.dynamodb.partition_write_capacity = args.partition_capacity
+    rows = []
+    with aws.install():
+        for shards in args.shards or [1, 2, 4, 8]:
+            rows.append(run(aws, shards, args.vendors, args.rounds, args.batch_size, args.writers, args.quote_bytes, args.redelivery))
+    print(format_table(rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: quote_store_benchmark.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Write cost of a hot quote request in the quote store layouts. Many writers (banks) append their quote to
+# the same request one by one, as the mortgage quote aggregator does, and the capacity units consumed by the
+# in-memory DynamoDB are reported per append: the list layout rewrites a growing item on every append until
+# it hits the item size limit, the compact layout writes a history item and at most the bounded top-k item.
+#
+# usage: python quote_store_benchmark.py --quotes 3000 --quote-bytes 200 --top-k 10
+import argparse
+import decimal
+import logging
+import random
+
+from aws_stand_ins import LocalAWS, _item_size
+from benchmark import format_table
+from lambda_loader import add_layer_path
+
+add_layer_path()
+import quote_store  # noqa: E402
+
+REQUEST_ID = 'hot-request'
+
+
+def checkpoints(quotes):
+    points = []
+    point = 10
+    while point < quotes:
+        points.append(point)
+        point *= 10
+    return points + [quotes]
+
+
+def run(aws, layout, quotes, quote_bytes, top_k, seed):
+    table_name = f"MortgageQuotes-{layout}"
+    history_table = f"MortgageQuoteHistory-{layout}"
+    aws.dynamodb.create_table(table_name, 'ID')
+    aws.dynamodb.create_table(history_table, 'ID', 'quote')
+    aws.calls.reset()
+    aws.dynamodb.capacity.clear()
+    if layout == quote_store.COMPACT:
+        store = quote_store.QuoteStore(table_name, 'ID', layout=layout, idempotency_field='bankId', rank_field='rate',
+                                       top_k=top_k, history_table=history_table, history_sort_key='quote')
+    else:
+        store = quote_store.QuoteStore(table_name, 'ID', layout=layout, idempotency_field='bankId')
+    rates = random.Random(seed)
+    rows = []
+    failed = 0
+    window = (0, 0, 0, 0)
+    for index in range(1, quotes + 1):
+        quote = {'bankId': f"Bank-{index:06d}", 'rate': decimal.Decimal(f"{rates.uniform(3, 9):.2f}"), 'terms': 'x' * quote_bytes}
+        failed += len(store.write({(REQUEST_ID,): [quote]}))
+        if index not in checkpoints(quotes):
+            continue
+        written = aws.dynamodb.consumed(kind='write')
+        read = aws.dynamodb.consumed(kind='read')
+        calls = aws.calls.total('dynamodb')
+        appends = index - window[0]
+        item = aws.dynamodb.items(table_name)
+        rows.append({
+            'layout': layout,
+            'quotes': index,
+            'wcu/append': (written - window[1]) / appends,
+            'rcu/append': (read - window[2]) / appends,
+            'calls/append': (calls - window[3]) / appends,
+            'item_kb': _item_size(item[0]) / 1024 if item else 0.0,
+            'failed appends': failed
+        })
+        window = (index, written, read, calls)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write cost of a hot quote request in the quote store layouts")
+    parser.add_argument('--layout', action='append', choices=[quote_store.LIST, quote_store.COMPACT],
+                        help='layout to measure (default: list and compact)')
+    parser.add_argument('--quotes', type=int, default=3000, help='quotes appended to the request (default: 3000)')
+    parser.add_argument('--quote-bytes', type=int, default=200, help='size of the terms of a quote (default: 200)')
+    parser.add_argument('--top-k', type=int, default=quote_store.TOP_K, help=f"quotes kept inline by the compact layout (default: {quote_store.TOP_K})")
+    parser.add_argument('--seed', type=int, default=1, help='seed of the quoted rates (default: 1)')
+    args = parser.parse_args()
+
+    # the list layout logs every append rejected for the size of its item
+    logging.getLogger().setLevel(logging.CRITICAL)
+    rows = []
+    # the handlers keep their clients for the life of the process, so the layouts share the stand-ins and
+    # every run counts from zero on tables of its own
+    aws = LocalAWS()
+    with aws.install():
+        for layout in args.layout or [quote_store.LIST, quote_store.COMPACT]:
+            rows.extend(run(aws, layout, args.quotes, args.quote_bytes, args.top_k, args.seed))
+    print(format_table(rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# File: replay.py
+# -----
+# Copyright (c) 2023 Amazon Web Services
+#
+# 2022 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and either
+# Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# Note:
+# THE SOFTWARE IS PROVIDED AS IS, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+###
+# Capture and replay of real event batches. The instrumented handlers log a sample of their events, redacted
+# (EVENT_CAPTURE_SAMPLE_RATE, shared/layer/python/instrumentation.py). "capture" collects them from CloudWatch
+# Logs or exported log lines into a JSONL file, "replay" runs them in their original order against the
+# handlers on the in-memory stand-ins, at the original pace or sped up, and reports the handler time and
+# the DynamoDB calls of every batch.
+#
+# usage: python replay.py capture --log-group /aws/lambda/<aggregator> --since 60 --output captures.jsonl
+#        python replay.py replay captures.jsonl --speed 10 [--env QUOTE_STORE_LAYOUT=compact] [--report batches.jsonl]
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import pathlib
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+import boto3
+
+from aws_stand_ins import CallCounter, LocalAWS, json_default
+from benchmark import MetricSink, format_table, latency_summary
+from lambda_loader import LambdaContext, add_layer_path, load_handler
+
+add_layer_path()
+import instrumentation  # noqa: E402
+
+IMPLEMENTATION = pathlib.Path(__file__).resolve().parents[2]
+SCATTER_GATHER = IMPLEMENTATION.joinpath("parallel-to-sns-scatter-gather")
+SCATTER_GATHER_LAMBDA = SCATTER_GATHER.joinpath("scatter_gather", "lambda_")
+QUOTE_AGGREGATOR = IMPLEMENTATION.joinpath("orchestration-to-choreography", "lambda", "choreography", "quoteAggregator.py")
+QUEUE_URL_PREFIX = 'https://sqs.local.amazonaws.com/000000000000'
+TOPIC_ARN_PREFIX = 'arn:aws:sns:local:000000000000'
+CAPTURE_MARKER = '{"EventCapture"'
+
+
+class Target:
+    """Handler a captured service is replayed with, and the environment of its function for the capture tags."""
+
+    def __init__(self, path, handler, environment):
+        self.path = path
+        self.handler = handler
+        self.environment = environment
+
+
+def gather_environment(context, tags):
+    return {
+        'QUOTE_TABLE_NAME': 'QuoteAggregatorTable',
+        'QUOTE_RANK_INDEX': 'BestRateIndex',
+        'EXPECTED_VENDORS': ','.join(context['car_rentals']),
+        'RESULT_TOPIC_ARN': f"{TOPIC_ARN_PREFIX}:quotes-topic",
+        'DEAD_LETTER_QUEUE_URL': f"{QUEUE_URL_PREFIX}/dead-letters",
+        'SCATTER_GATHER_DESIGN': 'sns'
+    }
+
+
+# the responder of a vendor gets the vendor settings of car_rentals, the responder for any vendor none
+def responder_environment(context, tags):
+    vendor = tags.get('vendor')
+    if vendor is None:
+        return {}
+    if vendor not in context['car_rentals']:
+        raise ValueError(f"vendor {vendor} of a captured responder event is not in car_rentals")
+    return dict(context['car_rentals'][vendor], vendor=vendor,
+                QUOTE_QUEUE_URL=f"{QUEUE_URL_PREFIX}/sqs-aggregator", DEAD_LETTER_QUEUE_URL=f"{QUEUE_URL_PREFIX}/dead-letters")
+
+
+def quote_aggregator_environment(context, tags):
+    return {
+        'QUOTE_TABLE_NAME': 'MortgageQuotes',
+        'QUOTE_HISTORY_TABLE_NAME': 'MortgageQuoteHistory',
+        'METRICS_NAMESPACE': 'MortgageQuotes',
+        'DEAD_LETTER_QUEUE_URL': f"{QUEUE_URL_PREFIX}/dead-letters"
+    }
+
+
+# captured services (the name given to instrumentation.handler) and what they are replayed with
+TARGETS = {
+    'aggregator': Target(SCATTER_GATHER_LAMBDA.joinpath("aggregator", "app.py"), 'lambda_handler', gather_environment),
+    'gather-deadline': Target(SCATTER_GATHER_LAMBDA.joinpath("aggregator", "app.py"), 'deadline_handler', gather_environment),
+    'quote-reader': Target(SCATTER_GATHER_LAMBDA.joinpath("aggregator", "app.py"), 'reader_handler', gather_environment),
+    'responder': Target(SCATTER_GATHER_LAMBDA.joinpath("responder", "app.py"), 'lambda_handler', responder_environment),
+    'QuoteAggregator': Target(QUOTE_AGGREGATOR, 'lambda_handler', quote_aggregator_environment),
+}
+
+
+def create_resources(aws):
+    aws.dynamodb.create_table('QuoteAggregatorTable', 'quoteId', 'vendor', indexes={'BestRateIndex': ('quoteId', 'bestRate')})
+    aws.dynamodb.create_table('MortgageQuotes', 'ID')
+    aws.dynamodb.create_table('MortgageQuoteHistory', 'ID', 'quote')
+    for name in ('sqs-aggregator', 'dead-letters'):
+        aws.queue(name)
+
+
+class BatchCalls(CallCounter):
+    """Call counter that also counts the calls of the batch running on the current thread."""
+
+    def __init__(self):
+        super().__init__()
+        self._local = threading.local()
+
+    def add(self, service, operation, count=1):
+        super().add(service, operation, count)
+        counts = getattr(self._local, 'counts', None)
+        if counts is not None:
+            counts[(service, operation)] += count
+
+    @contextlib.contextmanager
+    def batch(self):
+        self._local.counts = Counter()
+        try:
+            yield self._local.counts
+        finally:
+            self._local.counts = None
+
+
+class Containers:
+    """Warm handler modules per function, a batch arriving while every container is busy loads a new one."""
+
+    def __init__(self, context, overrides):
+        self.context = context
+        self.overrides = overrides
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def acquire(self, service, tags):
+        key = (service, json.dumps(tags, sort_keys=True))
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            module = idle.pop() if idle else None
+        if module is None:
+            target = TARGETS[service]
+            module = load_handler(target.path, dict(target.environment(self.context, tags), **self.overrides))
+        try:
+            yield getattr(module, TARGETS[service].handler)
+        finally:
+            with self._lock:
+                self._idle[key].append(module)
+
+
+# ------------------------------------------------------------------------------------------------
+# capture
+# ------------------------------------------------------------------------------------------------
+
+# the captures in log lines, a line of an export may carry a timestamp or request id before the JSON
+def read_captures(lines):
+    for line in lines:
+        start = line.find(CAPTURE_MARKER)
+        if start < 0:
+            continue
+        try:
+            yield json.loads(line[start:])['EventCapture']
+        except (KeyError, ValueError):
+            continue
+
+
+def log_lines(log_group, since_minutes):
+    logs = boto3.client('logs')
+    start = int((time.time() - since_minutes * 60) * 1000)
+    for page in logs.get_paginator('filter_log_events').paginate(logGroupName=log_group, startTime=start,
+                                                                 filterPattern='"EventCapture"'):
+        for event in page['events']:
+            yield event['message']
+
+
+def capture(args):
+    captures = []
+    for log_group in args.log_group or []:
+        captures.extend(read_captures(log_lines(log_group, args.since)))
+    for path in getattr(args, 'from') or []:
+        with (contextlib.nullcontext(sys.stdin) if path == '-' else open(path)) as lines:
+            captures.extend(read_captures(lines))
+    sample = random.Random(args.seed)
+    captures = [record for record in captures if args.sample >= 1 or sample.random() < args.sample]
+    # fields redacted here on top of those the functions redacted (EVENT_CAPTURE_REDACT)
+    if args.redact:
+        captures = [dict(record, Event=instrumentation.redact(record['Event'], frozenset(args.redact))) for record in captures]
+    captures.sort(key=lambda record: record['Timestamp'])
+    with (contextlib.nullcontext(sys.stdout) if args.output == '-' else open(args.output, 'w')) as output:
+        for record in captures:
+            output.write(json.dumps(record, default=json_default) + '\n')
+    print(f"captured {len(captures)} events of {dict(Counter(record['Service'] for record in captures))}", file=sys.stderr)
+
+
+# ------------------------------------------------------------------------------------------------
+# replay
+# ------------------------------------------------------------------------------------------------
+
+def run_batch(index, record, containers, calls):
+    event = record['Event']
+    row = {'batch': index, 'service': record['Service'], 'vendor': record.get('Tags', {}).get('vendor') or '',
+           'records': len(event.get('Records', [])) if isinstance(event, dict) and 'Records' in event else 1}
+    with containers.acquire(record['Service'], record.get('Tags', {})) as handler, calls.batch() as counts:
+        started = time.perf_counter()
+        try:
+            response = handler(event, LambdaContext(f"replay-{record['Service']}"))
+        except Exception as error:
+            response = None
+            row['error'] = type(error).__name__
+        row['handler_ms'] = (time.perf_counter() - started) * 1000
+    row['ddb calls'] = sum(count for (service, _), count in counts.items() if service == 'dynamodb')
+    row['ddb operations'] = ' '.join(f"{operation}={count}" for (service, operation), count in sorted(counts.items()) if service == 'dynamodb')
+    row['failed'] = len(response.get('batchItemFailures', [])) if isinstance(response, dict) else 0
+    return row
+
+
+def summary(rows):
+    services = {}
+    for row in rows:
+        services.setdefault(row['service'], []).append(row)
+    result = []
+    for service, batches in services.items():
+        item = {'service': service, 'batches': len(batches), 'records': sum(row['records'] for row in batches)}
+        item.update(latency_summary([row['handler_ms'] / 1000.0 for row in batches]))
+        item['ddb calls/batch'] = sum(row['ddb calls'] for row in batches) / len(batches)
+        item['failed'] = sum(row['failed'] for row in batches)
+        item['errors'] = sum(1 for row in batches if row.get('error'))
+        result.append(item)
+    return result
+
+
+def replay(args):
+    with open(args.captures) as lines:
+        captures = [json.loads(line) for line in lines if line.strip()]
+    captures = [record for record in captures if not args.service or record['Service'] in args.service]
+    unknown = {record['Service'] for record in captures} - set(TARGETS)
+    if unknown:
+        print(f"skipping the events of {', '.join(sorted(unknown))}, no replay target", file=sys.stderr)
+        captures = [record for record in captures if record['Service'] in TARGETS]
+    if not captures:
+        sys.exit("no captured events to replay")
+    captures.sort(key=lambda record: record['Timestamp'])
+    context = json.loads(pathlib.Path(args.cdk_json).read_text())['context']
+    overrides = dict(setting.split('=', 1) for setting in args.env or [])
+
+    calls = BatchCalls()
+    aws = LocalAWS(calls=calls)
+    create_resources(aws)
+    containers = Containers(context, overrides)
+    sink = MetricSink()
+    rows = []
+    with aws.install(), contextlib.redirect_stdout(sink), \
+            concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = []
+        first = captures[0]['Timestamp']
+        started = time.monotonic()
+        for index, record in enumerate(captures):
+            # the batches arrive as they were captured, --speed 0 sends them back to back
+            if args.speed > 0:
+                delay = (record['Timestamp'] - first) / 1000.0 / args.speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(executor.submit(run_batch, index, record, containers, calls))
+        rows = [future.result() for future in futures]
+
+    if args.report:
+        with open(args.report, 'w') as report:
+            for row in rows:
+                report.write(json.dumps(row) + '\n')
+    if not args.quiet:
+        print(format_table(rows, ['batch', 'service', 'vendor', 'records', 'handler_ms', 'ddb calls', 'ddb operations', 'failed', 'error']))
+        print()
+    print(format_table(summary(rows)))
+    print(f"\nconsumed {aws.dynamodb.consumed(kind='write'):,.1f} write units, {aws.dynamodb.consumed(kind='read'):,.1f} read units")
+    if args.stages:
+        print()
+        print(format_table(sink.stage_summary('replay')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture and replay of real event batches against the handlers")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    capture_parser = commands.add_parser('capture', help='collect the captured events from CloudWatch Logs or log files into JSONL')
+    capture_parser.add_argument('--log-group', action='append', help='log group of a function with EVENT_CAPTURE_SAMPLE_RATE set (repeatable)')
+    capture_parser.add_argument('--since', type=float, default=60, help='minutes of logs to read from the log groups (default: 60)')
+    capture_parser.add_argument('--from', action='append', metavar='FILE', help="exported log lines, '-' for stdin (repeatable)")
+    capture_parser.add_argument('--sample', type=float, default=1.0, help='share of the captured events to keep (default: 1)')
+    capture_parser.add_argument('--seed', type=int, default=1, help='seed of the sample (default: 1)')
+    capture_parser.add_argument('--redact', action='append', metavar='FIELD', help='another field to redact in the events (repeatable)')
+    capture_parser.add_argument('--output', default='-', help="JSONL file of the captures (default: stdout)")
+
+    replay_parser = commands.add_parser('replay', help='replay captured events against the handlers on the local stand-ins')
+    replay_parser.add_argument('captures', help='JSONL file written by capture')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help='multiple of the captured pace, 0 for back to back (default: 1)')
+    replay_parser.add_argument('--concurrency', type=int, default=10, help='batches handled at once, 1 replays one by one (default: 10)')
+    replay_parser.add_argument('--service', action='append', choices=sorted(TARGETS), help='replay only the events of this service (repeatable)')
+    replay_parser.add_argument('--env', action='append', metavar='KEY=VALUE', help='environment variable of every replayed function (repeatable)')
+    replay_parser.add_argument('--cdk-json', default=str(SCATTER_GATHER.joinpath("cdk.json")), help='cdk.json with the car_rentals of the responders')
+    replay_parser.add_argument('--report', help='JSONL file for the rows of the batches, to compare replays')
+    replay_parser.add_argument('--stages', action='store_true', help='also print the latency per stage from the embedded metrics of the handlers')
+    replay_parser.add_argument('--quiet', action='store_true', help='print the summary only, without a row per batch')
+    args = parser.parse_args()
+
+    if args.command == 'capture':
+        capture(args)
+    else:
+        replay(args)
+
+
+if __name__ == '__main__':
+    main()